@@ -1,20 +1,31 @@
-app.py
+import io
 import os
 import streamlit as st
 import pandas as pd
 from datetime import date
 from dateutil.parser import parse as dtparse
 
-from src.auth import require_login
+from src.auth import require_login, admin_login
 from src.db import (
     init_db, get_items, add_item, get_locations, add_location,
-    get_lots, add_lot, get_inventory, upsert_inventory_delta,
-    add_movement, get_movements, get_documents_for_movement,
-    add_document, get_document_blob
+    get_lots, add_lot, get_inventory, get_inventory_as_of, book_movement, book_movements, BookingError, get_master_index,
+    get_stock_totals, get_stock_by_item, get_stock_by_location,
+    allocate_fefo, book_fefo, get_expiry_watchlist, get_expiry_summary,
+    reserve_stock, commit_reservation, release_reservation, expire_reservations, get_reservations,
+    RESERVATION_TTL_MINUTES,
+    query_movements, search_movements, get_movement_report, get_documents_for_movement,
+    get_archive_cutoff, get_archive_info
 )
-from src.storage import save_upload
+from src.storage import save_upload, open_document, build_zip
+from src.importer import import_csv, write_rejects, ImportFileError
+from src.export import export_movements, export_inventory, write_chunks, FORMATS as EXPORT_FORMATS
+from src.ledger import check_ledger, get_checkpoint
+from src.archive import verify_archive
+from src.backup import backup, verify_backup, list_backups, backup_dir, BackupError
+from src import tracing
 
 st.set_page_config(page_title="Lager & Versand", layout="wide")
+trace = tracing.start_rerun()
 
 DATA_DIR = st.secrets.get("DATA_DIR", "data")
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -22,6 +33,7 @@ os.makedirs(DATA_DIR, exist_ok=True)
 init_db(DATA_DIR)
 
 require_login()
+IS_ADMIN = admin_login()
 
 st.title("📦 Lager & Versand")
 
@@ -32,7 +44,7 @@ tabs = st.tabs([
     "Versand (OUT)",
     "Bewegungen & Dokumente",
     "Reports"
-])
+] + (["Admin"] if IS_ADMIN else []))
 
 def _num(x):
     try:
@@ -47,23 +59,117 @@ def _as_date(s):
         return s
     return dtparse(str(s)).date()
 
+# Ab so vielen Optionen zeigt ein Auswahlfeld nur Suchtreffer statt der ganzen Liste
+TYPEAHEAD_THRESHOLD = 500
+TYPEAHEAD_LIMIT = 100
+
+def _master_options(idx, kind, label, key):
+    """Optionen (IDs) für ein Stammdaten-Auswahlfeld.
+    Muss außerhalb von st.form stehen, damit die Suche sofort wirkt."""
+    ids = idx.ids(kind)
+    if len(ids) <= TYPEAHEAD_THRESHOLD:
+        return ids
+    term = st.text_input(f"{label} suchen", key=f"{key}_search",
+                         placeholder=f"{len(ids)} Einträge – Suchbegriff eingeben")
+    return idx.search(kind, term, TYPEAHEAD_LIMIT)
+
+BATCH_ROWS = 10
+
+def _batch_editor(key, label_columns):
+    """Raster für Sammelbuchungen: je Zeile Auswahl-Spalten plus Paletten/Koli.
+    label_columns: {Spaltenname: Liste der Labels}."""
+    empty = pd.DataFrame({**{c: pd.Series([None] * BATCH_ROWS, dtype="object") for c in label_columns},
+                          "Paletten": [0] * BATCH_ROWS, "Koli": [0] * BATCH_ROWS})
+    config = {c: st.column_config.SelectboxColumn(c, options=opts, width="large") for c, opts in label_columns.items()}
+    config["Paletten"] = st.column_config.NumberColumn("Paletten", min_value=0, step=1)
+    config["Koli"] = st.column_config.NumberColumn("Koli", min_value=0, step=1)
+    return st.data_editor(empty, key=key, num_rows="dynamic", hide_index=True,
+                          use_container_width=True, column_config=config)
+
+def _filled_rows(df, label_cols):
+    """Nur Zeilen, in denen etwas eingetragen wurde."""
+    def qty(v):
+        return 0 if pd.isna(v) else int(v)
+    for _, r in df.iterrows():
+        if all(pd.isna(r[c]) for c in label_cols) and qty(r["Paletten"]) == 0 and qty(r["Koli"]) == 0:
+            continue
+        yield r, qty(r["Paletten"]), qty(r["Koli"])
+
+# Exporte bis zu dieser Größe direkt im Browser anbieten (download_button hält die Datei im Speicher)
+EXPORT_DOWNLOAD_LIMIT = 64 * 1024 * 1024
+
+def _export_panel(key, basename, make_chunks):
+    """Export als Datei unter DATA_DIR/exports (gestreamt geschrieben) plus Download."""
+    e1, e2 = st.columns([1, 3])
+    fmt = e1.radio("Format", list(EXPORT_FORMATS), horizontal=True, key=f"{key}_fmt")
+    if e2.button("Export erstellen", key=f"{key}_run"):
+        name = f"{basename}_{date.today().isoformat()}{EXPORT_FORMATS[fmt][1]}"
+        path = os.path.join(DATA_DIR, "exports", name)
+        with st.spinner("Export läuft …"):
+            size = write_chunks(make_chunks(fmt), path)
+        st.session_state[key] = (path, fmt, size)
+    done = st.session_state.get(key)
+    if done:
+        path, fmt, size = done
+        st.caption(f"{os.path.basename(path)}: {size / 2**20:.1f} MiB, gespeichert unter {path}")
+        if size <= EXPORT_DOWNLOAD_LIMIT and os.path.exists(path):
+            with open(path, "rb") as f:
+                st.download_button("⬇️ Export herunterladen", data=f.read(), file_name=os.path.basename(path),
+                                   mime=EXPORT_FORMATS[fmt][0], key=f"{key}_dl")
+        else:
+            st.info("Zu groß für den Browser-Download – Datei direkt vom Server holen "
+                    "(oder per `python -m src.cli export` bzw. API `/exports/...`).")
+
 # ---------------- Dashboard ----------------
-with tabs[0]:
+with tabs[0], tracing.section("Dashboard"):
     st.subheader("Aktueller Bestand (nach Charge & Lagerplatz)")
-    inv = get_inventory(DATA_DIR)
-    if inv.empty:
+    totals = get_stock_totals(DATA_DIR)
+    if not totals["positionen"]:
         st.info("Noch kein Bestand vorhanden. Lege Stammdaten an und buche Wareneingang.")
     else:
-        # kleine Kennzahlen
+        # kleine Kennzahlen (aus den Bestandssummen, ohne den Bestand zu laden)
         c1, c2, c3 = st.columns(3)
-        c1.metric("Positionen (Zeilen)", int(len(inv)))
-        c2.metric("Summe Paletten", int(inv["paletten"].sum()))
-        c3.metric("Summe Koli", int(inv["koli"].sum()))
-
-        st.dataframe(inv, use_container_width=True, hide_index=True)
+        c1.metric("Positionen (Zeilen)", totals["positionen"])
+        c2.metric("Summe Paletten", totals["paletten"])
+        c3.metric("Summe Koli", totals["koli"])
+
+        group = st.selectbox("Summen je", ["–", "Artikel", "Lagerplatz"], key="stock_group")
+        if group == "Artikel":
+            st.dataframe(get_stock_by_item(DATA_DIR), use_container_width=True, hide_index=True)
+        elif group == "Lagerplatz":
+            st.dataframe(get_stock_by_location(DATA_DIR), use_container_width=True, hide_index=True)
+
+        # Detailtabelle nur auf Wunsch laden
+        if st.toggle("Detailtabelle anzeigen (Charge & Lagerplatz)", key="stock_detail"):
+            inv = get_inventory(DATA_DIR)
+            st.dataframe(inv, use_container_width=True, hide_index=True)
+        with st.expander("Bestand exportieren (CSV/JSONL)"):
+            _export_panel("exp_inv", "bestand", lambda fmt: export_inventory(DATA_DIR, fmt))
+
+    st.markdown("### MHD-Warnliste")
+    summary = get_expiry_summary(DATA_DIR, date.today())
+    for col, r in zip(st.columns(len(summary)), summary.itertuples()):
+        col.metric(r.stufe, f"{r.positionen} Pos.", f"{r.paletten} Pal / {r.koli} Koli", delta_color="off")
+    watch_stufe = st.selectbox("Details anzeigen", ["–"] + list(summary["stufe"]), key="watch_stufe")
+    if watch_stufe != "–":
+        watch = get_expiry_watchlist(DATA_DIR, date.today())
+        watch = watch[watch["stufe"] == watch_stufe].drop(columns=["stufe"])
+        if watch.empty:
+            st.info("Keine Positionen in dieser Stufe.")
+        else:
+            st.dataframe(watch, use_container_width=True, hide_index=True)
+
+    st.markdown("### Bestand zum Stichtag")
+    as_of = st.date_input("Stichtag (Bestand bei Tagesende)", value=None, key="as_of")
+    if as_of:
+        hist = get_inventory_as_of(DATA_DIR, as_of)
+        if hist.empty:
+            st.info("Zu diesem Stichtag war kein Bestand vorhanden.")
+        else:
+            st.dataframe(hist, use_container_width=True, hide_index=True)
 
 # ---------------- Stammdaten ----------------
-with tabs[1]:
+with tabs[1], tracing.section("Stammdaten"):
     st.subheader("Stammdaten")
     colA, colB, colC = st.columns(3)
 
@@ -103,36 +209,67 @@ with tabs[1]:
         st.markdown("### Chargen (mit MHD)")
         lots = get_lots(DATA_DIR)
         st.dataframe(lots, use_container_width=True, hide_index=True)
-        with st.form("add_lot", clear_on_submit=True):
-            items = get_items(DATA_DIR)
-            if items.empty:
-                st.warning("Bitte zuerst mindestens einen Artikel anlegen.")
-                st.stop()
-            item_id = st.selectbox("Artikel", items["id"], format_func=lambda i: f'{items.loc[items["id"]==i,"sku"].values[0]} – {items.loc[items["id"]==i,"name"].values[0]}')
-            batch = st.text_input("Charge", placeholder="z.B. CH-2026-02-001")
-            mhd = st.date_input("MHD", value=None)
-            submitted = st.form_submit_button("Charge anlegen")
-            if submitted:
-                if not batch:
-                    st.error("Bitte Charge ausfüllen.")
+        idx = get_master_index(DATA_DIR)
+        item_opts = _master_options(idx, "item", "Artikel", "lot_item")
+        if not idx.ids("item"):
+            # kein st.stop(): Massenimport und die übrigen Tabs sollen trotzdem erscheinen
+            st.warning("Bitte zuerst mindestens einen Artikel anlegen.")
+        else:
+            with st.form("add_lot", clear_on_submit=True):
+                item_id = st.selectbox("Artikel", item_opts, format_func=idx.item_label)
+                batch = st.text_input("Charge", placeholder="z.B. CH-2026-02-001")
+                mhd = st.date_input("MHD", value=None)
+                submitted = st.form_submit_button("Charge anlegen")
+                if submitted:
+                    if not batch or item_id is None:
+                        st.error("Bitte Artikel wählen und Charge ausfüllen.")
+                    else:
+                        add_lot(DATA_DIR, int(item_id), batch.strip(), mhd)
+                        st.success("Charge angelegt.")
+                        st.rerun()
+
+    st.markdown("### CSV-Massenimport")
+    st.caption(
+        "Spalten (Kopfzeile): Artikel `sku,name` · Lagerplätze `code,description` · "
+        "Chargen `sku,batch,mhd` · Anfangsbestand `sku,batch,mhd,location,paletten,koli`"
+    )
+    with st.form("csv_import", clear_on_submit=True):
+        kinds = {"items": "Artikel", "locations": "Lagerplätze", "lots": "Chargen", "stock": "Anfangsbestand"}
+        kind = st.selectbox("Importtyp", list(kinds), format_func=kinds.get)
+        csv_file = st.file_uploader("CSV-Datei", type=["csv", "txt"])
+        submitted = st.form_submit_button("Importieren")
+        if submitted:
+            if csv_file is None:
+                st.error("Bitte eine CSV-Datei wählen.")
+            else:
+                try:
+                    result = import_csv(DATA_DIR, kind, io.TextIOWrapper(csv_file, encoding="utf-8-sig", newline=""))
+                except (ImportFileError, UnicodeDecodeError) as e:
+                    st.error(f"Import abgebrochen: {e}")
                 else:
-                    add_lot(DATA_DIR, int(item_id), batch.strip(), mhd)
-                    st.success("Charge angelegt.")
-                    st.rerun()
+                    st.session_state["import_result"] = result
+    result = st.session_state.get("import_result")
+    if result is not None:
+        (st.warning if result.rejected else st.success)(result.summary())
+        if result.rejects:
+            buf = io.StringIO()
+            write_rejects(result, buf)
+            st.download_button("⬇️ Abgelehnte Zeilen als CSV", data=buf.getvalue().encode("utf-8"),
+                               file_name=f"import_{result.kind}_abgelehnt.csv", mime="text/csv")
 
 # ---------------- Wareneingang ----------------
-with tabs[2]:
+with tabs[2], tracing.section("Wareneingang (IN)"):
     st.subheader("Wareneingang (IN)")
-    items = get_items(DATA_DIR)
-    locs = get_locations(DATA_DIR)
-    lots = get_lots(DATA_DIR)
+    idx = get_master_index(DATA_DIR)
 
-    if items.empty or locs.empty or lots.empty:
+    if not (idx.ids("item") and idx.ids("location") and idx.ids("lot")):
         st.warning("Bitte zuerst Stammdaten anlegen: Artikel, Lagerplätze und Chargen.")
     else:
+        lot_opts = _master_options(idx, "lot", "Charge", "in_lot")
+        loc_opts = _master_options(idx, "location", "Lagerplatz", "in_loc")
         with st.form("in_form", clear_on_submit=True):
-            lot_id = st.selectbox("Charge wählen", lots["id"], format_func=lambda i: f'{lots.loc[lots["id"]==i,"sku"].values[0]} | Charge {lots.loc[lots["id"]==i,"batch"].values[0]} | MHD {lots.loc[lots["id"]==i,"mhd"].values[0]}')
-            location_id = st.selectbox("Lagerplatz", locs["id"], format_func=lambda i: f'{locs.loc[locs["id"]==i,"code"].values[0]}')
+            lot_id = st.selectbox("Charge wählen", lot_opts, format_func=idx.lot_label)
+            location_id = st.selectbox("Lagerplatz", loc_opts, format_func=idx.location_label)
             pal = st.number_input("Paletten", min_value=0, step=1, value=0)
             koli = st.number_input("Koli", min_value=0, step=1, value=0)
             partner = st.text_input("Lieferant/Quelle (optional)")
@@ -141,21 +278,50 @@ with tabs[2]:
             move_date = st.date_input("Buchungsdatum", value=date.today())
             submitted = st.form_submit_button("Wareneingang buchen")
             if submitted:
-                if pal == 0 and koli == 0:
+                if lot_id is None or location_id is None:
+                    st.error("Bitte Charge und Lagerplatz wählen.")
+                elif pal == 0 and koli == 0:
                     st.error("Bitte mindestens Paletten oder Koli > 0 eingeben.")
                 else:
-                    mv_id = add_movement(DATA_DIR, "IN", int(lot_id), int(location_id), int(pal), int(koli),
-                                        partner.strip(), reference.strip(), notes.strip(), move_date)
-                    upsert_inventory_delta(DATA_DIR, int(lot_id), int(location_id), int(pal), int(koli))
+                    mv_id = book_movement(DATA_DIR, "IN", int(lot_id), int(location_id), int(pal), int(koli),
+                                          partner.strip(), reference.strip(), notes.strip(), move_date)
                     st.success(f"Wareneingang gebucht (ID {mv_id}).")
                     st.rerun()
 
+        with st.expander("Sammelbuchung (mehrere Positionen, z.B. eine LKW-Ladung)"):
+            lot_by_label = {idx.lot_label(i): i for i in lot_opts}
+            loc_by_label = {idx.location_label(i): i for i in loc_opts}
+            with st.form("in_batch_form", clear_on_submit=True):
+                grid = _batch_editor("in_batch_grid", {"Charge": list(lot_by_label), "Lagerplatz": list(loc_by_label)})
+                partner = st.text_input("Lieferant/Quelle (optional)", key="in_batch_partner")
+                reference = st.text_input("Referenz (optional)", key="in_batch_ref")
+                notes = st.text_area("Notizen (optional)", key="in_batch_notes")
+                move_date = st.date_input("Buchungsdatum", value=date.today(), key="in_batch_date")
+                submitted = st.form_submit_button("Alle Positionen buchen")
+                if submitted:
+                    lines, problems = [], []
+                    for n, (r, p, k) in enumerate(_filled_rows(grid, ["Charge", "Lagerplatz"]), start=1):
+                        if r["Charge"] not in lot_by_label or r["Lagerplatz"] not in loc_by_label:
+                            problems.append(f"Position {n}: Charge und Lagerplatz wählen.")
+                        else:
+                            lines.append((lot_by_label[r["Charge"]], loc_by_label[r["Lagerplatz"]], p, k))
+                    if problems:
+                        st.error(" ".join(problems))
+                    else:
+                        try:
+                            ids = book_movements(DATA_DIR, "IN", lines, partner.strip(), reference.strip(),
+                                                 notes.strip(), move_date)
+                        except BookingError as e:
+                            st.error(str(e))
+                        else:
+                            st.success(f"{len(ids)} Positionen gebucht.")
+                            st.rerun()
+
 # ---------------- Versand (OUT) ----------------
-with tabs[3]:
+with tabs[3], tracing.section("Versand (OUT)"):
     st.subheader("Versand (OUT)")
+    expire_reservations(DATA_DIR)
     inv = get_inventory(DATA_DIR)
-    locs = get_locations(DATA_DIR)
-    lots = get_lots(DATA_DIR)
 
     if inv.empty:
         st.info("Kein Bestand vorhanden.")
@@ -163,18 +329,31 @@ with tabs[3]:
         st.dataframe(inv, use_container_width=True, hide_index=True)
 
         st.markdown("### Versand buchen + Dokumente anhängen")
+        # Auswahl anhand Inventory-Zeilen, damit nur vorhandene Kombinationen versendbar sind
+        inv_rows = inv.copy()
+        inv_rows["label"] = (
+            inv_rows["sku"] + " | " +
+            "Charge " + inv_rows["batch"].astype(str) + " | " +
+            "MHD " + inv_rows["mhd"].astype(str) + " | " +
+            "Platz " + inv_rows["lagerplatz"].astype(str) + " | " +
+            "frei: " + inv_rows["frei_paletten"].astype(str) + " Pal / " + inv_rows["frei_koli"].astype(str) + " Koli"
+        )
+        reserved = (inv_rows["reserviert_paletten"] != 0) | (inv_rows["reserviert_koli"] != 0)
+        inv_rows.loc[reserved, "label"] += (
+            " (reserviert " + inv_rows["reserviert_paletten"].astype(str) + " Pal / " +
+            inv_rows["reserviert_koli"].astype(str) + " Koli)"
+        )
+        inv_labels = dict(zip(inv_rows.index, inv_rows["label"]))
+        inv_opts = list(inv_labels)
+        if len(inv_opts) > TYPEAHEAD_THRESHOLD:
+            term = st.text_input("Bestand suchen", key="out_inv_search",
+                                 placeholder=f"{len(inv_opts)} Positionen – Suchbegriff eingeben")
+            hits = inv_rows["label"].str.contains(term.strip(), case=False, regex=False) if term.strip() else None
+            inv_opts = list((inv_rows.index[hits] if hits is not None else inv_rows.index)[:TYPEAHEAD_LIMIT])
+
         with st.form("out_form", clear_on_submit=True):
-            # Auswahl anhand Inventory-Zeilen, damit nur vorhandene Kombinationen versendbar sind
-            inv_rows = inv.copy()
-            inv_rows["label"] = (
-                inv_rows["sku"] + " | " +
-                "Charge " + inv_rows["batch"].astype(str) + " | " +
-                "MHD " + inv_rows["mhd"].astype(str) + " | " +
-                "Platz " + inv_rows["lagerplatz"].astype(str) + " | " +
-                "Bestand: " + inv_rows["paletten"].astype(str) + " Pal / " + inv_rows["koli"].astype(str) + " Koli"
-            )
-            chosen = st.selectbox("Aus Bestand auswählen", inv_rows.index, format_func=lambda i: inv_rows.loc[i,"label"])
-            row = inv_rows.loc[chosen]
+            chosen = st.selectbox("Aus Bestand auswählen", inv_opts, format_func=inv_labels.get)
+            row = inv_rows.loc[chosen] if chosen is not None else None
 
             pal = st.number_input("Paletten zu senden", min_value=0, step=1, value=0)
             koli = st.number_input("Koli zu senden", min_value=0, step=1, value=0)
@@ -186,62 +365,236 @@ with tabs[3]:
 
             uploads = st.file_uploader("Dokumente (PDF/JPG/PNG) – mehrere möglich", accept_multiple_files=True)
 
-            submitted = st.form_submit_button("Versand buchen")
-            if submitted:
-                if (pal == 0 and koli == 0) or not receiver.strip():
+            c1, c2 = st.columns(2)
+            submitted = c1.form_submit_button("Versand buchen")
+            reserve = c2.form_submit_button("Nur reservieren",
+                                            help=f"Hält die Menge {RESERVATION_TTL_MINUTES} Minuten für den "
+                                                 "Empfänger zurück; gebucht wird unter „Reservierungen“.")
+            if submitted or reserve:
+                if row is None:
+                    st.error("Bitte eine Bestandsposition wählen.")
+                elif (pal == 0 and koli == 0) or not receiver.strip():
                     st.error("Bitte Paletten/Koli > 0 und Empfänger angeben.")
                 else:
-                    # Bestand prüfen
-                    if pal > int(row["paletten"]) or koli > int(row["koli"]):
-                        st.error("Nicht genug Bestand für diese Charge/Lagerplatz.")
+                    # Vorprüfung gegen den freien Bestand; verbindlich prüft die Buchung selbst
+                    if pal > int(row["frei_paletten"]) or koli > int(row["frei_koli"]):
+                        st.error("Nicht genug freier Bestand (ohne Reservierungen) für diese Charge/Lagerplatz.")
+                    elif reserve:
+                        try:
+                            res_id = reserve_stock(DATA_DIR, int(row["lot_id"]), int(row["location_id"]),
+                                                   int(pal), int(koli), receiver.strip(), reference.strip())
+                        except BookingError as e:
+                            st.error(str(e))
+                        else:
+                            st.success(f"Reserviert (Nr. {res_id}) für {RESERVATION_TTL_MINUTES} Minuten.")
+                            st.rerun()
                     else:
-                        mv_id = add_movement(
-                            DATA_DIR, "OUT", int(row["lot_id"]), int(row["location_id"]),
-                            int(pal), int(koli), receiver.strip(), reference.strip(), notes.strip(), move_date
-                        )
-                        upsert_inventory_delta(DATA_DIR, int(row["lot_id"]), int(row["location_id"]), -int(pal), -int(koli))
-
-                        # Dokumente speichern
-                        saved = 0
-                        if uploads:
-                            for uf in uploads:
-                                stored_path, mime, size = save_upload(DATA_DIR, uf)
-                                add_document(DATA_DIR, mv_id, uf.name, stored_path, mime, size)
-                                saved += 1
-
-                        st.success(f"Versand gebucht (ID {mv_id}). Dokumente gespeichert: {saved}.")
-                        st.rerun()
+                        # Dokumente zuerst ablegen, dann alles in einer Transaktion buchen
+                        docs = []
+                        for uf in uploads or []:
+                            stored_path, mime, size, sha = save_upload(DATA_DIR, uf)
+                            docs.append((uf.name, stored_path, mime, size, sha))
+
+                        try:
+                            mv_id = book_movement(
+                                DATA_DIR, "OUT", int(row["lot_id"]), int(row["location_id"]),
+                                int(pal), int(koli), receiver.strip(), reference.strip(), notes.strip(), move_date,
+                                documents=docs
+                            )
+                        except BookingError as e:
+                            st.error(str(e))
+                        else:
+                            st.success(f"Versand gebucht (ID {mv_id}). Dokumente gespeichert: {len(docs)}.")
+                            st.rerun()
+
+        open_res = get_reservations(DATA_DIR)
+        with st.expander(f"Reservierungen ({len(open_res)} offen)"):
+            if open_res.empty:
+                st.caption("Keine offenen Reservierungen.")
+            else:
+                st.dataframe(open_res.drop(columns=["lot_id", "location_id", "movement_id"]),
+                             use_container_width=True, hide_index=True)
+                res_labels = dict(zip(open_res["id"], "Nr. " + open_res["id"].astype(str) + " | " +
+                                      open_res["sku"] + " | Platz " + open_res["lagerplatz"] + " | " +
+                                      open_res["paletten"].astype(str) + " Pal / " + open_res["koli"].astype(str) +
+                                      " Koli | " + open_res["partner"].fillna("")))
+                with st.form("out_res_form"):
+                    res_id = st.selectbox("Reservierung", list(res_labels), format_func=res_labels.get)
+                    move_date = st.date_input("Versanddatum", value=date.today(), key="out_res_date")
+                    notes = st.text_input("Notizen (optional)", key="out_res_notes")
+                    c1, c2 = st.columns(2)
+                    commit = c1.form_submit_button("Reservierung buchen")
+                    release = c2.form_submit_button("Freigeben")
+                    if commit or release:
+                        try:
+                            if commit:
+                                mv_id = commit_reservation(DATA_DIR, int(res_id), move_date, notes=notes.strip())
+                            else:
+                                release_reservation(DATA_DIR, int(res_id))
+                        except BookingError as e:
+                            st.error(str(e))
+                        else:
+                            st.success(f"Versand gebucht (ID {mv_id})." if commit else "Reservierung freigegeben.")
+                            st.rerun()
+
+        with st.expander("Sammelversand (mehrere Positionen, z.B. eine LKW-Ladung)"):
+            pos_by_label = {inv_labels[i]: (int(inv_rows.at[i, "lot_id"]), int(inv_rows.at[i, "location_id"]))
+                            for i in inv_opts}
+            with st.form("out_batch_form", clear_on_submit=True):
+                grid = _batch_editor("out_batch_grid", {"Bestandsposition": list(pos_by_label)})
+                receiver = st.text_input("Empfänger / an wen gesendet", key="out_batch_receiver")
+                reference = st.text_input("Referenz (optional)", key="out_batch_ref")
+                notes = st.text_area("Notizen (optional)", key="out_batch_notes")
+                move_date = st.date_input("Versanddatum", value=date.today(), key="out_batch_date")
+                uploads = st.file_uploader("Dokumente für alle Positionen", accept_multiple_files=True,
+                                           key="out_batch_docs")
+                submitted = st.form_submit_button("Alle Positionen versenden")
+                if submitted:
+                    lines, problems = [], []
+                    for n, (r, p, k) in enumerate(_filled_rows(grid, ["Bestandsposition"]), start=1):
+                        if r["Bestandsposition"] not in pos_by_label:
+                            problems.append(f"Position {n}: Bestandsposition wählen.")
+                        else:
+                            lines.append(pos_by_label[r["Bestandsposition"]] + (p, k))
+                    if not receiver.strip():
+                        problems.append("Bitte Empfänger angeben.")
+                    if problems:
+                        st.error(" ".join(problems))
+                    else:
+                        docs = []
+                        for uf in uploads or []:
+                            stored_path, mime, size, sha = save_upload(DATA_DIR, uf)
+                            docs.append((uf.name, stored_path, mime, size, sha))
+                        try:
+                            ids = book_movements(DATA_DIR, "OUT", lines, receiver.strip(), reference.strip(),
+                                                 notes.strip(), move_date, documents=docs)
+                        except BookingError as e:
+                            st.error(str(e))
+                        else:
+                            st.success(f"{len(ids)} Positionen versendet. Dokumente je Position: {len(docs)}.")
+                            st.rerun()
+
+        with st.expander("FEFO-Versand (nach Artikel, frühestes MHD zuerst)"):
+            st.caption("Je Zeile Artikel und Menge angeben; das System verteilt auf Chargen und Lagerplätze "
+                       "mit dem frühesten MHD und bucht alle Positionen gemeinsam.")
+            idx = get_master_index(DATA_DIR)
+            item_by_label = {label: i for i, label in idx.labels["item"].items()}
+            stock_labels = sorted(set(inv["sku"] + " – " + inv["artikel"]) & set(item_by_label))
+            with st.form("out_fefo_form"):
+                grid = _batch_editor("out_fefo_grid", {"Artikel": stock_labels})
+                receiver = st.text_input("Empfänger / an wen gesendet", key="out_fefo_receiver")
+                reference = st.text_input("Referenz (optional)", key="out_fefo_ref")
+                notes = st.text_area("Notizen (optional)", key="out_fefo_notes")
+                move_date = st.date_input("Versanddatum", value=date.today(), key="out_fefo_date")
+                skip_expired = st.checkbox("Chargen mit MHD vor dem Versanddatum auslassen", value=True,
+                                           key="out_fefo_skip_expired")
+                c1, c2 = st.columns(2)
+                preview = c1.form_submit_button("Zuteilung anzeigen")
+                submitted = c2.form_submit_button("FEFO-Versand buchen")
+                if preview or submitted:
+                    order, problems = [], []
+                    for n, (r, p, k) in enumerate(_filled_rows(grid, ["Artikel"]), start=1):
+                        if r["Artikel"] not in item_by_label:
+                            problems.append(f"Zeile {n}: Artikel wählen.")
+                        else:
+                            order.append((item_by_label[r["Artikel"]], p, k))
+                    if submitted and not receiver.strip():
+                        problems.append("Bitte Empfänger angeben.")
+                    min_mhd = move_date if skip_expired else None
+                    if problems:
+                        st.error(" ".join(problems))
+                    elif preview:
+                        try:
+                            alloc = allocate_fefo(DATA_DIR, order, min_mhd=min_mhd)
+                        except BookingError as e:
+                            st.error(str(e))
+                        else:
+                            alloc["Charge"] = alloc["lot_id"].map(idx.lot_label)
+                            alloc["Lagerplatz"] = alloc["location_id"].map(idx.location_label)
+                            st.dataframe(alloc[["zeile", "Charge", "Lagerplatz", "paletten", "koli"]],
+                                         use_container_width=True, hide_index=True)
+                    else:
+                        try:
+                            ids = book_fefo(DATA_DIR, order, receiver.strip(), reference.strip(), notes.strip(),
+                                            move_date, min_mhd=min_mhd)
+                        except BookingError as e:
+                            st.error(str(e))
+                        else:
+                            st.success(f"{len(order)} Auftragszeilen als {len(ids)} Positionen versendet.")
+                            st.rerun()
 
 # ---------------- Bewegungen & Dokumente ----------------
-with tabs[4]:
+MOVES_PAGE_SIZE = 500
+
+with tabs[4], tracing.section("Bewegungen & Dokumente"):
     st.subheader("Bewegungen")
-    moves = get_movements(DATA_DIR)
-    if moves.empty:
-        st.info("Noch keine Bewegungen vorhanden.")
+    q = st.text_input("🔎 Volltextsuche (Partner, Referenz, Notizen, Dokumentnamen)", value="",
+                      placeholder="z.B. müller cmr 0815 – Wortanfänge genügen")
+    # Filter
+    c1, c2, c3, c4 = st.columns(4)
+    with c1:
+        t = st.selectbox("Typ", ["ALLE", "IN", "OUT"])
+    with c2:
+        partner = st.text_input("Partner/Empfänger enthält", value="")
+    with c3:
+        from_d = st.date_input("Von", value=None)
+    with c4:
+        to_d = st.date_input("Bis", value=None)
+    archive_cutoff = get_archive_cutoff(DATA_DIR)
+    with_archive = bool(archive_cutoff) and st.checkbox(
+        f"Archiv einbeziehen (Bewegungen bis {archive_cutoff})", key="mv_archive")
+
+    # Seiten-Cursor: Liste der after_id-Werte besuchter Seiten, zurückgesetzt bei Filterwechsel
+    filt = (t, partner.strip(), from_d, to_d, with_archive)
+    if st.session_state.get("mv_filter") != filt:
+        st.session_state["mv_filter"] = filt
+        st.session_state["mv_cursors"] = [None]
+    cursors = st.session_state["mv_cursors"]
+
+    if q.strip():
+        # Volltextsuche: beste Treffer zuerst, die übrigen Filter gelten weiter
+        df = search_movements(DATA_DIR, q, typ=None if t == "ALLE" else t, partner_like=partner.strip() or None,
+                              date_from=from_d, date_to=to_d, limit=MOVES_PAGE_SIZE)
+        if df.empty:
+            st.info("Keine Treffer.")
+        else:
+            st.dataframe(df, use_container_width=True, hide_index=True)
+            st.caption(f"{len(df)} Treffer (beste zuerst" + (f", max. {MOVES_PAGE_SIZE}" if len(df) == MOVES_PAGE_SIZE else "")
+                       + "); Spalte „dokument“ = passender Dateiname.")
     else:
-        # Filter
-        c1, c2, c3, c4 = st.columns(4)
-        with c1:
-            t = st.selectbox("Typ", ["ALLE", "IN", "OUT"])
-        with c2:
-            partner = st.text_input("Partner/Empfänger enthält", value="")
-        with c3:
-            from_d = st.date_input("Von", value=None)
-        with c4:
-            to_d = st.date_input("Bis", value=None)
-
-        df = moves.copy()
-        if t != "ALLE":
-            df = df[df["typ"] == t]
-        if partner.strip():
-            df = df[df["partner"].fillna("").str.contains(partner.strip(), case=False)]
-        if from_d:
-            df = df[pd.to_datetime(df["datum"]).dt.date >= from_d]
-        if to_d:
-            df = df[pd.to_datetime(df["datum"]).dt.date <= to_d]
-
-        st.dataframe(df, use_container_width=True, hide_index=True)
+        page = query_movements(
+            DATA_DIR,
+            typ=None if t == "ALLE" else t,
+            partner_like=partner.strip() or None,
+            date_from=from_d, date_to=to_d,
+            after_id=cursors[-1], limit=MOVES_PAGE_SIZE + 1,
+            include_archive=with_archive,
+        )
+        has_more = len(page) > MOVES_PAGE_SIZE
+        df = page.head(MOVES_PAGE_SIZE)
+
+        if df.empty and len(cursors) == 1:
+            st.info("Keine Bewegungen gefunden.")
+        else:
+            st.dataframe(df, use_container_width=True, hide_index=True)
+
+            n1, n2, n3 = st.columns([1, 1, 4])
+            with n1:
+                if st.button("◀ Vorherige Seite", disabled=len(cursors) == 1):
+                    cursors.pop()
+                    st.rerun()
+            with n2:
+                if st.button("Nächste Seite ▶", disabled=not has_more):
+                    cursors.append(int(df["id"].iloc[-1]))
+                    st.rerun()
+            n3.caption(f"Seite {len(cursors)} · {len(df)} Bewegungen")
+
+            with st.expander("Alle Treffer exportieren (CSV/JSONL, mit obigen Filtern)"):
+                _export_panel("exp_mv", "bewegungen", lambda fmt: export_movements(
+                    DATA_DIR, fmt, typ=None if t == "ALLE" else t, partner_like=partner.strip() or None,
+                    date_from=from_d, date_to=to_d, include_archive=with_archive))
 
+    if not df.empty:
         st.markdown("### Dokumente zu einer Bewegung")
         move_ids = df["id"].tolist()
         if move_ids:
@@ -251,49 +604,148 @@ with tabs[4]:
                 st.info("Keine Dokumente für diese Bewegung.")
             else:
                 st.dataframe(docs[["id","filename","mime","size_bytes","uploaded_at"]], use_container_width=True, hide_index=True)
-                for _, r in docs.iterrows():
-                    blob = get_document_blob(DATA_DIR, int(r["id"]))
-                    st.download_button(
-                        label=f"⬇️ Download: {r['filename']}",
-                        data=blob,
-                        file_name=r["filename"],
-                        mime=r["mime"] or "application/octet-stream"
-                    )
+
+                # Dateien werden erst auf Anforderung gelesen, nicht bei jedem Rerun
+                doc_names = dict(zip(docs["id"], docs["filename"]))
+                d1, d2 = st.columns(2)
+                with d1:
+                    doc_id = st.selectbox("Dokument", list(doc_names), format_func=doc_names.get)
+                    if st.button("Download vorbereiten"):
+                        st.session_state["dl_doc"] = int(doc_id)
+                    if st.session_state.get("dl_doc") == int(doc_id):
+                        doc = open_document(DATA_DIR, int(doc_id))
+                        st.download_button(
+                            label=f"⬇️ Download: {doc.filename}",
+                            data=doc.read(),
+                            file_name=doc.filename,
+                            mime=doc.mime,
+                            on_click=lambda: st.session_state.pop("dl_doc", None),
+                        )
+                with d2:
+                    if st.button(f"Alle {len(docs)} Dokumente als ZIP vorbereiten"):
+                        st.session_state["dl_zip"] = int(mv_id)
+                    if st.session_state.get("dl_zip") == int(mv_id):
+                        lazy_docs = [open_document(DATA_DIR, int(i)) for i in docs["id"]]
+                        with build_zip([x for x in lazy_docs if x is not None]) as zf:
+                            zip_bytes = zf.read()
+                        st.download_button(
+                            label="⬇️ Download: ZIP",
+                            data=zip_bytes,
+                            file_name=f"bewegung_{int(mv_id)}_dokumente.zip",
+                            mime="application/zip",
+                            on_click=lambda: st.session_state.pop("dl_zip", None),
+                        )
 
 # ---------------- Reports ----------------
-with tabs[5]:
+with tabs[5], tracing.section("Reports"):
     st.subheader("Reports")
-    moves = get_movements(DATA_DIR)
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        from_d = st.date_input("Von", value=None, key="r_from")
+    with c2:
+        to_d = st.date_input("Bis", value=None, key="r_to")
+    with c3:
+        grp = st.selectbox("Gruppieren nach", ["Empfänger", "Artikel (SKU)"], index=0)
+
+    if grp == "Empfänger":
+        rep = get_movement_report(DATA_DIR, "OUT", "partner", from_d, to_d).rename(columns={"partner": "empfaenger"})
+    else:
+        rep = get_movement_report(DATA_DIR, "OUT", "sku", from_d, to_d)
 
-    if moves.empty:
-        st.info("Keine Daten.")
+    if rep.empty:
+        st.warning("Keine OUT-Daten im gewählten Zeitraum.")
     else:
-        out = moves[moves["typ"]=="OUT"].copy()
-        c1, c2, c3 = st.columns(3)
-        with c1:
-            from_d = st.date_input("Von", value=None, key="r_from")
-        with c2:
-            to_d = st.date_input("Bis", value=None, key="r_to")
-        with c3:
-            grp = st.selectbox("Gruppieren nach", ["Empfänger", "Artikel (SKU)"], index=0)
-
-        if from_d:
-            out = out[pd.to_datetime(out["datum"]).dt.date >= from_d]
-        if to_d:
-            out = out[pd.to_datetime(out["datum"]).dt.date <= to_d]
-
-        if out.empty:
-            st.warning("Keine OUT-Daten im gewählten Zeitraum.")
+        st.dataframe(rep, use_container_width=True, hide_index=True)
+
+        st.download_button(
+            "⬇️ Report als CSV",
+            data=rep.to_csv(index=False).encode("utf-8"),
+            file_name="report.csv",
+            mime="text/csv"
+        )
+
+# ---------------- Admin ----------------
+if IS_ADMIN:
+    with tabs[6], tracing.section("Admin"):
+        st.subheader("Admin")
+
+        st.markdown("### Abgleich Bestand ↔ Bewegungen")
+        cp = get_checkpoint(DATA_DIR)
+        st.caption(f"Letzter Abgleich: bis Bewegung {cp[0]} am {cp[1]} (UTC)" if cp else "Noch kein Abgleich gelaufen.")
+        a1, a2, a3 = st.columns(3)
+        with a1:
+            full = st.checkbox("Voller Abgleich (alles neu rechnen)")
+        with a2:
+            repair = st.checkbox("Abweichungen reparieren")
+        with a3:
+            run_check = st.button("Abgleich starten")
+        if run_check:
+            st.session_state["ledger_report"] = check_ledger(DATA_DIR, full=full, repair=repair)
+        report = st.session_state.get("ledger_report")
+        if report is not None:
+            (st.success if report.ok or report.repaired else st.error)(report.summary())
+            if not report.drift.empty:
+                st.dataframe(report.drift, use_container_width=True, hide_index=True)
+
+        st.markdown("### Archiv")
+        archive_info = get_archive_info(DATA_DIR)
+        if archive_info.empty:
+            st.caption("Noch nichts archiviert (python -m src.cli archive).")
         else:
-            if grp == "Empfänger":
-                rep = out.groupby("partner", dropna=False)[["paletten","koli"]].sum().reset_index().rename(columns={"partner":"empfaenger"})
+            st.dataframe(archive_info, use_container_width=True, hide_index=True)
+            if st.button("Archiv prüfen"):
+                st.session_state["archive_problems"] = verify_archive(DATA_DIR)
+            problems = st.session_state.get("archive_problems")
+            if problems is not None:
+                if problems:
+                    for p in problems:
+                        st.error(p)
+                else:
+                    st.success("Archiv in Ordnung: Zeilen, Summen und Bestand stimmen.")
+
+        st.markdown("### Sicherung")
+        st.caption(f"Online während des Betriebs nach {backup_dir(DATA_DIR)}; Dokumente nur neue seit der "
+                   "letzten Sicherung. Wiederherstellen: python -m src.cli restore <datei> (App vorher beenden).")
+        if st.button("Backup erstellen"):
+            bar = st.progress(0.0, text="Sicherung läuft …")
+            try:
+                report = backup(DATA_DIR, progress=lambda text, frac: bar.progress(min(frac, 1.0), text=text))
+                problems = verify_backup(report.path)
+            except BackupError as e:
+                st.error(f"Sicherung abgebrochen: {e}")
             else:
-                rep = out.groupby("sku", dropna=False)[["paletten","koli"]].sum().reset_index()
-            st.dataframe(rep, use_container_width=True, hide_index=True)
-
-            st.download_button(
-                "⬇️ Report als CSV",
-                data=rep.to_csv(index=False).encode("utf-8"),
-                file_name="report.csv",
-                mime="text/csv"
-            )
+                for p in problems:
+                    st.error(p)
+                if not problems:
+                    st.success(report.summary() + " Geprüft.")
+        backups = list_backups(DATA_DIR)
+        if backups:
+            st.dataframe(pd.DataFrame([{
+                "datei": m["name"], "erstellt": m["created_at"],
+                "datenbanken": len(m["databases"]), "neue_dokumente": m["new_uploads"],
+                "dokumente": len(m["uploads"]), "basis": m["previous"],
+            } for m in backups]), use_container_width=True, hide_index=True)
+
+# ---------------- Debug (Admin) ----------------
+if IS_ADMIN:
+    with st.sidebar.expander("🐞 Debug: Laufzeiten"):
+        trace_on = st.checkbox("Messung aktiv (für alle Sitzungen)", value=tracing.ENABLED)
+        slow_ms = st.number_input("Slow-Query-Schwelle (ms)", min_value=1, step=50, value=int(tracing.SLOW_QUERY_MS))
+        if trace_on != tracing.ENABLED or float(slow_ms) != tracing.SLOW_QUERY_MS:
+            tracing.configure(enabled=trace_on, slow_query_ms=slow_ms)
+            st.rerun()
+        if not tracing.ENABLED:
+            st.caption("Messung aus. Einschalten und Seite neu laden bzw. bedienen.")
+        else:
+            breakdown = trace.frame()
+            st.caption(f"Dieser Durchlauf: {trace.elapsed_ms():.0f} ms gesamt, "
+                       f"{breakdown['ms'].sum():.0f} ms in Datenbank-Funktionen")
+            st.markdown("**Nach Tab**")
+            st.dataframe(trace.by_section(), use_container_width=True, hide_index=True)
+            st.markdown("**Nach Tab und Funktion**")
+            st.dataframe(breakdown, use_container_width=True, hide_index=True)
+            if trace.slow:
+                st.markdown("**Langsame Anweisungen**")
+                st.dataframe(pd.DataFrame(trace.slow, columns=["ms", "abschnitt", "funktion", "sql"]),
+                             use_container_width=True, hide_index=True)
+            st.caption(f"Slow-Query-Log: {tracing.slow_log_path(DATA_DIR)}")
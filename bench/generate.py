@@ -0,0 +1,165 @@
+"""Synthetische Testdaten für Benchmarks.
+
+Füllt data_dir/app.db reproduzierbar (fester Seed) mit Artikeln, Lagerplätzen,
+Chargen, Bewegungen und Dokumenten. Bewegungen laufen durch die normalen
+Trigger (Tagesverdichtung, Snapshots, Blob-Referenzen); der Bestand wird am
+Ende aus den Bewegungen berechnet, sodass Bestand und Bewegungen übereinstimmen
+und OUT nie unter 0 bucht.
+
+Aufruf: python -m bench.generate DIR [--items 50000 --locations 5000 ...]
+"""
+import os
+import sys
+import time
+import random
+import hashlib
+import argparse
+from datetime import date, timedelta, datetime
+
+from src import db
+from src.storage import blob_path
+
+DEFAULTS = {
+    "items": 50_000,
+    "locations": 5_000,
+    "lots": 200_000,
+    "movements": 2_000_000,
+    "documents": 20_000,
+}
+# Anzahl verschiedener Dokument-Inhalte (Rest sind Duplikate → Dedup)
+DISTINCT_BLOBS = 2_000
+BATCH = 50_000
+PARTNERS = [f"Kunde {i:03d}" for i in range(200)] + [f"Lieferant {i:03d}" for i in range(50)]
+
+
+def _now():
+    return datetime.utcnow().isoformat(timespec="seconds")
+
+
+def _batched(rows, size=BATCH):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _movements(rnd, n_lots, n_locations, n, start: date, days: int):
+    """(typ, lot_id, location_id, paletten, koli, partner, reference, datum) in Datumsfolge.
+
+    Jede Charge liegt auf ein bis zwei festen Plätzen; OUT entnimmt höchstens den
+    laufenden Bestand der Position."""
+    homes = {}
+    balance = {}
+    for i in range(n):
+        day = start + timedelta(days=i * days // n)
+        lot_id = rnd.randint(1, n_lots)
+        places = homes.get(lot_id)
+        if places is None:
+            places = homes[lot_id] = [rnd.randint(1, n_locations) for _ in range(rnd.randint(1, 2))]
+        key = (lot_id, rnd.choice(places))
+        pal, koli = balance.get(key, (0, 0))
+        if (pal or koli) and rnd.random() < 0.45:
+            out_pal, out_koli = rnd.randint(0, pal), rnd.randint(0, koli)
+            if out_pal == 0 and out_koli == 0:
+                out_pal, out_koli = (0, koli) if koli else (pal, 0)
+            balance[key] = (pal - out_pal, koli - out_koli)
+            yield ("OUT", *key, out_pal, out_koli, rnd.choice(PARTNERS[:200]), f"LS-{i}", day.isoformat())
+        else:
+            in_pal, in_koli = rnd.randint(1, 6), rnd.randint(0, 80)
+            balance[key] = (pal + in_pal, koli + in_koli)
+            yield ("IN", *key, in_pal, in_koli, rnd.choice(PARTNERS[200:]), f"WE-{i}", day.isoformat())
+
+
+def _blobs(rnd, data_dir, n):
+    """Legt n kleine Dateien inhaltsadressiert ab; liefert (sha256, pfad, größe)."""
+    out = []
+    for i in range(n):
+        payload = f"Lieferschein {i}\n".encode() + rnd.randbytes(rnd.randint(2_000, 60_000))
+        sha = hashlib.sha256(payload).hexdigest()
+        path = blob_path(data_dir, sha)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(payload)
+        out.append((sha, path, len(payload)))
+    return out
+
+
+def generate(data_dir: str, items=DEFAULTS["items"], locations=DEFAULTS["locations"], lots=DEFAULTS["lots"],
+             movements=DEFAULTS["movements"], documents=DEFAULTS["documents"], seed: int = 42,
+             start: date = date(2023, 1, 1), days: int = 3 * 365, log=print) -> dict:
+    """Erzeugt eine neue Datenbank in data_dir (muss leer sein). Gibt die Mengen zurück."""
+    if os.path.exists(os.path.join(data_dir, "app.db")):
+        raise FileExistsError(f"{data_dir}/app.db existiert bereits")
+    rnd = random.Random(seed)
+    db.init_db(data_dir)
+    now = _now()
+
+    def step(label, fn):
+        t0 = time.perf_counter()
+        fn()
+        log(f"{label}: {time.perf_counter() - t0:.1f} s")
+
+    def run(con):
+        step(f"{items} Artikel", lambda: con.executemany(
+            "INSERT INTO items(sku,name,created_at) VALUES (?,?,?)",
+            ((f"SKU{i:07d}", f"Artikel {i} {rnd.choice(['Karton', 'Dose', 'Flasche', 'Beutel'])}", now)
+             for i in range(1, items + 1))))
+        step(f"{locations} Lagerplätze", lambda: con.executemany(
+            "INSERT INTO locations(code,description,created_at) VALUES (?,?,?)",
+            ((f"{chr(65 + i % 26)}-{i:05d}", f"Regal {i // 100}", now) for i in range(1, locations + 1))))
+        step(f"{lots} Chargen", lambda: con.executemany(
+            "INSERT INTO lots(item_id,batch,mhd,created_at) VALUES (?,?,?,?)",
+            (((i % items) + 1, f"CH{i:07d}", (start + timedelta(days=rnd.randint(30, days + 720))).isoformat(), now)
+             for i in range(lots))))
+
+        def moves():
+            for batch in _batched(_movements(rnd, lots, locations, movements, start, days)):
+                con.executemany(
+                    """INSERT INTO movements(typ,lot_id,location_id,paletten,koli,partner,reference,notes,datum,created_at)
+                         VALUES (?,?,?,?,?,?,?,'',?,?)""",
+                    [row + (now,) for row in batch])
+        step(f"{movements} Bewegungen", moves)
+
+        step("Bestand", lambda: con.execute(f"""
+            INSERT INTO inventory(lot_id,location_id,paletten,koli,updated_at)
+            SELECT lot_id, location_id,
+                   SUM(CASE typ WHEN 'OUT' THEN -paletten ELSE paletten END),
+                   SUM(CASE typ WHEN 'OUT' THEN -koli ELSE koli END), '{now}'
+            FROM movements GROUP BY lot_id, location_id"""))
+
+        def docs():
+            if not documents:
+                return
+            blobs = _blobs(rnd, data_dir, min(DISTINCT_BLOBS, documents))
+            n_moves = con.execute("SELECT MAX(id) FROM movements").fetchone()[0] or 0
+            con.executemany(
+                "INSERT INTO documents(movement_id,filename,stored_path,mime,size_bytes,uploaded_at,sha256) VALUES (?,?,?,?,?,?,?)",
+                ((mid, f"LS_{mid}.pdf", path, "application/pdf", size, now, sha)
+                 for mid, (sha, path, size) in ((rnd.randint(1, n_moves), rnd.choice(blobs)) for _ in range(documents))))
+        step(f"{documents} Dokumente", docs)
+
+    db.write_transaction(data_dir, run)
+    step("ANALYZE", lambda: db.write_transaction(data_dir, lambda con: con.execute("ANALYZE")))
+    return {"items": items, "locations": locations, "lots": lots, "movements": movements,
+            "documents": documents, "seed": seed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.generate", description="Synthetische Benchmark-Daten")
+    parser.add_argument("data_dir")
+    for name, default in DEFAULTS.items():
+        parser.add_argument(f"--{name}", type=int, default=default)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    t0 = time.perf_counter()
+    generate(args.data_dir, args.items, args.locations, args.lots, args.movements, args.documents, args.seed)
+    print(f"Fertig in {time.perf_counter() - t0:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Benchmark für den CSV-Massenimport (src/importer.py).
+
+Erzeugt reproduzierbar (fester Seed) CSV-Dateien für Artikel, Lagerplätze,
+Chargen und Anfangsbestand mit zusammen --rows Zeilen (Default 1 Mio.), davon
+ein Anteil --reject-rate absichtlich ungültiger Zeilen, und importiert sie
+nacheinander in eine leere Datenbank. Ausgabe als JSON je Importtyp: Zeilen,
+neu/abgelehnt, Dauer, Zeilen pro Sekunde und Spitzen-RSS – der RSS zeigt, dass
+der Import blockweise streamt statt die Datei zu laden.
+
+Aufruf: python -m bench.import_csv DIR [--rows 1000000] [--reject-rate 0.01] [--out import.json]
+"""
+import os
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import tempfile
+
+from src import db, importer
+from bench.run import _RssSampler
+
+ROWS = 1_000_000
+# Anteile der Importtypen an --rows (Reihenfolge = Importreihenfolge)
+SHARES = {"items": 0.10, "locations": 0.01, "lots": 0.30, "stock": 0.59}
+REJECT_RATE = 0.01
+
+
+def _counts(rows: int) -> dict:
+    counts = {kind: max(1, int(rows * share)) for kind, share in SHARES.items()}
+    counts["stock"] += rows - sum(counts.values())
+    return counts
+
+
+def _rows(kind: str, n: int, counts: dict, rnd: random.Random, reject_rate: float):
+    items, locations, lots = counts["items"], counts["locations"], counts["lots"]
+    for i in range(n):
+        bad = rnd.random() < reject_rate
+        if kind == "items":
+            yield (f"SKU{i:07d}", "" if bad else f"Artikel {i}")
+        elif kind == "locations":
+            yield (f"L-{i:05d}", f"Gang {i // 100}")
+        elif kind == "lots":
+            yield (f"SKU{i % items:07d}", f"CH{i:07d}", "31.02.2027" if bad else f"2027-{i % 12 + 1:02d}-15")
+        else:
+            lot = rnd.randrange(lots)
+            sku = "UNBEKANNT" if bad else f"SKU{lot % items:07d}"
+            yield (sku, f"CH{lot:07d}", f"2027-{lot % 12 + 1:02d}-15", f"L-{rnd.randrange(locations):05d}",
+                   rnd.randint(0, 3), rnd.randint(1, 200))
+
+
+def write_files(target: str, rows: int = ROWS, reject_rate: float = REJECT_RATE, seed: int = 10) -> dict:
+    """Schreibt die CSV-Dateien nach target und gibt {kind: pfad} zurück."""
+    rnd = random.Random(seed)
+    counts = _counts(rows)
+    paths = {}
+    for kind, n in counts.items():
+        paths[kind] = os.path.join(target, f"{kind}.csv")
+        with open(paths[kind], "w", newline="", encoding="utf-8") as f:
+            out = csv.writer(f, delimiter=";")
+            out.writerow(importer.COLUMNS[kind])
+            out.writerows(_rows(kind, n, counts, rnd, reject_rate))
+    return paths
+
+
+def run(data_dir: str, rows: int = ROWS, reject_rate: float = REJECT_RATE, log=print) -> dict:
+    db.init_db(data_dir)
+    result = {"rows": rows, "reject_rate": reject_rate, "imports": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_files(tmp, rows, reject_rate)
+        for kind, path in paths.items():
+            with open(path, newline="", encoding="utf-8") as f, _RssSampler() as rss:
+                t0 = time.perf_counter()
+                res = importer.import_csv(data_dir, kind, f, delimiter=";", datum="2026-01-01")
+                seconds = time.perf_counter() - t0
+            entry = {
+                "kind": kind,
+                "rows": res.rows,
+                "inserted": res.inserted,
+                "rejected": res.rejected,
+                "seconds": round(seconds, 2),
+                "rows_per_second": round(res.rows / seconds) if seconds else None,
+                "peak_rss_mib": round(rss.peak / 2**20, 1),
+            }
+            result["imports"].append(entry)
+            log(res.summary(), f"{entry['seconds']} s", file=sys.stderr)
+    total = sum(e["seconds"] for e in result["imports"])
+    result["seconds"] = round(total, 2)
+    result["rows_per_second"] = round(rows / total) if total else None
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.import_csv",
+                                     description="CSV-Massenimport in eine leere Datenbank")
+    parser.add_argument("data_dir", help="leeres Verzeichnis (wird angelegt)")
+    parser.add_argument("--rows", type=int, default=ROWS)
+    parser.add_argument("--reject-rate", type=float, default=REJECT_RATE)
+    parser.add_argument("--out", help="JSON-Ergebnis hierhin schreiben (Default: stdout)")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(db._db_path(args.data_dir)):
+        raise SystemExit("Datenbank existiert bereits – der Import-Benchmark braucht ein leeres Verzeichnis.")
+    result = run(args.data_dir, args.rows, args.reject_rate)
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
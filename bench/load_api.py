@@ -0,0 +1,186 @@
+"""Lasttest für die HTTP-Schnittstelle (src/api.py).
+
+Startet einen lokalen Dienst auf einem freien Port (oder nutzt --url) und
+schickt mit --clients gleichzeitigen Keep-Alive-Verbindungen eine Mischung aus
+Bestandsabfragen, Bewegungslisten, Buchungen und Batch-Anfragen. Ausgabe als
+JSON: Anfragen pro Sekunde sowie p50/p95/p99 je Anfragetyp.
+
+Buchungen verändern die Datenbank – auf einer Kopie laufen lassen.
+
+Aufruf: python -m bench.load_api DIR [--clients 32] [--seconds 10] [--writes 0.1]
+"""
+import sys
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import argparse
+import threading
+from urllib.parse import urlsplit
+
+from src import api, db
+from bench.run import _percentile
+
+
+class _Client:
+    """Minimaler HTTP/1.1-Client über eine Keep-Alive-Verbindung."""
+
+    def __init__(self, host, port, token=None):
+        self.host, self.port, self.token = host, port, token
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        data = json.dumps(body).encode() if body is not None else b""
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(data)}\r\n"
+        if self.token:
+            head += f"Authorization: Bearer {self.token}\r\n"
+        if data:
+            head += "Content-Type: application/json\r\n"
+        self.writer.write(head.encode() + b"\r\n" + data)
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        length, close = 0, False
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+            elif name.lower() == "connection" and value.strip().lower() == "close":
+                close = True
+        payload = await self.reader.readexactly(length)
+        if close:
+            await self.close()
+        return int(status_line.split()[1]), payload
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+def _targets(data_dir):
+    with sqlite3.connect(db._db_path(data_dir)) as con:
+        stock = con.execute("SELECT inv.lot_id, inv.location_id, i.sku FROM inventory inv "
+                            "JOIN lots l ON l.id = inv.lot_id JOIN items i ON i.id = l.item_id "
+                            "WHERE inv.koli > 0 LIMIT 2000").fetchall()
+        day = con.execute("SELECT MAX(datum) FROM movements").fetchone()[0]
+    if not stock:
+        raise SystemExit("Keine Bestände – zuerst python -m bench.generate DIR ausführen.")
+    return stock, day
+
+
+def _mix(rnd, stock, day, write_share):
+    """(art, methode, pfad, body) einer zufälligen Anfrage."""
+    lot_id, location_id, sku = rnd.choice(stock)
+    r = rnd.random()
+    if r < write_share:
+        typ = "IN" if rnd.random() < 0.5 else "OUT"
+        return ("buchung", "POST", "/movements", {
+            "typ": typ, "datum": day, "partner": "Lasttest", "reference": "LOAD",
+            "lines": [{"lot_id": lot_id, "location_id": location_id, "paletten": 0, "koli": 1}]})
+    r = rnd.random()
+    if r < 0.5:
+        return ("bestand", "GET", f"/inventory?lot_id={lot_id}&location_id={location_id}", None)
+    if r < 0.8:
+        return ("bewegungen", "GET", "/movements?limit=50", None)
+    if r < 0.9:
+        return ("bestand_sku", "GET", f"/inventory?sku={sku}", None)
+    return ("batch", "POST", "/batch", {"requests": [
+        {"method": "GET", "path": f"/inventory?lot_id={lot_id}&location_id={location_id}"},
+        {"method": "GET", "path": "/movements?limit=10"},
+    ]})
+
+
+async def _load(host, port, token, clients, seconds, write_share, stock, day, seed):
+    latencies = {}
+    statuses = {}
+    deadline = time.perf_counter() + seconds
+
+    async def worker(n):
+        rnd = random.Random(seed + n)
+        client = _Client(host, port, token)
+        try:
+            while time.perf_counter() < deadline:
+                kind, method, path, body = _mix(rnd, stock, day, write_share)
+                t0 = time.perf_counter()
+                status, _ = await client.request(method, path, body)
+                latencies.setdefault(kind, []).append((time.perf_counter() - t0) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            await client.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(clients)))
+    elapsed = time.perf_counter() - t0
+    total = sum(len(v) for v in latencies.values())
+    everything = [x for v in latencies.values() for x in v]
+
+    def stats(values):
+        return {"n": len(values), "p50_ms": round(_percentile(values, 50), 2),
+                "p95_ms": round(_percentile(values, 95), 2), "p99_ms": round(_percentile(values, 99), 2)}
+
+    return {
+        "clients": clients,
+        "seconds": round(elapsed, 2),
+        "requests": total,
+        "rps": round(total / elapsed, 1),
+        "status": {str(k): v for k, v in sorted(statuses.items())},
+        "all": stats(everything),
+        "by_kind": {k: stats(v) for k, v in sorted(latencies.items())},
+    }
+
+
+def _start_local(data_dir):
+    """Startet src.api in einem Hintergrund-Thread auf einem freien Port."""
+    ready = threading.Event()
+    box = {}
+
+    def on_ready(server):
+        box["port"] = server.sockets[0].getsockname()[1]
+        ready.set()
+
+    def run():
+        asyncio.run(api.serve(data_dir, "127.0.0.1", 0, ready=on_ready))
+
+    threading.Thread(target=run, daemon=True).start()
+    if not ready.wait(30):
+        raise RuntimeError("API startet nicht.")
+    return "127.0.0.1", box["port"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.load_api", description="Lasttest für src/api.py")
+    parser.add_argument("data_dir")
+    parser.add_argument("--url", help="laufenden Dienst nutzen (z.B. http://127.0.0.1:8502) statt lokal zu starten")
+    parser.add_argument("--token", default=api.API_TOKEN)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writes", type=float, default=0.1, help="Anteil Buchungen (0..1)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="JSON-Ergebnis hierhin schreiben (Default: stdout)")
+    args = parser.parse_args(argv)
+
+    stock, day = _targets(args.data_dir)
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+    else:
+        host, port = _start_local(args.data_dir)
+    result = asyncio.run(_load(host, port, args.token, args.clients, args.seconds, args.writes, stock, day,
+                               args.seed))
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
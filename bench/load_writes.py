@@ -0,0 +1,127 @@
+"""Lasttest für gleichzeitige Buchungen (Schreib-Thread und Group Commit in src/db.py).
+
+Simuliert 1–32 Sitzungen als Threads, die ohne Pause (oder mit --think-ms)
+db.book_movement aufrufen, jeweils abwechselnd IN/OUT über 1 Koli auf einer
+eigenen Bestandsposition. Verglichen werden drei Betriebsarten:
+
+    direkt         jede Sitzung schreibt und committet selbst (LAGER_WRITER_THREAD=0)
+    schreibthread  ein Schreib-Thread, ein Commit je Buchung (GROUP_COMMIT_MAX=1)
+    group-commit   ein Schreib-Thread, gemeinsame Commits (Default)
+
+Ausgabe als JSON: Buchungen pro Sekunde, p50/p95/p99, Fehler und Buchungen je
+Commit. Buchungen verändern die Datenbank – auf einer Kopie laufen lassen.
+
+Aufruf: python -m bench.load_writes DIR [--sessions 1,2,4,8,16,32] [--seconds 3]
+        [--synchronous NORMAL|FULL] [--modes direkt,schreibthread,group-commit]
+"""
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+
+from src import db
+from bench.run import _percentile
+
+MODES = {
+    "direkt": {"writer_thread": False},
+    "schreibthread": {"writer_thread": True, "group_commit_max": 1},
+    "group-commit": {"writer_thread": True, "group_commit_max": db.GROUP_COMMIT_MAX},
+}
+
+
+def _positions(data_dir, n):
+    with sqlite3.connect(db._db_path(data_dir)) as con:
+        rows = con.execute("SELECT lot_id, location_id FROM inventory WHERE koli > 0 LIMIT ?", (n,)).fetchall()
+        day = con.execute("SELECT MAX(datum) FROM movements").fetchone()[0]
+    if len(rows) < n:
+        raise SystemExit("Zu wenige Bestände – zuerst python -m bench.generate DIR ausführen.")
+    return rows, day[:10]
+
+
+def _run(data_dir, sessions, seconds, think_ms, positions, day):
+    latencies, errors = [], {}
+    lock = threading.Lock()
+    start = threading.Barrier(sessions + 1)
+    stop = threading.Event()
+
+    def session(n):
+        lot_id, location_id = positions[n]
+        mine, k = [], 0
+        start.wait()
+        while not stop.is_set():
+            typ = "IN" if k % 2 == 0 else "OUT"
+            t0 = time.perf_counter()
+            try:
+                db.book_movement(data_dir, typ, lot_id, location_id, 0, 1, "Lasttest", f"W{n}", "", day)
+                mine.append((time.perf_counter() - t0) * 1000)
+            except (db.BookingError, sqlite3.Error) as e:
+                with lock:
+                    key = f"{type(e).__name__}: {e}"
+                    errors[key] = errors.get(key, 0) + 1
+            k += 1
+            if think_ms:
+                time.sleep(think_ms / 1000)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=session, args=(n,)) for n in range(sessions)]
+    for t in threads:
+        t.start()
+    before = db.writer_stats()
+    start.wait()
+    t0 = time.perf_counter()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    after = db.writer_stats()
+    commits = after["commits"] - before["commits"]
+    return {
+        "sessions": sessions,
+        "bookings": len(latencies),
+        "per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 50), 2),
+        "p95_ms": round(_percentile(latencies, 95), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+        "errors": errors,
+        "per_commit": round((after["jobs"] - before["jobs"]) / commits, 1) if commits else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.load_writes",
+                                     description="Buchungen/s bei gleichzeitigen Sitzungen")
+    parser.add_argument("data_dir")
+    parser.add_argument("--sessions", default="1,2,4,8,16,32")
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--think-ms", type=float, default=0, help="Pause je Sitzung zwischen Buchungen")
+    parser.add_argument("--synchronous", default=db.SYNCHRONOUS, help="OFF | NORMAL | FULL | EXTRA")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--out", help="JSON-Ergebnis hierhin schreiben (Default: stdout)")
+    args = parser.parse_args(argv)
+
+    counts = [int(x) for x in args.sessions.split(",")]
+    db.init_db(args.data_dir)
+    positions, day = _positions(args.data_dir, max(counts))
+    result = {"synchronous": args.synchronous.upper(), "seconds": args.seconds, "think_ms": args.think_ms,
+              "modes": {}}
+    for mode in args.modes.split(","):
+        db.configure_connections(synchronous=args.synchronous, **MODES[mode])
+        result["modes"][mode] = [_run(args.data_dir, n, args.seconds, args.think_ms, positions, day)
+                                 for n in counts]
+        print(mode, [(r["sessions"], r["per_second"]) for r in result["modes"][mode]], file=sys.stderr)
+    db.configure_connections(writer_thread=True, group_commit_max=MODES["group-commit"]["group_commit_max"])
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
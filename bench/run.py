@@ -0,0 +1,309 @@
+"""Benchmark-Lauf gegen eine (z.B. mit bench.generate erzeugte) Datenbank.
+
+Misst jede öffentliche Funktion aus src/db.py und src/storage.py sowie
+komplette app.py-Durchläufe per Streamlit-AppTest und schreibt p50/p95 und
+Spitzen-RSS je Fall als JSON, damit Läufe über Commits vergleichbar sind.
+
+Lesende Funktionen laufen kalt (Lese-Cache vor jeder Wiederholung geleert);
+schreibende Fälle ändern die Datenbank – also auf einer Kopie laufen lassen.
+Streamlit führt bei jedem Rerun alle Tabs aus; "app:<Tab>" misst den Rerun,
+den ein Widget in diesem Tab auslöst.
+
+Aufruf: python -m bench.run DIR [--repeat 5] [--out bench.json] [--only db,storage,app]
+"""
+import io
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+from datetime import date, datetime
+
+from src import db, storage
+
+REPEAT = 5
+# Abtastintervall für den RSS-Verlauf (Sekunden)
+RSS_INTERVAL = 0.005
+APP_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # kein procfs: Höchststand des Prozesses (KiB unter Linux, Bytes unter macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _RssSampler:
+    """Höchster RSS während des with-Blocks (Hintergrund-Thread)."""
+
+    def __enter__(self):
+        self.peak = _rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self._stop.wait(RSS_INTERVAL):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def measure(name: str, fn, repeat: int = REPEAT, setup=None, group: str = "") -> dict:
+    """Führt fn repeat-mal aus (setup vorher, nicht gemessen) und liefert die Kennzahlen."""
+    times = []
+    with _RssSampler() as rss:
+        for _ in range(repeat):
+            if setup:
+                setup()
+            t0 = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - t0) * 1000)
+    return {
+        "name": name,
+        "group": group,
+        "n": repeat,
+        "p50_ms": round(_percentile(times, 50), 3),
+        "p95_ms": round(_percentile(times, 95), 3),
+        "min_ms": round(min(times), 3),
+        "max_ms": round(max(times), 3),
+        "peak_rss_mib": round(rss.peak / 2**20, 1),
+    }
+
+
+def _sample(data_dir: str) -> dict:
+    """IDs und Werte aus der Datenbank, mit denen die Fälle parametriert werden."""
+    with sqlite3.connect(db._db_path(data_dir)) as con:
+        one = lambda sql: con.execute(sql).fetchone()
+        lot_id, location_id = one("SELECT lot_id, location_id FROM inventory WHERE paletten > 0 OR koli > 0 "
+                                  "ORDER BY paletten + koli DESC LIMIT 1") or (1, 1)
+        first_day, last_day = one("SELECT MIN(datum), MAX(datum) FROM movements")
+        doc = one("SELECT d.movement_id, d.id FROM documents d ORDER BY d.id LIMIT 1") or (None, None)
+        partner = one("SELECT partner FROM movements WHERE typ='OUT' LIMIT 1")
+        return {
+            "item_id": one("SELECT MIN(id) FROM items")[0] or 1,
+            "lot_id": lot_id,
+            "location_id": location_id,
+            "first_day": first_day or date.today().isoformat(),
+            "last_day": last_day or date.today().isoformat(),
+            "doc_movement_id": doc[0],
+            "document_id": doc[1],
+            "partner": (partner[0] if partner else "") or "",
+        }
+
+
+def _db_cases(data_dir: str, s: dict):
+    """(name, fn, lesend) je öffentlicher Funktion in src/db.py."""
+    d = data_dir
+    mid_day = s["last_day"][:8] + "15"
+    tag = datetime.now().strftime("%H%M%S%f")
+    counter = iter(range(10**9))
+
+    def _book(typ, n=1):
+        if n == 1:
+            return db.book_movement(d, typ, s["lot_id"], s["location_id"], 0, 1, "Benchmark", f"BENCH-{tag}", "",
+                                    s["last_day"])
+        lines = [(s["lot_id"], s["location_id"], 0, 1)] * n
+        return db.book_movements(d, typ, lines, "Benchmark", f"BENCH-{tag}", "", s["last_day"])
+
+    return [
+        ("init_db", lambda: db.init_db(d), False),
+        ("get_items", lambda: db.get_items(d), True),
+        ("get_locations", lambda: db.get_locations(d), True),
+        ("get_lots", lambda: db.get_lots(d), True),
+        ("get_master_index", lambda: db.get_master_index(d), True),
+        ("get_inventory", lambda: db.get_inventory(d), True),
+        ("get_inventory[lot,lagerplatz]", lambda: db.get_inventory(
+            d, lot_id=s["lot_id"], location_id=s["location_id"]), True),
+        ("get_stock_totals", lambda: db.get_stock_totals(d), True),
+        ("get_stock_by_item", lambda: db.get_stock_by_item(d), True),
+        ("get_stock_by_location", lambda: db.get_stock_by_location(d), True),
+        ("get_movements", lambda: db.get_movements(d), True),
+        ("query_movements", lambda: db.query_movements(d), True),
+        ("query_movements[typ,partner,zeitraum]", lambda: db.query_movements(
+            d, typ="OUT", partner_like=s["partner"][:5], date_from=s["first_day"], date_to=s["last_day"]), True),
+        ("search_movements", lambda: db.search_movements(d, s["partner"]), True),
+        ("search_movements[präfix]", lambda: db.search_movements(d, s["partner"][:3]), True),
+        ("get_movement_report[partner]", lambda: db.get_movement_report(d), True),
+        ("get_movement_report[sku]", lambda: db.get_movement_report(d, group_by="sku"), True),
+        ("get_movement_report[tag,monat]", lambda: db.get_movement_report(
+            d, group_by="tag", date_from=s["last_day"][:8] + "01", date_to=s["last_day"]), True),
+        ("get_inventory_as_of", lambda: db.get_inventory_as_of(d, mid_day), True),
+        ("get_documents_for_movement", lambda: db.get_documents_for_movement(d, s["doc_movement_id"] or 1), True),
+        ("get_document_info", lambda: db.get_document_info(d, s["document_id"] or 1), True),
+        ("get_document_blob", lambda: db.get_document_blob(d, s["document_id"] or 1), True),
+        ("get_blobs", lambda: db.get_blobs(d), True),
+        ("get_blobs[unreferenced]", lambda: db.get_blobs(d, unreferenced_only=True), True),
+        ("iter_movements[alle]", lambda: sum(len(rows) for rows in list(db.iter_movements(d))[1:]), True),
+        ("cache_stats", db.cache_stats, True),
+        ("add_item", lambda: db.add_item(d, f"BENCH-{tag}-{next(counter)}", "Benchmark"), False),
+        ("add_location", lambda: db.add_location(d, f"BENCH-{tag}-{next(counter)}", ""), False),
+        ("add_lot", lambda: db.add_lot(d, s["item_id"], f"BENCH-{tag}-{next(counter)}", None), False),
+        ("upsert_inventory_delta", lambda: db.upsert_inventory_delta(d, s["lot_id"], s["location_id"], 0, 0), False),
+        ("book_movement[IN]", lambda: _book("IN"), False),
+        ("book_movement[OUT]", lambda: _book("OUT"), False),
+        ("book_movements[IN x50]", lambda: _book("IN", 50), False),
+        ("allocate_fefo[50 Zeilen]", lambda: db.allocate_fefo(d, [(s["item_id"] + i, 0, 1) for i in range(50)]), True),
+        ("add_movement", lambda: db.add_movement(d, "IN", s["lot_id"], s["location_id"], 0, 0,
+                                                 "Benchmark", "", "", s["last_day"]), False),
+        ("add_document", lambda: db.add_document(d, s["doc_movement_id"] or 1, "bench.pdf", "/dev/null",
+                                                 "application/pdf", 0), False),
+        ("drop_blob", lambda: db.drop_blob(d, "0" * 64), False),
+        ("build_inventory_snapshots", lambda: db.build_inventory_snapshots(d), False),
+        ("rebuild_daily_rollup[monat]", lambda: db.rebuild_daily_rollup(
+            d, s["last_day"][:8] + "01", s["last_day"]), False),
+        ("rebuild_stock_summary", lambda: db.rebuild_stock_summary(d), False),
+        ("read_transaction", lambda: db.read_transaction(d, lambda con: con.execute("SELECT 1").fetchone()), True),
+        ("write_transaction", lambda: db.write_transaction(d, lambda con: None), False),
+    ]
+
+
+class _Upload(io.BytesIO):
+    name = "bench.pdf"
+    type = "application/pdf"
+
+
+def _storage_cases(data_dir: str, s: dict):
+    d = data_dir
+    payload = os.urandom(2 * 2**20)
+    docs = db.get_documents_for_movement(d, s["doc_movement_id"] or 1)
+    lazy = [storage.open_document(d, int(i)) for i in docs["id"]] or []
+
+    def _zip():
+        with storage.build_zip(lazy):
+            pass
+
+    return [
+        ("blob_path", lambda: storage.blob_path(d, "ab" * 32), True),
+        ("save_upload[2MiB neu]", lambda: storage.save_upload(d, _Upload(os.urandom(2 * 2**20))), False),
+        ("save_upload[2MiB dedup]", lambda: storage.save_upload(d, _Upload(payload)), False),
+        ("open_document", lambda: storage.open_document(d, s["document_id"] or 1), True),
+        ("LazyDocument.read", lambda: lazy and lazy[0].read(), True),
+        ("write_zip", lambda: storage.write_zip(lazy, io.BytesIO()), True),
+        ("build_zip", _zip, True),
+        ("gc_uploads", lambda: storage.gc_uploads(d), False),
+    ]
+
+
+def _widget_in(tab):
+    """Erstes Widget eines Tabs, das einen Rerun auslösen kann (oder None)."""
+    for kind in ("selectbox", "date_input", "text_input", "checkbox", "radio", "number_input"):
+        widgets = getattr(tab, kind)
+        if len(widgets):
+            return widgets[0]
+    return None
+
+
+def _app_results(data_dir: str, repeat: int) -> list:
+    from streamlit.testing.v1 import AppTest
+
+    os.environ.setdefault("APP_PASSWORD", "bench")
+    at = AppTest.from_file(APP_FILE, default_timeout=600)
+    at.secrets["DATA_DIR"] = data_dir
+    at.session_state["authed"] = True
+
+    results = [measure("app:erster Lauf", lambda: (db.clear_cache(), at.run()), repeat=1, group="app")]
+    if at.exception:
+        raise RuntimeError(f"app.py: {at.exception[0].message}")
+    results.append(measure("app:Rerun (warm)", at.run, repeat, group="app"))
+    results.append(measure("app:Rerun (kalt)", at.run, repeat, setup=db.clear_cache, group="app"))
+
+    def touch(i):
+        # Elemente gehören immer zum letzten Lauf, daher je Wiederholung neu suchen
+        widget = _widget_in(at.tabs[i])
+        widget.set_value(widget.value).run()
+
+    for i, tab in enumerate(at.tabs):
+        if _widget_in(tab) is not None:
+            results.append(measure(f"app:{tab.label}", lambda i=i: touch(i), repeat, group="app"))
+    return results
+
+
+def _meta(data_dir: str) -> dict:
+    root = os.path.dirname(APP_FILE)
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    with sqlite3.connect(db._db_path(data_dir)) as con:
+        counts = {t: con.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                  for t in ("items", "locations", "lots", "movements", "inventory", "documents")}
+    return {
+        "commit": commit,
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "db_bytes": os.path.getsize(db._db_path(data_dir)),
+        "rows": counts,
+    }
+
+
+def run(data_dir: str, repeat: int = REPEAT, only=("db", "storage", "app"), log=print) -> dict:
+    db.init_db(data_dir)
+    s = _sample(data_dir)
+    results = []
+    groups = [("db", _db_cases), ("storage", _storage_cases)]
+    for group, cases in groups:
+        if group not in only:
+            continue
+        for name, fn, reading in cases(data_dir, s):
+            r = measure(name, fn, repeat, setup=db.clear_cache if reading else None, group=group)
+            log(f"{group:8} {name:40} p50 {r['p50_ms']:10.2f} ms  p95 {r['p95_ms']:10.2f} ms  "
+                f"RSS {r['peak_rss_mib']:8.1f} MiB")
+            results.append(r)
+    if "app" in only:
+        for r in _app_results(data_dir, repeat):
+            log(f"{'app':8} {r['name'][4:]:40} p50 {r['p50_ms']:10.2f} ms  p95 {r['p95_ms']:10.2f} ms  "
+                f"RSS {r['peak_rss_mib']:8.1f} MiB")
+            results.append(r)
+    return {"meta": _meta(data_dir), "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.run", description="Benchmarks für db, storage und app")
+    parser.add_argument("data_dir", nargs="?", help="Datenverzeichnis (Default: frische Daten per bench.generate)")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--out", help="JSON-Ergebnis hierhin schreiben (Default: stdout)")
+    parser.add_argument("--only", default="db,storage,app", help="Auswahl aus db,storage,app")
+    args = parser.parse_args(argv)
+
+    data_dir = args.data_dir
+    if data_dir is None:
+        from bench.generate import generate
+        data_dir = tempfile.mkdtemp(prefix="lager-bench-")
+        generate(data_dir, log=lambda msg: print(msg, file=sys.stderr))
+    report = run(data_dir, args.repeat, tuple(args.only.split(",")), log=lambda msg: print(msg, file=sys.stderr))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
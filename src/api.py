@@ -0,0 +1,520 @@
+"""HTTP/JSON-Schnittstelle ohne UI (Scanner, ERP-Anbindung).
+
+Reiner asyncio-Server aus der Standardbibliothek (HTTP/1.1, Keep-Alive,
+Content-Length). Blockierende SQLite-Arbeit läuft in zwei begrenzten
+Thread-Pools: eine Schreib-Spur, deren Threads ihre Transaktionen an den
+Schreib-Thread von src/db.py übergeben (gleichzeitige Buchungen landen dort in
+einem gemeinsamen Commit), und eine Lese-Spur mit mehreren Threads, jeweils
+mit eigener gepoolter Verbindung. Ist die Schreibwarteschlange voll, antwortet
+der Dienst mit 503.
+
+    GET  /health
+    GET  /items | /locations | /lots
+    GET  /inventory?sku=&lot_id=&location_id=
+    GET  /inventory/as-of?date=YYYY-MM-DD
+    GET  /inventory/summary?by=total|item|location      Bestandssummen
+    GET  /movements?typ=&partner=&from=&to=&after_id=&limit=&archive=1   archive=1: inkl. Jahresarchive
+    GET  /movements/search?q=&typ=&partner=&from=&to=&limit=
+    GET  /reports/movements?typ=&group_by=&from=&to=
+    POST /items {sku, name} | /locations {code, description} | /lots {item_id, batch, mhd}
+    POST /movements {typ, lines: [{lot_id, location_id, paletten, koli}], partner, reference, notes, datum}
+    POST /movements/fefo {order: [{item_id, paletten, koli}], partner, reference, notes, datum, min_mhd}
+    GET  /reservations?status=offen|gebucht|freigegeben|abgelaufen|alle&lot_id=&location_id=
+    POST /reservations {lot_id, location_id, paletten, koli, partner, reference, ttl_minutes}
+    POST /reservations/{id}/commit {datum, partner, reference, notes}   bucht den Versand
+    POST /reservations/{id}/release
+    POST /batch {requests: [{method, path, body}]}        mehrere JSON-Anfragen in einem Aufruf
+    GET  /movements/{id}/documents
+    POST /movements/{id}/documents?filename=              Rohdaten im Body, gestreamt
+    GET  /documents/{id}                                  Datei, gestreamt
+    GET  /exports/movements?format=csv|jsonl&typ=&partner=&from=&to=&archive=1
+    GET  /exports/inventory?format=csv|jsonl               gestreamt (chunked)
+
+Ist LAGER_API_TOKEN gesetzt, muss jede Anfrage "Authorization: Bearer <token>"
+mitschicken.
+
+Aufruf: python -m src.cli serve [--host 127.0.0.1] [--port 8502]
+"""
+import os
+import re
+import json
+import asyncio
+import logging
+import sqlite3
+import functools
+import mimetypes
+from http import HTTPStatus
+from datetime import date
+from urllib.parse import urlsplit, parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from src import db, storage, export
+
+HOST = os.environ.get("LAGER_API_HOST", "127.0.0.1")
+PORT = int(os.environ.get("LAGER_API_PORT", "8502"))
+API_TOKEN = os.environ.get("LAGER_API_TOKEN")
+READ_WORKERS = int(os.environ.get("LAGER_API_READERS", "4"))
+WRITE_WORKERS = int(os.environ.get("LAGER_API_WRITERS", "8"))
+# Aufträge je Spur, die gleichzeitig laufen oder warten dürfen (Rückstau statt Speicherwachstum)
+MAX_PENDING = int(os.environ.get("LAGER_API_MAX_PENDING", "64"))
+MAX_HEADER_BYTES = 16 * 1024
+MAX_JSON_BYTES = 8 * 1024 * 1024
+MAX_BATCH = 100
+KEEPALIVE_SECONDS = 30
+
+log = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class _Lane:
+    """Begrenzter Thread-Pool; Aufrufer warten, wenn MAX_PENDING erreicht ist."""
+
+    def __init__(self, workers: int, name: str, max_pending: int = MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"api-{name}")
+        self.slots = asyncio.Semaphore(max_pending)
+
+    async def run(self, fn, *args, **kwargs):
+        async with self.slots:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class _BodyReader:
+    """Dateiähnlicher Lesezugriff (für storage.save_upload im Worker-Thread) auf den
+    Request-Body; holt die Daten blockweise aus dem asyncio-Stream."""
+
+    def __init__(self, reader, length: int, loop, name: str, mime: str):
+        self._reader = reader
+        self._remaining = length
+        self._loop = loop
+        self.name = name
+        self.type = mime
+
+    def read(self, size: int = -1) -> bytes:
+        if self._remaining <= 0:
+            return b""
+        n = self._remaining if size is None or size < 0 else min(size, self._remaining)
+        chunk = asyncio.run_coroutine_threadsafe(self._reader.read(n), self._loop).result()
+        if not chunk:
+            raise HTTPError(400, "Body kürzer als Content-Length.")
+        self._remaining -= len(chunk)
+        return chunk
+
+
+def _json_bytes(payload) -> bytes:
+    if isinstance(payload, pd.DataFrame):
+        return payload.to_json(orient="records", force_ascii=False).encode("utf-8")
+    return json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+
+
+def _int(query: dict, name: str, default=None):
+    value = query.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPError(400, f"'{name}' muss eine Zahl sein.") from None
+
+
+def _date(values: dict, name: str, default=None):
+    value = values.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        day = date.fromisoformat(value).isoformat()
+    except (TypeError, ValueError):
+        day = None
+    # nur die Form JJJJ-MM-TT (fromisoformat nähme auch 20260331 an)
+    if day != value:
+        raise HTTPError(400, f"'{name}' muss ein Datum JJJJ-MM-TT sein.")
+    return day
+
+
+def _flag(query: dict, name: str) -> bool:
+    return query.get(name, "").lower() in ("1", "true", "ja")
+
+
+def _require(body: dict, *names):
+    if not isinstance(body, dict):
+        raise HTTPError(400, "JSON-Objekt erwartet.")
+    missing = [n for n in names if body.get(n) in (None, "")]
+    if missing:
+        raise HTTPError(400, f"Pflichtfelder fehlen: {', '.join(missing)}")
+
+
+class Service:
+    def __init__(self, data_dir: str, read_workers: int = READ_WORKERS, token: str = API_TOKEN):
+        self.data_dir = data_dir
+        self.token = token
+        self.reads = _Lane(read_workers, "read")
+        self.writes = _Lane(WRITE_WORKERS, "write")
+        # (methode, regex, handler); Handler: async (match, query, body) -> payload
+        self.routes = [
+            ("GET", r"/health", self._health),
+            ("GET", r"/items", self._read(db.get_items)),
+            ("GET", r"/locations", self._read(db.get_locations)),
+            ("GET", r"/lots", self._read(db.get_lots)),
+            ("GET", r"/inventory", self._inventory),
+            ("GET", r"/inventory/as-of", self._inventory_as_of),
+            ("GET", r"/inventory/summary", self._inventory_summary),
+            ("GET", r"/movements", self._movements),
+            ("GET", r"/movements/search", self._search),
+            ("GET", r"/reports/movements", self._report),
+            ("GET", r"/movements/(\d+)/documents", self._documents),
+            ("POST", r"/items", self._add_item),
+            ("POST", r"/locations", self._add_location),
+            ("POST", r"/lots", self._add_lot),
+            ("POST", r"/movements", self._book),
+            ("POST", r"/movements/fefo", self._book_fefo),
+            ("GET", r"/reservations", self._reservations),
+            ("POST", r"/reservations", self._reserve),
+            ("POST", r"/reservations/(\d+)/commit", self._commit_reservation),
+            ("POST", r"/reservations/(\d+)/release", self._release_reservation),
+            ("POST", r"/batch", self._batch),
+        ]
+        self.routes = [(m, re.compile(p + r"\Z"), h) for m, p, h in self.routes]
+
+    # -------- JSON-Endpunkte --------
+    async def _health(self, match, query, body):
+        return {"ok": True, "data_dir": os.path.abspath(self.data_dir)}
+
+    def _read(self, fn):
+        async def handler(match, query, body):
+            return await self.reads.run(fn, self.data_dir)
+        return handler
+
+    async def _inventory(self, match, query, body):
+        return await self.reads.run(db.get_inventory, self.data_dir, sku=query.get("sku") or None,
+                                    lot_id=_int(query, "lot_id"), location_id=_int(query, "location_id"))
+
+    async def _inventory_as_of(self, match, query, body):
+        if not query.get("date"):
+            raise HTTPError(400, "Parameter 'date' fehlt.")
+        return await self.reads.run(db.get_inventory_as_of, self.data_dir, _date(query, "date"))
+
+    async def _inventory_summary(self, match, query, body):
+        by = query.get("by", "total")
+        fn = {"total": db.get_stock_totals, "item": db.get_stock_by_item, "location": db.get_stock_by_location}.get(by)
+        if fn is None:
+            raise HTTPError(400, "'by' muss total, item oder location sein.")
+        return await self.reads.run(fn, self.data_dir)
+
+    async def _movements(self, match, query, body):
+        return await self.reads.run(
+            db.query_movements, self.data_dir, typ=query.get("typ") or None,
+            partner_like=query.get("partner") or None, date_from=query.get("from") or None,
+            date_to=query.get("to") or None, after_id=_int(query, "after_id"),
+            limit=min(_int(query, "limit", 500), 5000), include_archive=_flag(query, "archive"))
+
+    async def _search(self, match, query, body):
+        if not query.get("q", "").strip():
+            raise HTTPError(400, "Parameter 'q' fehlt.")
+        return await self.reads.run(
+            db.search_movements, self.data_dir, query["q"], typ=query.get("typ") or None,
+            partner_like=query.get("partner") or None, date_from=query.get("from") or None,
+            date_to=query.get("to") or None, limit=min(_int(query, "limit", 100), 1000))
+
+    async def _report(self, match, query, body):
+        return await self.reads.run(
+            db.get_movement_report, self.data_dir, typ=query.get("typ", "OUT"),
+            group_by=query.get("group_by", "partner"), date_from=query.get("from") or None,
+            date_to=query.get("to") or None)
+
+    async def _documents(self, match, query, body):
+        docs = await self.reads.run(db.get_documents_for_movement, self.data_dir, int(match.group(1)))
+        return docs.drop(columns=["stored_path"])
+
+    async def _add_item(self, match, query, body):
+        _require(body, "sku", "name")
+        await self.writes.run(db.add_item, self.data_dir, str(body["sku"]).strip(), str(body["name"]).strip())
+        return {"ok": True}
+
+    async def _add_location(self, match, query, body):
+        _require(body, "code")
+        await self.writes.run(db.add_location, self.data_dir, str(body["code"]).strip(),
+                              str(body.get("description") or "").strip())
+        return {"ok": True}
+
+    async def _add_lot(self, match, query, body):
+        _require(body, "item_id", "batch")
+        await self.writes.run(db.add_lot, self.data_dir, int(body["item_id"]), str(body["batch"]).strip(),
+                              _date(body, "mhd"))
+        return {"ok": True}
+
+    async def _book(self, match, query, body):
+        _require(body, "typ", "lines", "datum")
+        if not isinstance(body["lines"], list) or not all(isinstance(ln, dict) for ln in body["lines"]):
+            raise HTTPError(400, "'lines' muss eine Liste von Objekten sein.")
+        lines = [(ln.get("lot_id"), ln.get("location_id"), ln.get("paletten", 0), ln.get("koli", 0))
+                 for ln in body["lines"]]
+        ids = await self.writes.run(
+            db.book_movements, self.data_dir, body["typ"], lines, body.get("partner") or "",
+            body.get("reference") or "", body.get("notes") or "", _date(body, "datum"))
+        return {"ids": ids}
+
+    async def _book_fefo(self, match, query, body):
+        _require(body, "order", "datum")
+        if not isinstance(body["order"], list) or not all(isinstance(ln, dict) for ln in body["order"]):
+            raise HTTPError(400, "'order' muss eine Liste von Objekten sein.")
+        order = [(ln.get("item_id"), ln.get("paletten", 0), ln.get("koli", 0)) for ln in body["order"]]
+        ids = await self.writes.run(
+            db.book_fefo, self.data_dir, order, body.get("partner") or "", body.get("reference") or "",
+            body.get("notes") or "", _date(body, "datum"), min_mhd=_date(body, "min_mhd"))
+        return {"ids": ids}
+
+    async def _reservations(self, match, query, body):
+        status = query.get("status", "offen")
+        return await self.reads.run(db.get_reservations, self.data_dir, status=None if status == "alle" else status,
+                                    lot_id=_int(query, "lot_id"), location_id=_int(query, "location_id"))
+
+    async def _reserve(self, match, query, body):
+        _require(body, "lot_id", "location_id")
+        res_id = await self.writes.run(
+            db.reserve_stock, self.data_dir, int(body["lot_id"]), int(body["location_id"]),
+            int(body.get("paletten") or 0), int(body.get("koli") or 0), body.get("partner") or "",
+            body.get("reference") or "", ttl_minutes=body.get("ttl_minutes") or None)
+        return {"id": res_id}
+
+    async def _commit_reservation(self, match, query, body):
+        _require(body, "datum")
+        movement_id = await self.writes.run(
+            db.commit_reservation, self.data_dir, int(match.group(1)), _date(body, "datum"), body.get("partner") or "",
+            body.get("reference") or "", body.get("notes") or "")
+        return {"id": movement_id}
+
+    async def _release_reservation(self, match, query, body):
+        await self.writes.run(db.release_reservation, self.data_dir, int(match.group(1)))
+        return {"ok": True}
+
+    async def _batch(self, match, query, body):
+        _require(body, "requests")
+        requests = body["requests"]
+        if not isinstance(requests, list) or len(requests) > MAX_BATCH:
+            raise HTTPError(400, f"'requests' muss eine Liste mit höchstens {MAX_BATCH} Einträgen sein.")
+        results = []
+        for req in requests:
+            if not isinstance(req, dict) or req.get("path", "").startswith("/batch"):
+                results.append({"status": 400, "body": {"error": "Ungültige Teilanfrage."}})
+                continue
+            status, payload = await self.dispatch(req.get("method", "GET").upper(), req.get("path", ""),
+                                                  req.get("body"))
+            # DataFrames als Liste von Objekten einbetten
+            results.append({"status": status, "body": json.loads(_json_bytes(payload))})
+        return {"results": results}
+
+    async def dispatch(self, method: str, target: str, body):
+        """Führt eine JSON-Anfrage aus und gibt (status, payload) zurück."""
+        parts = urlsplit(target)
+        query = dict(parse_qsl(parts.query))
+        allowed = False
+        for m, pattern, handler in self.routes:
+            match = pattern.match(parts.path)
+            if not match:
+                continue
+            allowed = True
+            if m != method:
+                continue
+            try:
+                return (201 if method == "POST" else 200), await handler(match, query, body)
+            except HTTPError as e:
+                return e.status, {"error": e.message}
+            except db.BookingError as e:
+                return 409, {"error": str(e)}
+            except db.WriteQueueFull as e:
+                return 503, {"error": f"Überlastet, bitte erneut versuchen ({e})."}
+            except sqlite3.IntegrityError as e:
+                return 409, {"error": f"Konflikt: {e}"}
+            except (ValueError, TypeError, KeyError) as e:
+                return 400, {"error": str(e)}
+            except Exception:
+                log.exception("Fehler bei %s %s", method, target)
+                return 500, {"error": "Interner Fehler."}
+        if allowed:
+            return 405, {"error": "Methode nicht erlaubt."}
+        return 404, {"error": "Unbekannter Pfad."}
+
+    # -------- Streaming-Endpunkte --------
+    async def _upload(self, writer, reader, movement_id: int, query: dict, headers: dict, length: int):
+        exists = await self.reads.run(db.read_transaction, self.data_dir, lambda con: con.execute(
+            "SELECT 1 FROM movements WHERE id=?", (movement_id,)).fetchone())
+        if not exists:
+            raise HTTPError(404, "Bewegung nicht gefunden.")
+        filename = os.path.basename(query.get("filename") or "") or f"dokument_{movement_id}"
+        mime = headers.get("content-type") or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        body = _BodyReader(reader, length, asyncio.get_running_loop(), filename, mime)
+        # Hashen und Ablegen ohne Schreibsperre, erst der Datensatz geht über die Schreib-Spur
+        stored, mime, size, sha = await self.reads.run(storage.save_upload, self.data_dir, body)
+        await self.writes.run(db.add_document, self.data_dir, movement_id, filename, stored, mime, size, sha)
+        return {"ok": True, "sha256": sha, "size_bytes": size}
+
+    async def _download(self, writer, document_id: int, keep_alive: bool):
+        doc = await self.reads.run(storage.open_document, self.data_dir, document_id)
+        if doc is None or not os.path.exists(doc.path):
+            raise HTTPError(404, "Dokument nicht gefunden.")
+        name = doc.filename.replace('"', "")
+        await self._head(writer, 200, doc.mime, doc.size, keep_alive,
+                         {"Content-Disposition": f'attachment; filename="{name}"'})
+        chunks = doc.chunks()
+        try:
+            while True:
+                chunk = await self.reads.run(next, chunks, None)
+                if chunk is None:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            chunks.close()
+
+    async def _export(self, writer, what: str, query: dict, keep_alive: bool):
+        fmt = query.get("format", "csv")
+        if fmt not in export.FORMATS:
+            raise HTTPError(400, f"Unbekanntes Format '{fmt}' (csv oder jsonl).")
+        if what == "movements":
+            chunks = export.export_movements(self.data_dir, fmt, typ=query.get("typ") or None,
+                                             partner_like=query.get("partner") or None,
+                                             date_from=query.get("from") or None, date_to=query.get("to") or None,
+                                             include_archive=_flag(query, "archive"))
+        else:
+            chunks = export.export_inventory(self.data_dir, fmt)
+        mime, ext = export.FORMATS[fmt]
+        try:
+            # erster Block vor den Headern, damit Fehler noch als JSON gemeldet werden können
+            chunk = await self.reads.run(next, chunks, b"")
+            await self._head(writer, 200, mime, None, keep_alive,
+                             {"Content-Disposition": f'attachment; filename="{what}{ext}"'})
+            while chunk:
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                await writer.drain()
+                chunk = await self.reads.run(next, chunks, b"")
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            await self.reads.run(chunks.close)
+
+    # -------- HTTP --------
+    async def _head(self, writer, status: int, content_type: str, length: int, keep_alive: bool, extra=None):
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+                 f"Content-Type: {content_type}",
+                 f"Content-Length: {length}" if length is not None else "Transfer-Encoding: chunked",
+                 "Connection: " + ("keep-alive" if keep_alive else "close")]
+        lines += [f"{k}: {v}" for k, v in (extra or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+    async def _respond(self, writer, status: int, payload, keep_alive: bool):
+        data = _json_bytes(payload)
+        await self._head(writer, status, "application/json; charset=utf-8", len(data), keep_alive)
+        writer.write(data)
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_SECONDS)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 431, {"error": "Header zu groß."}, False)
+                    break
+                keep_alive = await self._handle_one(reader, writer, head)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _handle_one(self, reader, writer, head: bytes) -> bool:
+        try:
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            method, target, version = request_line.split(" ", 2)
+        except ValueError:
+            await self._respond(writer, 400, {"error": "Ungültige Anfrage."}, False)
+            return False
+        headers = {}
+        for line in header_lines:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+        conn = headers.get("connection", "").lower()
+        keep_alive = conn != "close" and (version == "HTTP/1.1" or conn == "keep-alive")
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            await self._respond(writer, 411, {"error": "Bitte Content-Length statt chunked senden."}, False)
+            return False
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            await self._respond(writer, 400, {"error": "Ungültige Content-Length."}, False)
+            return False
+
+        parts = urlsplit(target)
+        upload = re.fullmatch(r"/movements/(\d+)/documents", parts.path) if method == "POST" else None
+        download = re.fullmatch(r"/documents/(\d+)", parts.path) if method == "GET" else None
+        exporting = re.fullmatch(r"/exports/(movements|inventory)", parts.path) if method == "GET" else None
+        try:
+            if self.token and headers.get("authorization") != f"Bearer {self.token}":
+                raise HTTPError(401, "Nicht angemeldet.")
+            if upload:
+                payload = await self._upload(writer, reader, int(upload.group(1)), dict(parse_qsl(parts.query)),
+                                             headers, length)
+                await self._respond(writer, 201, payload, keep_alive)
+                return keep_alive
+            if download:
+                await self._download(writer, int(download.group(1)), keep_alive)
+                return keep_alive
+            if exporting:
+                await self._export(writer, exporting.group(1), dict(parse_qsl(parts.query)), keep_alive)
+                return keep_alive
+            if length > MAX_JSON_BYTES:
+                raise HTTPError(413, "Anfrage zu groß.")
+            raw = await reader.readexactly(length) if length else b""
+            try:
+                body = json.loads(raw) if raw else None
+            except ValueError:
+                raise HTTPError(400, "Ungültiges JSON.") from None
+        except HTTPError as e:
+            # Nicht gelesener Body würde die Verbindung verschieben: danach schließen
+            await self._respond(writer, e.status, {"error": e.message}, False)
+            return False
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return False
+        except Exception:
+            log.exception("Fehler bei %s %s", method, target)
+            await self._respond(writer, 500, {"error": "Interner Fehler."}, False)
+            return False
+        status, payload = await self.dispatch(method, target, body)
+        await self._respond(writer, status, payload, keep_alive)
+        return keep_alive
+
+    def close(self):
+        self.writes.shutdown()
+        self.reads.shutdown()
+
+
+async def serve(data_dir: str, host: str = HOST, port: int = PORT, ready=None):
+    """Startet den Dienst und läuft bis zum Abbruch. ready(server) wird nach dem
+    Binden aufgerufen (z.B. für Tests mit port=0)."""
+    db.init_db(data_dir)
+    service = Service(data_dir)
+    server = await asyncio.start_server(service.handle, host, port, limit=MAX_HEADER_BYTES)
+    if ready:
+        ready(server)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
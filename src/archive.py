@@ -0,0 +1,262 @@
+"""Archivierung alter Bewegungen in Jahresdateien (DATA_DIR/archive/movements_<jahr>.db).
+
+Ein Lauf archiviert alle Bewegungen bis zum Stichtag (letztes Monatsende vor
+heute − ARCHIVE_KEEP_DAYS bzw. vor `before`) samt ihrer Dokumentzeilen:
+
+1. Fehlende Monatsend-Snapshots bis zum Stichtag anlegen und den Zeitraum
+   schließen (archive_state); Buchungen dorthin lehnt ein Trigger ab.
+2. Je Jahr die Zeilen in die Jahresdatei kopieren und dort committen.
+3. In einer Transaktion der Hauptdatenbank: inkrementeller Abgleich
+   (src.ledger), zeilengenauer Vergleich Haupt- gegen Jahresdatei,
+   archive_balances fortschreiben, die kopierten Zeilen löschen.
+   Tagesverdichtung, Snapshots, Bestand und Blob-Referenzen bleiben dabei
+   unverändert (maintenance_flags 'archiv').
+
+Bricht ein Lauf zwischen 2. und 3. ab, stehen Zeilen in beiden Dateien; ein
+neuer Lauf kopiert sie erneut (INSERT OR REPLACE) und löscht sie dann.
+Lesende Abfragen über archivierte Zeiträume: db.query_movements(...,
+include_archive=True), db.iter_movements, db.get_inventory_as_of; Dokumente
+archivierter Bewegungen findet db über die id-Bereiche in archive_log.
+"""
+import os
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from src import db, ledger
+
+ARCHIVE_KEEP_DAYS = int(os.environ.get("LAGER_ARCHIVE_KEEP_DAYS", "730"))
+
+_MOVEMENTS_DDL = """
+    CREATE TABLE IF NOT EXISTS arch.movements (
+        id INTEGER PRIMARY KEY,
+        typ TEXT NOT NULL,
+        lot_id INTEGER NOT NULL,
+        location_id INTEGER NOT NULL,
+        paletten INTEGER NOT NULL,
+        koli INTEGER NOT NULL,
+        partner TEXT,
+        reference TEXT,
+        notes TEXT,
+        datum TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )
+"""
+_DOCUMENTS_DDL = """
+    CREATE TABLE IF NOT EXISTS arch.documents (
+        id INTEGER PRIMARY KEY,
+        movement_id INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        stored_path TEXT NOT NULL,
+        mime TEXT,
+        size_bytes INTEGER,
+        uploaded_at TEXT NOT NULL,
+        sha256 TEXT
+    )
+"""
+_MOVEMENT_COLS = db.ARCHIVE_COLUMNS["movements"]
+_DOCUMENT_COLS = db.ARCHIVE_COLUMNS["documents"]
+# Bewegungen eines Jahres bis zum Stichtag: datum in [:von, :bis)
+_RANGE = "datum >= :von AND datum < :bis"
+_DOCS_OF_RANGE = f"movement_id IN (SELECT id FROM main.movements WHERE {_RANGE})"
+
+
+class ArchiveError(RuntimeError):
+    """Archivierung abgebrochen; die Hauptdatenbank ist unverändert."""
+
+
+class ArchiveReport:
+    def __init__(self, cutoff: str, years: pd.DataFrame):
+        self.cutoff = cutoff
+        self.years = years
+
+    @property
+    def movements(self) -> int:
+        return int(self.years["bewegungen"].sum()) if not self.years.empty else 0
+
+    def summary(self) -> str:
+        if self.years.empty:
+            return f"Archivierung bis {self.cutoff}: nichts zu archivieren."
+        per_year = ", ".join(f"{r.jahr}: {r.bewegungen}" for r in self.years.itertuples())
+        return (f"Archivierung bis {self.cutoff}: {self.movements} Bewegungen, "
+                f"{int(self.years['dokumente'].sum())} Dokumente ({per_year}).")
+
+
+def _now():
+    return datetime.utcnow().isoformat(timespec="seconds")
+
+
+def default_cutoff(before=None) -> str:
+    """Letztes Monatsende vor `before` (Default: heute − ARCHIVE_KEEP_DAYS)."""
+    before = date.fromisoformat(str(before)[:10]) if before else date.today() - timedelta(days=ARCHIVE_KEEP_DAYS)
+    return (before.replace(day=1) - timedelta(days=1)).isoformat()
+
+
+def _bounds(year: int, cutoff: str):
+    """(:von, :bis) der Bewegungen eines Jahres bis einschließlich Stichtag."""
+    day_after = (date.fromisoformat(cutoff) + timedelta(days=1)).isoformat()
+    return {"von": f"{year:04d}-01-01", "bis": min(f"{year + 1:04d}-01-01", day_after)}
+
+
+def plan_archive(data_dir: str, before=None) -> pd.DataFrame:
+    """Was ein Lauf archivieren würde: Bewegungen je Jahr bis zum Stichtag."""
+    cutoff = default_cutoff(before)
+    return db.read_transaction(data_dir, lambda con: pd.read_sql_query("""
+        SELECT CAST(substr(datum,1,4) AS INTEGER) AS jahr, COUNT(*) AS bewegungen,
+               MIN(datum) AS von, MAX(datum) AS bis
+        FROM movements WHERE datum < ?
+        GROUP BY 1 ORDER BY 1
+    """, con, params=((date.fromisoformat(cutoff) + timedelta(days=1)).isoformat(),)))
+
+
+def _close_period(con, cutoff: str):
+    if not con.in_transaction:
+        con.execute("BEGIN IMMEDIATE")
+    con.execute(
+        "INSERT INTO archive_state(id, cutoff, updated_at) VALUES (1, ?, ?) "
+        "ON CONFLICT(id) DO UPDATE SET cutoff = MAX(cutoff, excluded.cutoff), updated_at = excluded.updated_at",
+        (cutoff, _now())
+    )
+
+
+def _copy_year(con, year: int, bounds: dict):
+    con.execute(_MOVEMENTS_DDL)
+    con.execute("CREATE INDEX IF NOT EXISTS arch.ix_movements_datum ON movements(datum)")
+    con.execute(_DOCUMENTS_DDL)
+    con.execute("CREATE INDEX IF NOT EXISTS arch.ix_documents_movement ON documents(movement_id, id)")
+    con.execute("BEGIN")
+    try:
+        con.execute(f"INSERT OR REPLACE INTO arch.movements({_MOVEMENT_COLS}) "
+                    f"SELECT {_MOVEMENT_COLS} FROM main.movements WHERE {_RANGE}", bounds)
+        con.execute(f"INSERT OR REPLACE INTO arch.documents({_DOCUMENT_COLS}) "
+                    f"SELECT {_DOCUMENT_COLS} FROM main.documents WHERE {_DOCS_OF_RANGE}", bounds)
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+
+
+def _move_year(con, year: int, bounds: dict, cutoff: str) -> dict:
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        report = ledger.check_in_transaction(con)
+        if not report.ok:
+            raise ArchiveError(f"{report.summary()} Erst abgleichen (check-ledger --repair), dann archivieren.")
+        missing = con.execute(f"""
+            SELECT (SELECT COUNT(*) FROM (SELECT {_MOVEMENT_COLS} FROM main.movements WHERE {_RANGE}
+                                          EXCEPT SELECT {_MOVEMENT_COLS} FROM arch.movements)),
+                   (SELECT COUNT(*) FROM (SELECT {_DOCUMENT_COLS} FROM main.documents WHERE {_DOCS_OF_RANGE}
+                                          EXCEPT SELECT {_DOCUMENT_COLS} FROM arch.documents))
+        """, bounds).fetchone()
+        if any(missing):
+            raise ArchiveError(f"Jahresarchiv {year} unvollständig ({missing[0]} Bewegungen, "
+                               f"{missing[1]} Dokumente fehlen oder weichen ab).")
+        n, n_docs, p_in, k_in, p_out, k_out, *ids = con.execute(f"""
+            SELECT COUNT(*),
+                   (SELECT COUNT(*) FROM main.documents WHERE {_DOCS_OF_RANGE}),
+                   COALESCE(SUM(CASE typ WHEN 'IN' THEN paletten END), 0),
+                   COALESCE(SUM(CASE typ WHEN 'IN' THEN koli END), 0),
+                   COALESCE(SUM(CASE typ WHEN 'OUT' THEN paletten END), 0),
+                   COALESCE(SUM(CASE typ WHEN 'OUT' THEN koli END), 0),
+                   MIN(id), MAX(id),
+                   (SELECT MIN(id) FROM main.documents WHERE {_DOCS_OF_RANGE}),
+                   (SELECT MAX(id) FROM main.documents WHERE {_DOCS_OF_RANGE})
+            FROM main.movements WHERE {_RANGE}
+        """, bounds).fetchone()
+        if n:
+            con.execute(f"""
+                INSERT INTO archive_balances(lot_id, location_id, paletten, koli)
+                SELECT lot_id, location_id,
+                       SUM(CASE typ WHEN 'OUT' THEN -paletten ELSE paletten END),
+                       SUM(CASE typ WHEN 'OUT' THEN -koli ELSE koli END)
+                FROM main.movements WHERE {_RANGE}
+                GROUP BY lot_id, location_id
+                ON CONFLICT(lot_id, location_id) DO UPDATE SET
+                    paletten = paletten + excluded.paletten,
+                    koli = koli + excluded.koli
+            """, bounds)
+            con.execute("INSERT OR IGNORE INTO maintenance_flags(name) VALUES ('archiv')")
+            con.execute(f"DELETE FROM main.documents WHERE {_DOCS_OF_RANGE}", bounds)
+            con.execute(f"DELETE FROM main.movements WHERE {_RANGE}", bounds)
+            con.execute("DELETE FROM maintenance_flags WHERE name = 'archiv'")
+            con.execute(
+                """INSERT INTO archive_log(year, cutoff, path, movements, documents, paletten_in, koli_in,
+                                           paletten_out, koli_out, archived_at, movement_id_min, movement_id_max,
+                                           document_id_min, document_id_max) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+                (year, cutoff, os.path.relpath(db.archive_path(".", year)), n, n_docs, p_in, k_in, p_out, k_out,
+                 _now(), *ids)
+            )
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+    return {"jahr": year, "bewegungen": n, "dokumente": n_docs}
+
+
+def archive_movements(data_dir: str, before=None, log=None) -> ArchiveReport:
+    """Verschiebt Bewegungen (und deren Dokumentzeilen) bis zum Stichtag in die
+    Jahresdateien; siehe Moduldoku. Gibt einen ArchiveReport zurück."""
+    cutoff = default_cutoff(before)
+    plan = plan_archive(data_dir, before)
+    if plan.empty:
+        return ArchiveReport(cutoff, pd.DataFrame(columns=["jahr", "bewegungen", "dokumente"]))
+    # Stichtagsabfragen brauchen danach einen Snapshot am Stichtag
+    db.build_inventory_snapshots(data_dir, cutoff)
+    db.write_transaction(data_dir, _close_period, cutoff)
+
+    os.makedirs(os.path.join(data_dir, db.ARCHIVE_DIR), exist_ok=True)
+    done = []
+    for year in plan["jahr"]:
+        bounds = _bounds(int(year), cutoff)
+        with db.archive_connection(data_dir, int(year)) as con:
+            _copy_year(con, int(year), bounds)
+            done.append(_move_year(con, int(year), bounds, cutoff))
+        if log:
+            log(f"{year}: {done[-1]['bewegungen']} Bewegungen archiviert")
+    return ArchiveReport(cutoff, pd.DataFrame(done))
+
+
+def verify_archive(data_dir: str) -> list:
+    """Prüft die Jahresarchive gegen archive_log (Anzahl und Summen je Jahr),
+    auf Überschneidungen mit der Hauptdatenbank und per vollem Abgleich den
+    Bestand gegen archive_balances + Bewegungen. Gibt die Befunde zurück
+    (leer = in Ordnung)."""
+    problems = []
+    info = db.get_archive_info(data_dir)
+    cutoff = db.get_archive_cutoff(data_dir)
+    for r in info.itertuples():
+        path = db.archive_path(data_dir, r.jahr)
+        if not os.path.exists(path):
+            problems.append(f"{r.jahr}: Archivdatei fehlt ({path}).")
+            continue
+        with db.archive_connection(data_dir, r.jahr) as con:
+            got = con.execute("""
+                SELECT COUNT(*),
+                       (SELECT COUNT(*) FROM arch.documents),
+                       COALESCE(SUM(CASE typ WHEN 'IN' THEN paletten END), 0),
+                       COALESCE(SUM(CASE typ WHEN 'IN' THEN koli END), 0),
+                       COALESCE(SUM(CASE typ WHEN 'OUT' THEN paletten END), 0),
+                       COALESCE(SUM(CASE typ WHEN 'OUT' THEN koli END), 0),
+                       MAX(datum)
+                FROM arch.movements
+            """).fetchone()
+            overlap = con.execute("SELECT COUNT(*) FROM main.movements WHERE id IN (SELECT id FROM arch.movements)"
+                                  ).fetchone()[0]
+        expected = (r.bewegungen, r.dokumente, r.paletten_in, r.koli_in, r.paletten_out, r.koli_out)
+        if tuple(int(x) for x in got[:6]) != tuple(int(x) for x in expected):
+            problems.append(f"{r.jahr}: Archiv hat (Bewegungen, Dokumente, Pal/Koli IN, Pal/Koli OUT) "
+                            f"{tuple(got[:6])}, erwartet {tuple(int(x) for x in expected)}.")
+        if got[6] and cutoff and got[6][:10] > cutoff:
+            problems.append(f"{r.jahr}: Archiv enthält Bewegungen nach dem Stichtag {cutoff}.")
+        if overlap:
+            problems.append(f"{r.jahr}: {overlap} Bewegungen stehen zusätzlich noch in der Hauptdatenbank "
+                            f"(Lauf abgebrochen? archive erneut ausführen).")
+    if cutoff:
+        left = db.read_transaction(data_dir, lambda con: con.execute(
+            "SELECT COUNT(*) FROM movements WHERE substr(datum,1,10) <= ?", (cutoff,)).fetchone()[0])
+        if left:
+            problems.append(f"{left} Bewegungen bis zum Stichtag {cutoff} sind noch nicht archiviert.")
+    report = ledger.check_ledger(data_dir, full=True)
+    if not report.ok:
+        problems.append(report.summary())
+    return problems
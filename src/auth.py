@@ -5,34 +5,37 @@ import streamlit as st
 def _sha256(s: str) -> str:
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
+def _secret(name: str):
+    try:
+        value = st.secrets.get(name, None)
+    except Exception:
+        value = None
+    return value or os.environ.get(name)
+
+def _is_hash(x: str) -> bool:
+    # Support: falls jemand einen SHA256 Hash einträgt, akzeptieren wir das auch.
+    # Erkennung: 64 hex chars
+    x = x.strip().lower()
+    return len(x) == 64 and all(c in "0123456789abcdef" for c in x)
+
+def _password_ok(pw: str, secret: str) -> bool:
+    stored_hash = secret.strip()
+    if not _is_hash(stored_hash):
+        stored_hash = _sha256(stored_hash)
+    return _sha256(pw) == stored_hash.lower()
+
 def require_login():
     """Einfaches Login per gemeinsamem Passwort.
     Passwort kommt aus:
     - st.secrets['APP_PASSWORD'] (empfohlen) oder
     - ENV APP_PASSWORD
     """
-    secret = None
-    try:
-        secret = st.secrets.get("APP_PASSWORD", None)
-    except Exception:
-        secret = None
-    if not secret:
-        secret = os.environ.get("APP_PASSWORD")
+    secret = _secret("APP_PASSWORD")
 
     if not secret:
         st.error("APP_PASSWORD ist nicht gesetzt. Setze es in .streamlit/secrets.toml oder als ENV APP_PASSWORD.")
         st.stop()
 
-    # Support: falls jemand einen SHA256 Hash einträgt, akzeptieren wir das auch.
-    # Erkennung: 64 hex chars
-    def is_hash(x):
-        x = x.strip().lower()
-        return len(x) == 64 and all(c in "0123456789abcdef" for c in x)
-
-    stored_hash = secret.strip()
-    if not is_hash(stored_hash):
-        stored_hash = _sha256(stored_hash)
-
     if st.session_state.get("authed"):
         return
 
@@ -40,7 +43,7 @@ def require_login():
         st.markdown("## 🔐 Login")
         pw = st.text_input("Gemeinsames Passwort", type="password")
         if st.button("Anmelden"):
-            if _sha256(pw) == stored_hash:
+            if _password_ok(pw, secret):
                 st.session_state["authed"] = True
                 st.success("Angemeldet.")
                 st.rerun()
@@ -48,3 +51,24 @@ def require_login():
                 st.error("Falsches Passwort.")
         st.caption("Tipp: Passwort in `.streamlit/secrets.toml` oder als ENV `APP_PASSWORD` setzen.")
     st.stop()
+
+def admin_login() -> bool:
+    """Optionaler Admin-Zugang für Wartungsfunktionen.
+    Passwort aus st.secrets['ADMIN_PASSWORD'] oder ENV ADMIN_PASSWORD;
+    ist keines gesetzt, gibt es keinen Admin-Bereich.
+    """
+    if st.session_state.get("admin"):
+        return True
+    secret = _secret("ADMIN_PASSWORD")
+    if not secret:
+        return False
+
+    with st.sidebar.expander("🛠️ Admin"):
+        pw = st.text_input("Admin-Passwort", type="password", key="admin_pw")
+        if st.button("Als Admin anmelden"):
+            if _password_ok(pw, secret):
+                st.session_state["admin"] = True
+                st.rerun()
+            else:
+                st.error("Falsches Admin-Passwort.")
+    return False
@@ -0,0 +1,411 @@
+"""Online-Sicherung der Datenbanken und der Dokument-Ablage.
+
+backup() kopiert app.db und die Jahresarchive mit der Backup-API von SQLite in
+Schritten von BACKUP_PAGES Seiten mit BACKUP_SLEEP_MS Pause dazwischen. Die
+Quelle hält dabei eine Lesetransaktion offen: die Kopie ist ein fester Stand
+(WAL), Buchungen laufen weiter und zwingen die Sicherung nicht zum Neustart.
+Jede Kopie wird per PRAGMA integrity_check geprüft.
+
+Aus uploads/ kommen nur Dateien dazu, die im Manifest der letzten Sicherung
+fehlen: abgelegte Dateien ändern sich nie (Blobs sind inhaltsadressiert,
+Altablagen tragen einen Zeitstempel im Namen).
+
+Ergebnis im Sicherungsverzeichnis (LAGER_BACKUP_DIR, Default DATA_DIR/backups):
+  lager_<zeit>.tar.gz          manifest.json, app.db, archive/*.db, neue uploads
+  lager_<zeit>.tar.gz.sha256   Prüfsumme (sha256sum -c)
+  lager_<zeit>.json            Manifest, Basis der nächsten Sicherung
+Eine Wiederherstellung braucht die Sicherung und die älteren Sicherungen, auf
+die ihr Manifest für Dokumente verweist.
+"""
+import io
+import os
+import re
+import json
+import time
+import shutil
+import sqlite3
+import tarfile
+import hashlib
+import tempfile
+from datetime import datetime
+
+from src import db
+from src.storage import blob_path
+
+BACKUP_DIR = os.environ.get("LAGER_BACKUP_DIR")  # None: <data_dir>/backups
+BACKUP_PAGES = int(os.environ.get("LAGER_BACKUP_PAGES", "1024"))
+BACKUP_SLEEP_MS = float(os.environ.get("LAGER_BACKUP_SLEEP_MS", "20"))
+COMPRESS_LEVEL = 6
+FORMAT = 1
+
+_SHA = re.compile(r"[0-9a-f]{64}\Z")
+
+
+class BackupError(RuntimeError):
+    """Sicherung oder Wiederherstellung abgebrochen."""
+
+
+class BackupReport:
+    def __init__(self, path: str, manifest: dict, seconds: float):
+        self.path = path
+        self.manifest = manifest
+        self.seconds = seconds
+
+    def summary(self) -> str:
+        m = self.manifest
+        size = os.path.getsize(self.path) / 2**20
+        return (f"Sicherung {os.path.basename(self.path)}: {len(m['databases'])} Datenbank(en), "
+                f"{m['new_uploads']} neue von {len(m['uploads'])} Dokument-Dateien, {size:.1f} MiB, "
+                f"{self.seconds:.1f} s.")
+
+
+class _HashingWriter:
+    """Dateiobjekt, das beim Schreiben die sha256 mitrechnet."""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha = hashlib.sha256()
+
+    def write(self, data):
+        self.sha.update(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def backup_dir(data_dir: str) -> str:
+    return BACKUP_DIR or os.path.join(data_dir, "backups")
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _snapshot(src_path: str, dst_path: str, pages: int, sleep_ms: float, progress=None) -> dict:
+    """Kopiert eine SQLite-Datei schrittweise per Backup-API; prüft die Kopie."""
+    src = sqlite3.connect(src_path, isolation_level=None)
+    dst = sqlite3.connect(dst_path)
+    steps = restarts = 0
+    last_remaining = None
+
+    def on_step(status, remaining, total):
+        nonlocal steps, restarts, last_remaining
+        steps += 1
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+        last_remaining = remaining
+        if progress:
+            progress(1 - remaining / total if total else 1.0)
+        if remaining and sleep_ms:
+            time.sleep(sleep_ms / 1000)
+
+    try:
+        # Lesetransaktion = fester Stand der Quelle über alle Schritte
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        src.backup(dst, pages=pages, progress=on_step)
+        src.execute("COMMIT")
+        dst.execute("PRAGMA journal_mode=DELETE;")
+        check = [r[0] for r in dst.execute("PRAGMA integrity_check")]
+    finally:
+        src.close()
+        dst.close()
+    if check != ["ok"]:
+        raise BackupError(f"integrity_check der Kopie von {src_path}: {'; '.join(check[:5])}")
+    return {"sha256": _file_sha256(dst_path), "size": os.path.getsize(dst_path), "steps": steps,
+            "restarts": restarts}
+
+
+def _upload_files(data_dir: str):
+    """(Name relativ zu uploads/, Pfad) aller abgelegten Dokumente: Blobs
+    ab/cd/<sha256> und Altablagen <zeit>__<name> (vor der Blob-Ablage)."""
+    root = os.path.join(data_dir, "uploads")
+    if not os.path.isdir(root):
+        return
+    for dirpath, dirs, files in os.walk(root):
+        if dirpath == root:
+            dirs[:] = [d for d in dirs if d != "tmp"]
+        for name in files:
+            path = os.path.join(dirpath, name)
+            yield os.path.relpath(path, root).replace(os.sep, "/"), path
+
+
+def _upload_member(rel: str) -> str:
+    return f"uploads/{rel}"
+
+
+def list_backups(data_dir: str, out_dir: str = None) -> list:
+    """Manifeste der vorhandenen Sicherungen, neueste zuerst."""
+    out_dir = out_dir or backup_dir(data_dir)
+    if not os.path.isdir(out_dir):
+        return []
+    manifests = []
+    for name in sorted(os.listdir(out_dir), reverse=True):
+        if name.startswith("lager_") and name.endswith(".json"):
+            with open(os.path.join(out_dir, name), encoding="utf-8") as f:
+                manifests.append(json.load(f))
+    return manifests
+
+
+def backup(data_dir: str, out_dir: str = None, full: bool = False, pages: int = BACKUP_PAGES,
+           sleep_ms: float = BACKUP_SLEEP_MS, progress=None) -> BackupReport:
+    """Legt eine Sicherung an (siehe Moduldoku). full=True nimmt alle Dokumente
+    auf statt nur der neuen. progress(text, anteil) meldet den Fortschritt."""
+    t0 = time.perf_counter()
+    out_dir = out_dir or backup_dir(data_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    name = f"lager_{datetime.now().strftime('%Y%m%d-%H%M%S-%f')[:-3]}"
+    archive_name = f"{name}.tar.gz"
+    previous = None if full else next(iter(list_backups(data_dir, out_dir)), None)
+    known = dict(previous["uploads"]) if previous else {}
+
+    with tempfile.TemporaryDirectory(dir=out_dir, prefix=".backup-") as tmp:
+        databases = {}
+        files = db.database_files(data_dir)
+        for i, (rel, path) in enumerate(files):
+            target = os.path.join(tmp, rel)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            step = (lambda frac, i=i, rel=rel: progress(f"Datenbank {rel}", (i + frac) / len(files))) if progress else None
+            databases[rel] = _snapshot(path, target, pages, sleep_ms, step)
+
+        uploads, new = {}, []
+        for rel, path in _upload_files(data_dir):
+            if rel in known:
+                uploads[rel] = known[rel]
+            else:
+                uploads[rel] = archive_name
+                new.append((rel, path))
+
+        manifest = {
+            "format": FORMAT,
+            "name": archive_name,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "data_dir": os.path.abspath(data_dir),
+            "schema_version": db.SCHEMA_VERSION,
+            "previous": previous["name"] if previous else None,
+            "databases": databases,
+            "uploads": uploads,
+            "new_uploads": len(new),
+        }
+        manifest_bytes = json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8")
+
+        part = os.path.join(out_dir, f".{archive_name}.part")
+        try:
+            with open(part, "wb") as raw:
+                out = _HashingWriter(raw)
+                with tarfile.open(fileobj=out, mode="w:gz", compresslevel=COMPRESS_LEVEL) as tar:
+                    info = tarfile.TarInfo("manifest.json")
+                    info.size = len(manifest_bytes)
+                    info.mtime = int(time.time())
+                    tar.addfile(info, fileobj=io.BytesIO(manifest_bytes))
+                    for rel in databases:
+                        tar.add(os.path.join(tmp, rel), arcname=rel)
+                    for i, (rel, path) in enumerate(new):
+                        if progress and i % 100 == 0:
+                            progress("Dokumente", i / len(new))
+                        tar.add(path, arcname=_upload_member(rel))
+                raw.flush()
+                os.fsync(raw.fileno())
+            final = os.path.join(out_dir, archive_name)
+            os.replace(part, final)
+        except BaseException:
+            if os.path.exists(part):
+                os.remove(part)
+            raise
+        with open(final + ".sha256", "w", encoding="utf-8") as f:
+            f.write(f"{out.sha.hexdigest()}  {archive_name}\n")
+        # Manifest zuletzt: erst damit gilt die Sicherung als Basis der nächsten
+        with open(os.path.join(out_dir, f"{name}.json"), "wb") as f:
+            f.write(manifest_bytes)
+    if progress:
+        progress("fertig", 1.0)
+    return BackupReport(final, manifest, time.perf_counter() - t0)
+
+
+def _read_manifest(tar, members) -> dict:
+    """Liest manifest.json, das erste Mitglied (Archive nur der Reihe nach lesen:
+    gezieltes Springen entpackt gzip jedes Mal von vorn)."""
+    member = next(members, None)
+    if member is None or member.name != "manifest.json":
+        raise BackupError("manifest.json fehlt.")
+    return json.load(tar.extractfile(member))
+
+
+def _extract_upload(tar, member, data_dir: str):
+    target = os.path.join(data_dir, member.name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with tar.extractfile(member) as src, open(target + ".part", "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(target + ".part", target)
+
+
+def _rewrite_paths(db_file: str, data_dir: str, legacy: set):
+    """Ablagepfade der Dokumente (und Blobs) einer wiederhergestellten Datenbank auf data_dir umschreiben."""
+    con = sqlite3.connect(db_file)
+    try:
+        with con:
+            tables = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for table in ("documents", "blobs"):
+                if table not in tables:
+                    continue
+                rows = con.execute(f"SELECT rowid, sha256 FROM {table} WHERE sha256 IS NOT NULL").fetchall()
+                con.executemany(f"UPDATE {table} SET stored_path = ? WHERE rowid = ?",
+                                [(blob_path(data_dir, sha), rowid) for rowid, sha in rows])
+            if "documents" in tables:
+                rows = con.execute("SELECT id, stored_path FROM documents WHERE sha256 IS NULL").fetchall()
+                con.executemany("UPDATE documents SET stored_path = ? WHERE id = ?",
+                                [(os.path.join(data_dir, "uploads", os.path.basename(p)), i)
+                                 for i, p in rows if os.path.basename(p) in legacy])
+    finally:
+        con.close()
+
+
+def _checksum_ok(path: str) -> bool:
+    sidecar = path + ".sha256"
+    if not os.path.exists(sidecar):
+        return False
+    with open(sidecar, encoding="utf-8") as f:
+        expected = f.read().split()[0]
+    return _file_sha256(path) == expected
+
+
+def verify_backup(path: str) -> list:
+    """Prüft Prüfsumme, Manifest, jede Datei des Archivs (sha256, Datenbanken per
+    integrity_check) und ob die älteren Sicherungen der Dokumente vorhanden und
+    unversehrt sind. Gibt die Befunde zurück (leer = in Ordnung)."""
+    problems = []
+    if not os.path.exists(path):
+        return [f"Sicherung fehlt: {path}"]
+    if not _checksum_ok(path):
+        problems.append(f"{os.path.basename(path)}: Prüfsumme fehlt oder stimmt nicht.")
+    try:
+        with tarfile.open(path, "r|gz") as tar, tempfile.TemporaryDirectory() as tmp:
+            members = iter(tar)
+            manifest = _read_manifest(tar, members)
+            expected_uploads = {_upload_member(rel) for rel, where in manifest["uploads"].items()
+                                if where == manifest["name"]}
+            seen = set()
+            for member in members:
+                if member.name in manifest["databases"]:
+                    target = os.path.join(tmp, "check.db")
+                    with tar.extractfile(member) as src, open(target, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                    meta = manifest["databases"][member.name]
+                    if _file_sha256(target) != meta["sha256"]:
+                        problems.append(f"{member.name}: Prüfsumme stimmt nicht.")
+                    else:
+                        con = sqlite3.connect(target)
+                        try:
+                            check = [r[0] for r in con.execute("PRAGMA integrity_check")]
+                        finally:
+                            con.close()
+                        if check != ["ok"]:
+                            problems.append(f"{member.name}: integrity_check: {'; '.join(check[:5])}")
+                    os.remove(target)
+                    seen.add(member.name)
+                else:
+                    # Blobs tragen ihre Prüfsumme im Namen, Altablagen nicht
+                    name = member.name.rsplit("/", 1)[-1]
+                    h = hashlib.sha256()
+                    with tar.extractfile(member) as src:
+                        for chunk in iter(lambda: src.read(1024 * 1024), b""):
+                            h.update(chunk)
+                    if _SHA.match(name) and h.hexdigest() != name:
+                        problems.append(f"{member.name}: Inhalt passt nicht zur Prüfsumme.")
+                    seen.add(member.name)
+    except (tarfile.TarError, OSError, EOFError, ValueError, KeyError, sqlite3.DatabaseError) as e:
+        return problems + [f"{os.path.basename(path)}: Archiv nicht lesbar ({e})."]
+    for rel in manifest["databases"]:
+        if rel not in seen:
+            problems.append(f"{rel}: fehlt im Archiv.")
+    missing = expected_uploads - seen
+    if missing:
+        problems.append(f"{len(missing)} Dokument-Datei(en) fehlen im Archiv.")
+    directory = os.path.dirname(os.path.abspath(path))
+    for other in sorted(set(manifest["uploads"].values()) - {manifest["name"]}):
+        other_path = os.path.join(directory, other)
+        if not os.path.exists(other_path):
+            problems.append(f"Ältere Sicherung {other} (für Dokumente) fehlt.")
+        elif not _checksum_ok(other_path):
+            problems.append(f"Ältere Sicherung {other}: Prüfsumme stimmt nicht.")
+    return problems
+
+
+def restore(path: str, data_dir: str, force: bool = False, log=None) -> str:
+    """Stellt eine Sicherung nach data_dir wieder her (App vorher beenden).
+
+    Prüft die Sicherung zuerst (verify_backup). Vorhandene Datenbanken werden nur
+    mit force=True ersetzt und dabei samt -wal/-shm nach *.vor-restore-<zeit>
+    verschoben; Dokument-Dateien werden ergänzt. Ablagepfade der Dokumente
+    werden in allen Datenbanken (auch den Jahresarchiven) auf data_dir umgeschrieben.
+    """
+    problems = verify_backup(path)
+    if problems:
+        raise BackupError("Sicherung fehlerhaft: " + " ".join(problems))
+    with tarfile.open(path, "r|gz") as tar:
+        manifest = _read_manifest(tar, iter(tar))
+    existing = [os.path.join(data_dir, rel) for rel in manifest["databases"]
+                if os.path.exists(os.path.join(data_dir, rel))]
+    if existing and not force:
+        raise BackupError(f"{data_dir} enthält bereits Daten ({', '.join(existing)}); mit force überschreiben.")
+    db.close_all_connections()
+    os.makedirs(data_dir, exist_ok=True)
+
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    directory = os.path.dirname(os.path.abspath(path))
+    wanted = {}
+    for rel, where in manifest["uploads"].items():
+        if not os.path.exists(os.path.join(data_dir, _upload_member(rel))):
+            wanted.setdefault(where, set()).add(_upload_member(rel))
+    own = wanted.pop(manifest["name"], set())
+    restored = 0
+
+    with tempfile.TemporaryDirectory(dir=data_dir, prefix=".restore-") as tmp:
+        with tarfile.open(path, "r|gz") as tar:
+            members = iter(tar)
+            _read_manifest(tar, members)
+            for member in members:
+                if member.name in manifest["databases"]:
+                    target = os.path.join(tmp, member.name)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with tar.extractfile(member) as src, open(target, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                elif member.name in own:
+                    _extract_upload(tar, member, data_dir)
+                    restored += 1
+        legacy = {rel for rel in manifest["uploads"] if "/" not in rel}
+        for rel in manifest["databases"]:
+            _rewrite_paths(os.path.join(tmp, rel), data_dir, legacy)
+        for rel in manifest["databases"]:
+            target = os.path.join(data_dir, rel)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # -wal/-shm gehören zur alten Datei: mitverschieben, sonst fehlen der
+            # Sicherheitskopie die noch nicht eingecheckten Commits
+            saved = f"{target}.vor-restore-{stamp}" if os.path.exists(target) else None
+            if saved:
+                os.replace(target, saved)
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(target + suffix):
+                    if saved:
+                        os.replace(target + suffix, saved + suffix)
+                    else:
+                        os.remove(target + suffix)
+            os.replace(os.path.join(tmp, rel), target)
+
+    for where, names in sorted(wanted.items()):
+        with tarfile.open(os.path.join(directory, where), "r|gz") as tar:
+            members = iter(tar)
+            _read_manifest(tar, members)
+            for member in members:
+                if member.name in names:
+                    _extract_upload(tar, member, data_dir)
+                    restored += 1
+        if log:
+            log(f"{where}: {len(names)} Dokument-Datei(en)")
+    return (f"Wiederhergestellt aus {manifest['name']} ({manifest['created_at']}): "
+            f"{len(manifest['databases'])} Datenbank(en), {restored} Dokument-Datei(en) ergänzt.")
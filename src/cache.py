@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Begrenzter LRU-Cache, dessen Einträge an eine Schreib-Generation gebunden sind.
+
+    Ein Eintrag gilt nur, solange die beim Lesen übergebene Generation der beim
+    Speichern entspricht; ältere Einträge werden beim Zugriff verworfen.
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, generation):
+        """Gibt (True, Wert) bei Treffer zurück, sonst (False, None)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] == generation:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[1]
+                del self._data[key]
+                self.invalidations += 1
+            self.misses += 1
+            return False, None
+
+    def put(self, key, generation, value):
+        with self._lock:
+            self._data[key] = (generation, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, predicate=None):
+        """Entfernt alle Einträge (oder die, deren Schlüssel predicate erfüllt)."""
+        with self._lock:
+            if predicate is None:
+                dropped = len(self._data)
+                self._data.clear()
+            else:
+                keys = [k for k in self._data if predicate(k)]
+                for k in keys:
+                    del self._data[k]
+                dropped = len(keys)
+            self.invalidations += dropped
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "size": len(self._data),
+                "max_entries": self.max_entries,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = self.invalidations = 0
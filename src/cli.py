@@ -0,0 +1,275 @@
+"""Kommandozeile für Wartungsaufgaben.
+
+Aufruf: python -m src.cli <befehl> [--data-dir DIR] ...
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from datetime import date
+
+from src import db, storage, importer, ledger, api, export, archive, backup
+
+
+def _cmd_rebuild_rollup(args):
+    db.init_db(args.data_dir)
+    db.rebuild_daily_rollup(args.data_dir, args.date_from, args.date_to)
+    print("Tagesverdichtung neu aufgebaut.")
+
+
+def _cmd_rebuild_stock_summary(args):
+    db.init_db(args.data_dir)
+    db.rebuild_stock_summary(args.data_dir)
+    print("Bestandssummen neu aufgebaut.")
+
+
+def _cmd_gc_uploads(args):
+    db.init_db(args.data_dir)
+    removed = storage.gc_uploads(args.data_dir, args.grace)
+    print(f"{removed} Datei(en) entfernt.")
+
+
+def _cmd_expire_reservations(args):
+    db.init_db(args.data_dir)
+    expired = db.expire_reservations(args.data_dir)
+    print(f"{expired} Reservierung(en) abgelaufen.")
+
+
+def _cmd_build_snapshots(args):
+    db.init_db(args.data_dir)
+    built = db.build_inventory_snapshots(args.data_dir, args.until)
+    print(f"{len(built)} Snapshot(s) angelegt" + (f": {built[0]} … {built[-1]}" if built else "."))
+
+
+def _cmd_import(args):
+    db.init_db(args.data_dir)
+    t0 = time.perf_counter()
+    with open(args.file, newline="", encoding=args.encoding) as f:
+        result = importer.import_csv(args.data_dir, args.kind, f, delimiter=args.delimiter, datum=args.datum)
+    print(f"{result.summary()} ({time.perf_counter() - t0:.1f} s)")
+    if result.rejects:
+        if args.rejects:
+            with open(args.rejects, "w", newline="", encoding="utf-8") as f:
+                importer.write_rejects(result, f)
+            print(f"Abgelehnte Zeilen: {args.rejects}")
+        else:
+            importer.write_rejects(result, sys.stdout)
+    return 1 if result.rejected else 0
+
+
+def _cmd_check_ledger(args):
+    db.init_db(args.data_dir)
+    report = ledger.check_ledger(args.data_dir, full=args.full, repair=args.repair)
+    print(report.summary())
+    if not report.drift.empty:
+        print(report.drift.to_string(index=False))
+    return 0 if report.ok or report.repaired else 1
+
+
+def _cmd_expiry_report(args):
+    db.init_db(args.data_dir)
+    as_of = date.fromisoformat(args.as_of) if args.as_of else date.today()
+    watch = db.get_expiry_watchlist(args.data_dir, as_of, args.days)
+    out_dir = args.out_dir or os.path.join(args.data_dir, "reports")
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"mhd_warnliste_{as_of.isoformat()}.csv")
+    watch.to_csv(path, index=False, sep=args.delimiter)
+    for r in db.get_expiry_summary(args.data_dir, as_of, args.days).itertuples():
+        print(f"{r.stufe:>12}: {r.positionen:6} Positionen, {r.paletten:7} Pal, {r.koli:8} Koli")
+    print(f"Warnliste: {path}")
+    return 0
+
+
+def _cmd_export(args):
+    db.init_db(args.data_dir)
+    t0 = time.perf_counter()
+    if args.what == "movements":
+        chunks = export.export_movements(args.data_dir, args.format, typ=args.typ, partner_like=args.partner,
+                                         date_from=args.date_from, date_to=args.date_to, delimiter=args.delimiter,
+                                         include_archive=args.archive)
+    else:
+        chunks = export.export_inventory(args.data_dir, args.format, delimiter=args.delimiter)
+    if args.out in (None, "-"):
+        try:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+        except BrokenPipeError:
+            # z.B. "| head": Leser ist weg, kein Fehler
+            sys.stdout = None
+        finally:
+            chunks.close()
+        return 0
+    size = export.write_chunks(chunks, args.out)
+    print(f"{args.out}: {size / 2**20:.1f} MiB ({time.perf_counter() - t0:.1f} s)")
+    return 0
+
+
+def _cmd_archive(args):
+    db.init_db(args.data_dir)
+    if args.dry_run:
+        plan = archive.plan_archive(args.data_dir, args.before)
+        print(f"Stichtag: {archive.default_cutoff(args.before)}")
+        print(plan.to_string(index=False) if not plan.empty else "Nichts zu archivieren.")
+        return 0
+    t0 = time.perf_counter()
+    try:
+        report = archive.archive_movements(args.data_dir, args.before, log=print)
+    except archive.ArchiveError as e:
+        print(f"Abgebrochen: {e}", file=sys.stderr)
+        return 1
+    print(f"{report.summary()} ({time.perf_counter() - t0:.1f} s)")
+    return 0
+
+
+def _cmd_verify_archive(args):
+    db.init_db(args.data_dir)
+    problems = archive.verify_archive(args.data_dir)
+    info = db.get_archive_info(args.data_dir)
+    if not info.empty:
+        print(info.drop(columns=["datei"]).to_string(index=False))
+    for p in problems:
+        print(f"FEHLER: {p}")
+    print("Archiv in Ordnung." if not problems else f"{len(problems)} Befund(e).")
+    return 1 if problems else 0
+
+
+def _cmd_backup(args):
+    db.init_db(args.data_dir)
+    try:
+        report = backup.backup(args.data_dir, args.out_dir, full=args.full,
+                               pages=args.pages, sleep_ms=args.sleep_ms)
+    except backup.BackupError as e:
+        print(f"Abgebrochen: {e}", file=sys.stderr)
+        return 1
+    print(report.summary())
+    problems = backup.verify_backup(report.path)
+    for p in problems:
+        print(f"FEHLER: {p}")
+    return 1 if problems else 0
+
+
+def _cmd_verify_backup(args):
+    problems = backup.verify_backup(args.path)
+    for p in problems:
+        print(f"FEHLER: {p}")
+    print("Sicherung in Ordnung." if not problems else f"{len(problems)} Befund(e).")
+    return 1 if problems else 0
+
+
+def _cmd_restore(args):
+    try:
+        print(backup.restore(args.path, args.data_dir, force=args.force, log=print))
+    except backup.BackupError as e:
+        print(f"Abgebrochen: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def _cmd_serve(args):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    print(f"API auf http://{args.host}:{args.port} (Daten: {args.data_dir})")
+    try:
+        asyncio.run(api.serve(args.data_dir, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.cli", description="Lager & Versand – Wartung")
+    parser.add_argument("--data-dir", default=os.environ.get("DATA_DIR", "data"),
+                        help="Datenverzeichnis (Default: ENV DATA_DIR oder ./data)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("rebuild-rollup", help="Tagesverdichtung für Reports neu aufbauen (Backfill)")
+    p.add_argument("--from", dest="date_from", help="ab Datum (YYYY-MM-DD)")
+    p.add_argument("--to", dest="date_to", help="bis Datum (YYYY-MM-DD)")
+    p.set_defaults(func=_cmd_rebuild_rollup)
+
+    p = sub.add_parser("rebuild-stock-summary", help="Bestandssummen je Artikel/Lagerplatz neu aufbauen")
+    p.set_defaults(func=_cmd_rebuild_stock_summary)
+
+    p = sub.add_parser("gc-uploads", help="Unreferenzierte Dokument-Blobs löschen")
+    p.add_argument("--grace", type=int, default=storage.GC_GRACE_SECONDS,
+                   help="nur Dateien älter als so viele Sekunden (Default: %(default)s)")
+    p.set_defaults(func=_cmd_gc_uploads)
+
+    p = sub.add_parser("expire-reservations", help="Überfällige Reservierungen freigeben (z.B. per cron)")
+    p.set_defaults(func=_cmd_expire_reservations)
+
+    p = sub.add_parser("build-snapshots", help="Fehlende Monatsend-Bestandssnapshots anlegen")
+    p.add_argument("--until", help="bis Datum (YYYY-MM-DD, Default: heute)")
+    p.set_defaults(func=_cmd_build_snapshots)
+
+    p = sub.add_parser("import", help="CSV-Massenimport (Stammdaten oder Anfangsbestand)")
+    p.add_argument("kind", choices=sorted(importer.COLUMNS))
+    p.add_argument("file")
+    p.add_argument("--delimiter", help="Trennzeichen (Default: automatisch , ; oder Tab)")
+    p.add_argument("--encoding", default="utf-8-sig")
+    p.add_argument("--datum", help="Buchungsdatum für Anfangsbestand (Default: heute)")
+    p.add_argument("--rejects", help="abgelehnte Zeilen als CSV hierhin schreiben")
+    p.set_defaults(func=_cmd_import)
+
+    p = sub.add_parser("check-ledger", help="Bestand gegen Bewegungen abgleichen (inkrementell)")
+    p.add_argument("--full", action="store_true", help="alle Summen neu rechnen und alle Positionen prüfen")
+    p.add_argument("--repair", action="store_true", help="abweichende Bestände auf die Soll-Summen setzen")
+    p.set_defaults(func=_cmd_check_ledger)
+
+    p = sub.add_parser("expiry-report", help="MHD-Warnliste als CSV schreiben (z.B. täglich per cron)")
+    p.add_argument("--days", type=int, default=db.EXPIRY_BUCKETS[-1], help="Vorlauf in Tagen (Default: %(default)s)")
+    p.add_argument("--as-of", help="Stichtag (YYYY-MM-DD, Default: heute)")
+    p.add_argument("--out-dir", help="Zielverzeichnis (Default: DATA_DIR/reports)")
+    p.add_argument("--delimiter", default=";")
+    p.set_defaults(func=_cmd_expiry_report)
+
+    p = sub.add_parser("export", help="Bewegungen oder Bestand als CSV/JSONL exportieren (gestreamt)")
+    p.add_argument("what", choices=["movements", "inventory"])
+    p.add_argument("--format", choices=sorted(export.FORMATS), default="csv")
+    p.add_argument("--out", help="Zieldatei (Default: stdout)")
+    p.add_argument("--delimiter", default=",", help="CSV-Trennzeichen")
+    p.add_argument("--typ", choices=["IN", "OUT"], help="nur Bewegungen dieses Typs")
+    p.add_argument("--partner", help="Partner/Empfänger enthält")
+    p.add_argument("--from", dest="date_from", help="ab Datum (YYYY-MM-DD)")
+    p.add_argument("--to", dest="date_to", help="bis Datum (YYYY-MM-DD)")
+    p.add_argument("--archive", action="store_true", help="archivierte Jahre einbeziehen")
+    p.set_defaults(func=_cmd_export)
+
+    p = sub.add_parser("archive", help="Alte Bewegungen in Jahresarchive (DATA_DIR/archive) verschieben")
+    p.add_argument("--before", help="Stichtag = letztes Monatsende davor "
+                                    f"(Default: heute − {archive.ARCHIVE_KEEP_DAYS} Tage, ENV LAGER_ARCHIVE_KEEP_DAYS)")
+    p.add_argument("--dry-run", action="store_true", help="nur anzeigen, was archiviert würde")
+    p.set_defaults(func=_cmd_archive)
+
+    p = sub.add_parser("verify-archive", help="Jahresarchive gegen Protokoll, Summen und Bestand prüfen")
+    p.set_defaults(func=_cmd_verify_archive)
+
+    p = sub.add_parser("backup", help="Online-Sicherung von Datenbank und Dokumenten (inkrementell)")
+    p.add_argument("--out-dir", help="Sicherungsverzeichnis (Default: ENV LAGER_BACKUP_DIR oder DATA_DIR/backups)")
+    p.add_argument("--full", action="store_true", help="alle Dokumente aufnehmen, nicht nur neue")
+    p.add_argument("--pages", type=int, default=backup.BACKUP_PAGES, help="Seiten je Kopierschritt")
+    p.add_argument("--sleep-ms", type=float, default=backup.BACKUP_SLEEP_MS, help="Pause zwischen Kopierschritten")
+    p.set_defaults(func=_cmd_backup)
+
+    p = sub.add_parser("verify-backup", help="Sicherung prüfen (Prüfsummen, integrity_check)")
+    p.add_argument("path", help="lager_<zeit>.tar.gz")
+    p.set_defaults(func=_cmd_verify_backup)
+
+    p = sub.add_parser("restore", help="Sicherung nach DATA_DIR wiederherstellen (App vorher beenden)")
+    p.add_argument("path", help="lager_<zeit>.tar.gz")
+    p.add_argument("--force", action="store_true", help="vorhandene Datenbanken ersetzen (werden umbenannt)")
+    p.set_defaults(func=_cmd_restore)
+
+    p = sub.add_parser("serve", help="HTTP/JSON-Schnittstelle für Scanner und ERP starten")
+    p.add_argument("--host", default=api.HOST)
+    p.add_argument("--port", type=int, default=api.PORT)
+    p.set_defaults(func=_cmd_serve)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
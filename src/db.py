@@ -1,24 +1,412 @@
 import os
+import re
+import json
+import atexit
+import queue
 import sqlite3
+import threading
+import functools
+import contextvars
+from concurrent.futures import Future
+from contextlib import contextmanager, closing
 import pandas as pd
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+
+from src.cache import LRUCache
+from src.masterdata import MasterIndex
+from src import tracing
+
+# Verbindungs-Einstellungen (per ENV oder configure_connections() anpassbar)
+BUSY_TIMEOUT_MS = int(os.environ.get("LAGER_BUSY_TIMEOUT_MS", "5000"))
+SYNCHRONOUS = os.environ.get("LAGER_SYNCHRONOUS", "NORMAL")  # OFF | NORMAL | FULL | EXTRA
+STATEMENT_CACHE_SIZE = int(os.environ.get("LAGER_STATEMENT_CACHE", "256"))
+POOL_MAX_IDLE = int(os.environ.get("LAGER_POOL_MAX_IDLE", "8"))
+CACHE_MAX_ENTRIES = int(os.environ.get("LAGER_CACHE_SIZE", "128"))
+# Schreib-Thread: 0 = jede Sitzung schreibt selbst (wie vor dem Schreib-Thread)
+WRITER_THREAD = os.environ.get("LAGER_WRITER_THREAD", "1") not in ("", "0")
+WRITE_QUEUE_SIZE = int(os.environ.get("LAGER_WRITE_QUEUE", "256"))
+GROUP_COMMIT_MAX = int(os.environ.get("LAGER_GROUP_COMMIT_MAX", "64"))
 
 def _conn(db_path: str):
-    con = sqlite3.connect(db_path, check_same_thread=False)
+    con = sqlite3.connect(
+        db_path,
+        check_same_thread=False,
+        timeout=BUSY_TIMEOUT_MS / 1000.0,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
     con.execute("PRAGMA journal_mode=WAL;")
     con.execute("PRAGMA foreign_keys=ON;")
+    con.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT_MS)};")
+    con.execute(f"PRAGMA synchronous={SYNCHRONOUS};")
     return con
 
+class _ConnectionPool:
+    """Langlebige Verbindungen je Datenbankdatei.
+
+    Eine Verbindung gehört während eines Aufrufs exklusiv einem Thread und
+    wandert danach zurück in den Pool. Pragmas werden nur beim Öffnen gesetzt.
+    close() schließt nur freie Verbindungen; ausgeliehene schließt release().
+    """
+
+    def __init__(self, db_path: str, max_idle: int = POOL_MAX_IDLE):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._all = set()
+        self._closed = False
+        self._watcher = None
+        self._watcher_lock = threading.Lock()
+
+    def data_version(self) -> int:
+        """PRAGMA data_version einer nie schreibenden Verbindung: ändert sich bei
+        jedem Commit einer anderen Verbindung, auch aus anderen Prozessen."""
+        with self._watcher_lock:
+            if self._watcher is None:
+                self._watcher = sqlite3.connect(self.db_path, check_same_thread=False)
+            return self._watcher.execute("PRAGMA data_version;").fetchone()[0]
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            con = _conn(self.db_path)
+            with self._lock:
+                self._all.add(con)
+            return con
+
+    def release(self, con):
+        if con.in_transaction:
+            con.rollback()
+        with self._lock:
+            keep = not self._closed and self._idle.qsize() < self.max_idle
+            if keep:
+                self._idle.put(con)
+        if not keep:
+            self._discard(con)
+
+    def _discard(self, con):
+        with self._lock:
+            self._all.discard(con)
+        tracing.forget(con)
+        con.close()
+
+    def close(self):
+        cons = []
+        with self._lock:
+            self._closed = True
+            while True:
+                try:
+                    cons.append(self._idle.get_nowait())
+                except queue.Empty:
+                    break
+            self._all.difference_update(cons)
+        with self._watcher_lock:
+            if self._watcher is not None:
+                self._watcher.close()
+                self._watcher = None
+        for con in cons:
+            tracing.forget(con)
+            try:
+                con.execute("PRAGMA optimize;")
+                con.close()
+            except sqlite3.Error:
+                pass
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _pool(data_dir: str) -> _ConnectionPool:
+    key = os.path.abspath(data_dir)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = _ConnectionPool(_db_path(data_dir))
+    return pool
+
+@contextmanager
+def _connect(data_dir: str):
+    pool = _pool(data_dir)
+    if tracing.ENABLED or tracing.has_hooks():
+        con = tracing.acquire(pool)
+    else:
+        con = pool.acquire()
+    try:
+        yield con
+    finally:
+        pool.release(con)
+
+class WriteQueueFull(sqlite3.OperationalError):
+    """Schreibwarteschlange länger als BUSY_TIMEOUT_MS voll (Gegendruck)."""
+
+class _WriterClosed(Exception):
+    """Schreib-Thread wird beendet; _write gibt den Auftrag an den nächsten weiter."""
+
+_writer_local = threading.local()
+
+class _Writer:
+    """Ein Schreib-Thread mit eigener Verbindung je Datenbankdatei.
+
+    Schreibaufträge kommen über eine begrenzte Warteschlange (WRITE_QUEUE_SIZE;
+    volle Warteschlange bremst die Aufrufer). Was sich während eines Commits
+    ansammelt, geht gemeinsam in die nächste Transaktion (Group Commit, höchstens
+    GROUP_COMMIT_MAX Aufträge). Jeder Auftrag läuft in einem eigenen SAVEPOINT:
+    ein Fehler verwirft nur ihn. Ergebnisse bzw. Fehler liefern Futures, erst
+    nach dem Commit.
+    """
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self.con = None
+        self.jobs = 0
+        self.commits = 0
+        self._closing = False
+        self._queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._loop, name="lager-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, args, kwargs) -> Future:
+        if self._closing:
+            raise _WriterClosed()
+        future = Future()
+        # Kontext mitnehmen: tracing ordnet die Anweisungen dem Aufrufer zu
+        job = (future, contextvars.copy_context(), fn, args, kwargs)
+        try:
+            self._queue.put(job, timeout=BUSY_TIMEOUT_MS / 1000.0)
+        except queue.Full:
+            raise WriteQueueFull(f"Schreibwarteschlange voll ({WRITE_QUEUE_SIZE} Aufträge)") from None
+        # close() kann zwischen Prüfung und put gelaufen sein: dann holt den
+        # Auftrag niemand mehr ab (liefe der Thread noch, räumt close() auf)
+        if self._closing and not self._thread.is_alive():
+            self._reject_pending()
+        return future
+
+    def _reject_pending(self):
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if job is not None and job[0].set_running_or_notify_cancel():
+                job[0].set_exception(_WriterClosed())
+
+    def _loop(self):
+        _writer_local.writer = self
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < GROUP_COMMIT_MAX:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [job for job in batch if job is not None]
+            if batch:
+                self._run(batch)
+
+    def _run(self, batch):
+        todo = [job for job in batch if job[0].set_running_or_notify_cancel()]
+        running = [future for future, *_ in todo]
+        done = []
+        try:
+            if self.con is None:
+                self.con = _conn(_db_path(self.data_dir))
+            con = self.con
+            if tracing.ENABLED or tracing.has_hooks():
+                tracing.hook(con)
+            con.execute("BEGIN IMMEDIATE")
+            while todo:
+                job = todo.pop(0)
+                future, ctx, fn, args, kwargs = job
+                con.execute("SAVEPOINT job")
+                try:
+                    result = ctx.run(fn, con, *args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                    if con.in_transaction:
+                        con.execute("ROLLBACK TO job")
+                        con.execute("RELEASE job")
+                    else:
+                        # Fehler hat die ganze Transaktion beendet: vorherige Aufträge wiederholen
+                        todo[:0] = [j for j, _ in done]
+                        done = []
+                        con.execute("BEGIN IMMEDIATE")
+                else:
+                    con.execute("RELEASE job")
+                    done.append((job, result))
+            con.commit()
+        except BaseException as e:
+            if self.con is not None and self.con.in_transaction:
+                self.con.rollback()
+            for future in running:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.jobs += len(done)
+        self.commits += 1
+        _invalidate_cache(self.data_dir)
+        for (future, *_), result in done:
+            future.set_result(result)
+
+    def close(self):
+        self._closing = True
+        self._queue.put(None)
+        self._thread.join()
+        self._reject_pending()
+        if self.con is not None:
+            try:
+                self.con.execute("PRAGMA optimize;")
+            except sqlite3.Error:
+                pass
+            tracing.forget(self.con)
+            self.con.close()
+            self.con = None
+
+_writers = {}
+
+def _writer(data_dir: str) -> _Writer:
+    key = os.path.abspath(data_dir)
+    writer = _writers.get(key)
+    if writer is None:
+        with _pools_lock:
+            writer = _writers.get(key)
+            if writer is None:
+                writer = _writers[key] = _Writer(data_dir)
+    return writer
+
+def _write(data_dir: str, fn, *args, **kwargs):
+    """Führt fn(con, ...) in einer Transaktion aus und gibt das Ergebnis zurück
+    (über den Schreib-Thread, siehe _Writer)."""
+    if WRITER_THREAD:
+        current = getattr(_writer_local, "writer", None)
+        if current is not None and os.path.abspath(current.data_dir) == os.path.abspath(data_dir):
+            # verschachtelter Aufruf aus einem Auftrag: gleiche Transaktion
+            return fn(current.con, *args, **kwargs)
+        while True:
+            try:
+                return _writer(data_dir).submit(fn, args, kwargs).result()
+            except _WriterClosed:
+                # Schreib-Thread wurde währenddessen geschlossen: beim neuen einreihen
+                continue
+    with _connect(data_dir) as con:
+        try:
+            result = fn(con, *args, **kwargs)
+            con.commit()
+        except BaseException:
+            con.rollback()
+            raise
+    _invalidate_cache(data_dir)
+    return result
+
+def read_transaction(data_dir: str, fn, *args, **kwargs):
+    """Führt fn(con, ...) auf einer gepoolten Verbindung aus, ohne zu schreiben."""
+    with _connect(data_dir) as con:
+        return fn(con, *args, **kwargs)
+
+def write_transaction(data_dir: str, fn, *args, **kwargs):
+    """Führt fn(con, ...) als eine Schreibtransaktion aus (für Module mit eigener
+    SQL-Logik wie den Massenimport)."""
+    return _write(data_dir, fn, *args, **kwargs)
+
+def configure_connections(busy_timeout_ms: int = None, synchronous: str = None,
+                          statement_cache_size: int = None, max_idle: int = None,
+                          writer_thread: bool = None, group_commit_max: int = None,
+                          write_queue_size: int = None):
+    """Ändert die Verbindungs-Einstellungen; offene Pools und Schreib-Threads
+    werden neu aufgebaut."""
+    global BUSY_TIMEOUT_MS, SYNCHRONOUS, STATEMENT_CACHE_SIZE, POOL_MAX_IDLE
+    global WRITER_THREAD, GROUP_COMMIT_MAX, WRITE_QUEUE_SIZE
+    if busy_timeout_ms is not None:
+        BUSY_TIMEOUT_MS = int(busy_timeout_ms)
+    if synchronous is not None:
+        if synchronous.upper() not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+            raise ValueError(f"Ungültiger synchronous-Modus: {synchronous}")
+        SYNCHRONOUS = synchronous.upper()
+    if statement_cache_size is not None:
+        STATEMENT_CACHE_SIZE = int(statement_cache_size)
+    if max_idle is not None:
+        POOL_MAX_IDLE = int(max_idle)
+    if writer_thread is not None:
+        WRITER_THREAD = bool(writer_thread)
+    if group_commit_max is not None:
+        GROUP_COMMIT_MAX = max(1, int(group_commit_max))
+    if write_queue_size is not None:
+        WRITE_QUEUE_SIZE = max(1, int(write_queue_size))
+    close_all_connections()
+
+def close_all_connections():
+    """Arbeitet die Schreibwarteschlangen ab und schließt alle Verbindungen
+    (auch als atexit-Hook registriert)."""
+    with _pools_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+        pools = list(_pools.values())
+        _pools.clear()
+    for writer in writers:
+        writer.close()
+    for pool in pools:
+        pool.close()
+
+def writer_stats() -> dict:
+    """Aufträge und Commits der Schreib-Threads (Aufträge/Commit = Gruppengröße)."""
+    with _pools_lock:
+        writers = list(_writers.values())
+    return {"jobs": sum(w.jobs for w in writers), "commits": sum(w.commits for w in writers)}
+
+atexit.register(close_all_connections)
+
+# -------- read cache --------
+# Ergebnisse der Lesefunktionen, gültig bis zum nächsten Commit auf die DB.
+_read_cache = LRUCache(CACHE_MAX_ENTRIES)
+
+def _cache_generation(data_dir: str) -> int:
+    return _pool(data_dir).data_version()
+
+def _invalidate_cache(data_dir: str):
+    key = os.path.abspath(data_dir)
+    _read_cache.invalidate(lambda k: k[1] == key)
+
+def _cached(fn):
+    @functools.wraps(fn)
+    def wrapper(data_dir, *args, **kwargs):
+        key = (fn.__name__, os.path.abspath(data_dir), args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return fn(data_dir, *args, **kwargs)
+        gen = _cache_generation(data_dir)
+        found, value = _read_cache.get(key, gen)
+        if not found:
+            value = fn(data_dir, *args, **kwargs)
+            _read_cache.put(key, gen, value)
+        # Kopie, damit Aufrufer den gecachten DataFrame nicht verändern
+        return value.copy() if isinstance(value, pd.DataFrame) else value
+    return wrapper
+
+def cache_stats() -> dict:
+    """Treffer/Fehlzugriffe/Verdrängungen des Lese-Caches."""
+    return _read_cache.stats()
+
+def clear_cache():
+    _read_cache.clear()
+
 def _db_path(data_dir: str) -> str:
     return os.path.join(data_dir, "app.db")
 
 def init_db(data_dir: str):
     os.makedirs(data_dir, exist_ok=True)
-    dbp = _db_path(data_dir)
-    con = _conn(dbp)
-    cur = con.cursor()
+    with _connect(data_dir) as con:
+        if con.execute("PRAGMA user_version;").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        _create_schema(con)
+        _migrate(con)
 
-    cur.executescript("""
+def _create_schema(con):
+    con.executescript("""
     CREATE TABLE IF NOT EXISTS items (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         sku TEXT NOT NULL UNIQUE,
@@ -38,8 +426,7 @@ def init_db(data_dir: str):
         item_id INTEGER NOT NULL,
         batch TEXT NOT NULL,
         mhd TEXT, -- ISO date
-        created_at TEXT NOT NULL,
-        UNIQUE(item_id, batch, COALESCE(mhd,'')),
+        created_at TEXT NOT NULL, -- Eindeutigkeit (item_id, batch, mhd) per Index, siehe Migration 1
         FOREIGN KEY(item_id) REFERENCES items(id)
     );
 
@@ -83,183 +470,1552 @@ def init_db(data_dir: str):
     );
     """)
     con.commit()
-    con.close()
+
+# -------- migrations --------
+_SNAP_INVALIDATE = """
+    DELETE FROM inventory_snapshots WHERE snap_date >= {d};
+    DELETE FROM snapshot_dates WHERE snap_date >= {d};
+"""
+# Trigger-Rümpfe der Tagesverdichtung (day, typ, item, partner, location)
+_ROLLUP_ADD_NEW = """
+    INSERT INTO movement_daily_rollup(day,typ,item_id,partner,location_id,paletten,koli,n)
+        SELECT substr(NEW.datum,1,10), NEW.typ, l.item_id, COALESCE(NEW.partner,''), NEW.location_id,
+               NEW.paletten, NEW.koli, 1
+        FROM lots l WHERE l.id = NEW.lot_id
+        ON CONFLICT(day,typ,item_id,partner,location_id) DO UPDATE SET
+            paletten = paletten + excluded.paletten,
+            koli = koli + excluded.koli,
+            n = n + 1;
+"""
+_ROLLUP_SUB_OLD = """
+    UPDATE movement_daily_rollup
+        SET paletten = paletten - OLD.paletten, koli = koli - OLD.koli, n = n - 1
+        WHERE day = substr(OLD.datum,1,10) AND typ = OLD.typ
+          AND item_id = (SELECT item_id FROM lots WHERE id = OLD.lot_id)
+          AND partner = COALESCE(OLD.partner,'') AND location_id = OLD.location_id;
+    DELETE FROM movement_daily_rollup
+        WHERE n <= 0 AND day = substr(OLD.datum,1,10) AND typ = OLD.typ;
+"""
+
+# Trigger-Rümpfe der Bestandssummen je Artikel, je Lagerplatz und gesamt.
+# Eine inventory-Zeile zählt als Position, solange paletten oder koli <> 0.
+# {r}: NEW oder OLD, {s}: Vorzeichen ('' oder '-')
+_STOCK_POS = "({r}.paletten <> 0 OR {r}.koli <> 0)"
+_STOCK_APPLY = """
+    INSERT INTO stock_by_item(item_id, positionen, paletten, koli)
+        SELECT l.item_id, {s}{pos}, {s}{r}.paletten, {s}{r}.koli FROM lots l WHERE l.id = {r}.lot_id
+        ON CONFLICT(item_id) DO UPDATE SET
+            positionen = positionen + excluded.positionen,
+            paletten = paletten + excluded.paletten,
+            koli = koli + excluded.koli;
+    INSERT INTO stock_by_location(location_id, positionen, paletten, koli)
+        VALUES ({r}.location_id, {s}{pos}, {s}{r}.paletten, {s}{r}.koli)
+        ON CONFLICT(location_id) DO UPDATE SET
+            positionen = positionen + excluded.positionen,
+            paletten = paletten + excluded.paletten,
+            koli = koli + excluded.koli;
+    UPDATE stock_total SET
+        positionen = positionen + {s}{pos}, paletten = paletten + {s}{r}.paletten, koli = koli + {s}{r}.koli
+        WHERE id = 1;
+"""
+# Häufigster Fall (Buchung auf bestehende Zeile): nur die Differenz addieren
+_STOCK_DELTA = """
+    UPDATE stock_by_item SET
+        positionen = positionen + {d_pos}, paletten = paletten + {d_pal}, koli = koli + {d_koli}
+        WHERE item_id = (SELECT item_id FROM lots WHERE id = NEW.lot_id);
+    UPDATE stock_by_location SET
+        positionen = positionen + {d_pos}, paletten = paletten + {d_pal}, koli = koli + {d_koli}
+        WHERE location_id = NEW.location_id;
+    UPDATE stock_total SET
+        positionen = positionen + {d_pos}, paletten = paletten + {d_pal}, koli = koli + {d_koli}
+        WHERE id = 1;
+""".format(d_pos=f"{_STOCK_POS.format(r='NEW')} - {_STOCK_POS.format(r='OLD')}",
+           d_pal="NEW.paletten - OLD.paletten", d_koli="NEW.koli - OLD.koli")
+
+def _stock_apply(r: str, s: str = "") -> str:
+    return _STOCK_APPLY.format(r=r, s=s, pos=_STOCK_POS.format(r=r))
+
+# Archivierung (src/archive.py) verschiebt Bewegungen/Dokumente, statt sie zu
+# löschen: Tagesverdichtung, Snapshots und Blob-Referenzen bleiben dabei stehen.
+_NOT_ARCHIVING = "NOT EXISTS (SELECT 1 FROM maintenance_flags WHERE name = 'archiv')"
+# Der Massenimport (src/importer.py) füllt den Volltextindex blockweise selbst: ein
+# FTS5-Eintrag je Zeile per Trigger wird mit jeder Zeile langsamer (maintenance_flags 'import')
+_NOT_IMPORTING = "NOT EXISTS (SELECT 1 FROM maintenance_flags WHERE name = 'import')"
+# Buchungen im archivierten (abgeschlossenen) Zeitraum sind nicht mehr möglich
+_CLOSED_PERIOD = "(SELECT cutoff FROM archive_state WHERE id = 1)"
+CLOSED_PERIOD_MESSAGE = "Buchungsdatum liegt im archivierten Zeitraum"
+# movements.datum ist ein reiner Tag (JJJJ-MM-TT): Stichtag, Verdichtung, Archiv
+# und Filter vergleichen denselben Schlüssel
+DATE_ONLY_MESSAGE = "Buchungsdatum muss JJJJ-MM-TT sein"
+
+# Wörter ohne Akzente vergleichen (Müller findet Muller); Bindestrich/Schrägstrich trennen
+_FTS_TOKENIZER = "unicode61 remove_diacritics 2"
+
+# Jede Migration ist (Version, Beschreibung, Schritte); ein Schritt ist SQL oder
+# eine Funktion fn(con). Schritte müssen idempotent sein, der erreichte Stand
+# steht in PRAGMA user_version.
+_MIGRATIONS = [
+    (1, "Indizes für häufige Abfragen", [
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_lots_item_batch_mhd ON lots(item_id, batch, COALESCE(mhd,''))",
+        "CREATE INDEX IF NOT EXISTS ix_movements_lot ON movements(lot_id)",
+        "CREATE INDEX IF NOT EXISTS ix_movements_location ON movements(location_id)",
+        "CREATE INDEX IF NOT EXISTS ix_movements_datum ON movements(datum)",
+        "CREATE INDEX IF NOT EXISTS ix_movements_typ_datum ON movements(typ, datum, lot_id, paletten, koli)",
+        "CREATE INDEX IF NOT EXISTS ix_documents_movement ON documents(movement_id, id)",
+        """CREATE INDEX IF NOT EXISTS ix_inventory_nonzero
+               ON inventory(lot_id, location_id, paletten, koli, updated_at)
+               WHERE paletten <> 0 OR koli <> 0""",
+    ]),
+    (2, "Tagesverdichtung der Bewegungen für Reports", [
+        """CREATE TABLE IF NOT EXISTS movement_daily_rollup (
+               day TEXT NOT NULL,
+               typ TEXT NOT NULL,
+               item_id INTEGER NOT NULL,
+               partner TEXT NOT NULL DEFAULT '',
+               location_id INTEGER NOT NULL,
+               paletten INTEGER NOT NULL DEFAULT 0,
+               koli INTEGER NOT NULL DEFAULT 0,
+               n INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (day, typ, item_id, partner, location_id)
+           ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS ix_rollup_typ_day ON movement_daily_rollup(typ, day)",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_movements_rollup_ins AFTER INSERT ON movements
+           BEGIN {_ROLLUP_ADD_NEW} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_movements_rollup_del AFTER DELETE ON movements
+           BEGIN {_ROLLUP_SUB_OLD} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_movements_rollup_upd
+           AFTER UPDATE OF typ, lot_id, location_id, paletten, koli, partner, datum ON movements
+           BEGIN {_ROLLUP_SUB_OLD} {_ROLLUP_ADD_NEW} END""",
+        lambda con: _rebuild_daily_rollup(con),
+    ]),
+    (3, "Inhaltsadressierte Dokument-Ablage mit Referenzzählung", [
+        lambda con: _add_column(con, "documents", "sha256", "TEXT"),
+        "CREATE INDEX IF NOT EXISTS ix_documents_sha256 ON documents(sha256)",
+        """CREATE TABLE IF NOT EXISTS blobs (
+               sha256 TEXT PRIMARY KEY,
+               stored_path TEXT NOT NULL,
+               size_bytes INTEGER,
+               refcount INTEGER NOT NULL DEFAULT 0,
+               created_at TEXT NOT NULL
+           )""",
+        "CREATE INDEX IF NOT EXISTS ix_blobs_unreferenced ON blobs(sha256) WHERE refcount <= 0",
+        """CREATE TRIGGER IF NOT EXISTS trg_documents_blob_ref AFTER INSERT ON documents
+           WHEN NEW.sha256 IS NOT NULL
+           BEGIN
+               INSERT INTO blobs(sha256, stored_path, size_bytes, refcount, created_at)
+                   VALUES (NEW.sha256, NEW.stored_path, NEW.size_bytes, 1, NEW.uploaded_at)
+                   ON CONFLICT(sha256) DO UPDATE SET refcount = refcount + 1;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_documents_blob_unref AFTER DELETE ON documents
+           WHEN OLD.sha256 IS NOT NULL
+           BEGIN
+               UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = OLD.sha256;
+           END""",
+    ]),
+    (4, "Monatliche Bestands-Snapshots für Stichtagsabfragen", [
+        """CREATE TABLE IF NOT EXISTS inventory_snapshots (
+               snap_date TEXT NOT NULL,
+               lot_id INTEGER NOT NULL,
+               location_id INTEGER NOT NULL,
+               paletten INTEGER NOT NULL,
+               koli INTEGER NOT NULL,
+               PRIMARY KEY (snap_date, lot_id, location_id)
+           ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS snapshot_dates (
+               snap_date TEXT PRIMARY KEY,
+               created_at TEXT NOT NULL
+           )""",
+        # Rückdatierte Änderungen machen Snapshots ab ihrem Datum ungültig
+        f"""CREATE TRIGGER IF NOT EXISTS trg_movements_snap_ins AFTER INSERT ON movements
+           WHEN substr(NEW.datum,1,10) <= (SELECT MAX(snap_date) FROM snapshot_dates)
+           BEGIN {_SNAP_INVALIDATE.format(d="substr(NEW.datum,1,10)")} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_movements_snap_del AFTER DELETE ON movements
+           WHEN substr(OLD.datum,1,10) <= (SELECT MAX(snap_date) FROM snapshot_dates)
+           BEGIN {_SNAP_INVALIDATE.format(d="substr(OLD.datum,1,10)")} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_movements_snap_upd
+           AFTER UPDATE OF typ, lot_id, location_id, paletten, koli, datum ON movements
+           WHEN MIN(substr(OLD.datum,1,10), substr(NEW.datum,1,10)) <= (SELECT MAX(snap_date) FROM snapshot_dates)
+           BEGIN {_SNAP_INVALIDATE.format(d="MIN(substr(OLD.datum,1,10), substr(NEW.datum,1,10))")} END""",
+    ]),
+    (5, "Prüfpunkt für den Abgleich Bestand/Bewegungen", [
+        """CREATE TABLE IF NOT EXISTS ledger_checkpoint (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               last_movement_id INTEGER NOT NULL,
+               checked_at TEXT NOT NULL
+           )""",
+        """CREATE TABLE IF NOT EXISTS ledger_sums (
+               lot_id INTEGER NOT NULL,
+               location_id INTEGER NOT NULL,
+               paletten INTEGER NOT NULL DEFAULT 0,
+               koli INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (lot_id, location_id)
+           ) WITHOUT ROWID""",
+    ]),
+    (6, "FEFO: Chargen je Artikel nach MHD", [
+        "CREATE INDEX IF NOT EXISTS ix_lots_item_mhd ON lots(item_id, mhd)",
+    ]),
+    (7, "MHD-Warnliste: Chargen nach MHD", [
+        "CREATE INDEX IF NOT EXISTS ix_lots_mhd ON lots(mhd) WHERE mhd IS NOT NULL",
+    ]),
+    (8, "Volltextsuche (FTS5) über Partner, Referenz, Notizen und Dokumentnamen", [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS movements_fts USING fts5(
+               partner, reference, notes, content='movements', content_rowid='id', tokenize='{_FTS_TOKENIZER}')""",
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+               filename, content='documents', content_rowid='id', tokenize='{_FTS_TOKENIZER}')""",
+        """CREATE TRIGGER IF NOT EXISTS trg_movements_fts_ins AFTER INSERT ON movements BEGIN
+               INSERT INTO movements_fts(rowid, partner, reference, notes)
+                   VALUES (NEW.id, NEW.partner, NEW.reference, NEW.notes);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_movements_fts_del AFTER DELETE ON movements BEGIN
+               INSERT INTO movements_fts(movements_fts, rowid, partner, reference, notes)
+                   VALUES ('delete', OLD.id, OLD.partner, OLD.reference, OLD.notes);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_movements_fts_upd AFTER UPDATE OF partner, reference, notes ON movements BEGIN
+               INSERT INTO movements_fts(movements_fts, rowid, partner, reference, notes)
+                   VALUES ('delete', OLD.id, OLD.partner, OLD.reference, OLD.notes);
+               INSERT INTO movements_fts(rowid, partner, reference, notes)
+                   VALUES (NEW.id, NEW.partner, NEW.reference, NEW.notes);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_documents_fts_ins AFTER INSERT ON documents BEGIN
+               INSERT INTO documents_fts(rowid, filename) VALUES (NEW.id, NEW.filename);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_documents_fts_del AFTER DELETE ON documents BEGIN
+               INSERT INTO documents_fts(documents_fts, rowid, filename) VALUES ('delete', OLD.id, OLD.filename);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_documents_fts_upd AFTER UPDATE OF filename ON documents BEGIN
+               INSERT INTO documents_fts(documents_fts, rowid, filename) VALUES ('delete', OLD.id, OLD.filename);
+               INSERT INTO documents_fts(rowid, filename) VALUES (NEW.id, NEW.filename);
+           END""",
+        # Einzelbuchungen schreiben je Commit ein kleines Segment; seltener mischen
+        "INSERT INTO movements_fts(movements_fts, rank) VALUES ('automerge', 16)",
+        "INSERT INTO documents_fts(documents_fts, rank) VALUES ('automerge', 16)",
+        # Backfill aus den Inhaltstabellen
+        "INSERT INTO movements_fts(movements_fts) VALUES ('rebuild')",
+        "INSERT INTO documents_fts(documents_fts) VALUES ('rebuild')",
+    ]),
+    (9, "Bestandssummen je Artikel, Lagerplatz und gesamt (Dashboard-Kennzahlen)", [
+        """CREATE TABLE IF NOT EXISTS stock_by_item (
+               item_id INTEGER PRIMARY KEY,
+               positionen INTEGER NOT NULL DEFAULT 0,
+               paletten INTEGER NOT NULL DEFAULT 0,
+               koli INTEGER NOT NULL DEFAULT 0
+           )""",
+        """CREATE TABLE IF NOT EXISTS stock_by_location (
+               location_id INTEGER PRIMARY KEY,
+               positionen INTEGER NOT NULL DEFAULT 0,
+               paletten INTEGER NOT NULL DEFAULT 0,
+               koli INTEGER NOT NULL DEFAULT 0
+           )""",
+        """CREATE TABLE IF NOT EXISTS stock_total (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               positionen INTEGER NOT NULL DEFAULT 0,
+               paletten INTEGER NOT NULL DEFAULT 0,
+               koli INTEGER NOT NULL DEFAULT 0
+           )""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_inventory_stock_ins AFTER INSERT ON inventory
+           BEGIN {_stock_apply("NEW")} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_inventory_stock_del AFTER DELETE ON inventory
+           BEGIN {_stock_apply("OLD", "-")} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_inventory_stock_upd AFTER UPDATE OF lot_id, location_id, paletten, koli ON inventory
+           WHEN OLD.lot_id = NEW.lot_id AND OLD.location_id = NEW.location_id
+           BEGIN {_STOCK_DELTA} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_inventory_stock_move AFTER UPDATE OF lot_id, location_id ON inventory
+           WHEN OLD.lot_id <> NEW.lot_id OR OLD.location_id <> NEW.location_id
+           BEGIN {_stock_apply("OLD", "-")} {_stock_apply("NEW")} END""",
+        lambda con: _rebuild_stock_summary(con),
+    ]),
+    (10, "Archivierung alter Bewegungen in Jahresdateien", [
+        """CREATE TABLE IF NOT EXISTS maintenance_flags (
+               name TEXT PRIMARY KEY
+           )""",
+        """CREATE TABLE IF NOT EXISTS archive_state (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               cutoff TEXT NOT NULL,
+               updated_at TEXT NOT NULL
+           )""",
+        """CREATE TABLE IF NOT EXISTS archive_log (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               year INTEGER NOT NULL,
+               cutoff TEXT NOT NULL,
+               path TEXT NOT NULL,
+               movements INTEGER NOT NULL,
+               documents INTEGER NOT NULL,
+               paletten_in INTEGER NOT NULL,
+               koli_in INTEGER NOT NULL,
+               paletten_out INTEGER NOT NULL,
+               koli_out INTEGER NOT NULL,
+               archived_at TEXT NOT NULL
+           )""",
+        # Σ IN − Σ OUT der archivierten Bewegungen, Ausgangswert für den vollen Abgleich
+        """CREATE TABLE IF NOT EXISTS archive_balances (
+               lot_id INTEGER NOT NULL,
+               location_id INTEGER NOT NULL,
+               paletten INTEGER NOT NULL DEFAULT 0,
+               koli INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (lot_id, location_id)
+           ) WITHOUT ROWID""",
+        "DROP TRIGGER IF EXISTS trg_movements_rollup_del",
+        f"""CREATE TRIGGER trg_movements_rollup_del AFTER DELETE ON movements
+           WHEN {_NOT_ARCHIVING}
+           BEGIN {_ROLLUP_SUB_OLD} END""",
+        "DROP TRIGGER IF EXISTS trg_movements_snap_del",
+        f"""CREATE TRIGGER trg_movements_snap_del AFTER DELETE ON movements
+           WHEN substr(OLD.datum,1,10) <= (SELECT MAX(snap_date) FROM snapshot_dates) AND {_NOT_ARCHIVING}
+           BEGIN {_SNAP_INVALIDATE.format(d="substr(OLD.datum,1,10)")} END""",
+        "DROP TRIGGER IF EXISTS trg_documents_blob_unref",
+        f"""CREATE TRIGGER trg_documents_blob_unref AFTER DELETE ON documents
+           WHEN OLD.sha256 IS NOT NULL AND {_NOT_ARCHIVING}
+           BEGIN
+               UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = OLD.sha256;
+           END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_movements_closed_ins BEFORE INSERT ON movements
+           WHEN substr(NEW.datum,1,10) <= {_CLOSED_PERIOD}
+           BEGIN SELECT RAISE(ABORT, '{CLOSED_PERIOD_MESSAGE}'); END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_movements_closed_upd BEFORE UPDATE ON movements
+           WHEN MIN(substr(OLD.datum,1,10), substr(NEW.datum,1,10)) <= {_CLOSED_PERIOD}
+           BEGIN SELECT RAISE(ABORT, '{CLOSED_PERIOD_MESSAGE}'); END""",
+    ]),
+    (11, "Reservierungen mit reserviertem Bestand je Position", [
+        lambda con: _add_column(con, "inventory", "reserved_paletten", "INTEGER NOT NULL DEFAULT 0"),
+        lambda con: _add_column(con, "inventory", "reserved_koli", "INTEGER NOT NULL DEFAULT 0"),
+        """CREATE TABLE IF NOT EXISTS reservations (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               lot_id INTEGER NOT NULL,
+               location_id INTEGER NOT NULL,
+               paletten INTEGER NOT NULL,
+               koli INTEGER NOT NULL,
+               partner TEXT,
+               reference TEXT,
+               status TEXT NOT NULL DEFAULT 'offen'
+                   CHECK (status IN ('offen', 'gebucht', 'freigegeben', 'abgelaufen')),
+               created_at TEXT NOT NULL,
+               expires_at TEXT NOT NULL,
+               closed_at TEXT,
+               movement_id INTEGER,
+               FOREIGN KEY(lot_id) REFERENCES lots(id),
+               FOREIGN KEY(location_id) REFERENCES locations(id)
+           )""",
+        "CREATE INDEX IF NOT EXISTS ix_reservations_open ON reservations(expires_at) WHERE status = 'offen'",
+        # Jede Reservierung verlässt 'offen' genau einmal und gibt dabei ihre Menge frei
+        """CREATE TRIGGER IF NOT EXISTS trg_reservations_close AFTER UPDATE OF status ON reservations
+           WHEN OLD.status = 'offen' AND NEW.status <> 'offen'
+           BEGIN
+               UPDATE inventory SET reserved_paletten = reserved_paletten - OLD.paletten,
+                                    reserved_koli = reserved_koli - OLD.koli
+               WHERE lot_id = OLD.lot_id AND location_id = OLD.location_id;
+           END""",
+    ]),
+    (12, "Buchungsdatum nur als Tag", [
+        # ältere Bewegungen mit Uhrzeit auf den Tag kürzen (Trigger halten Verdichtung
+        # und Snapshots dabei aktuell)
+        "UPDATE movements SET datum = substr(datum,1,10) WHERE length(datum) > 10",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_movements_date_ins BEFORE INSERT ON movements
+           WHEN NEW.datum IS NOT date(NEW.datum, '+0 days')
+           BEGIN SELECT RAISE(ABORT, '{DATE_ONLY_MESSAGE}'); END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_movements_date_upd BEFORE UPDATE OF datum ON movements
+           WHEN NEW.datum IS NOT date(NEW.datum, '+0 days')
+           BEGIN SELECT RAISE(ABORT, '{DATE_ONLY_MESSAGE}'); END""",
+    ]),
+    (13, "Volltextindex beim Massenimport blockweise", [
+        "DROP TRIGGER IF EXISTS trg_movements_fts_ins",
+        f"""CREATE TRIGGER trg_movements_fts_ins AFTER INSERT ON movements
+           WHEN {_NOT_IMPORTING}
+           BEGIN
+               INSERT INTO movements_fts(rowid, partner, reference, notes)
+                   VALUES (NEW.id, NEW.partner, NEW.reference, NEW.notes);
+           END""",
+    ]),
+    (14, "id-Bereiche je Archivlauf", [
+        # Dokumente/Bewegungen nach id nur im passenden Jahresarchiv suchen
+        lambda con: _add_column(con, "archive_log", "movement_id_min", "INTEGER"),
+        lambda con: _add_column(con, "archive_log", "movement_id_max", "INTEGER"),
+        lambda con: _add_column(con, "archive_log", "document_id_min", "INTEGER"),
+        lambda con: _add_column(con, "archive_log", "document_id_max", "INTEGER"),
+        lambda con: _backfill_archive_ranges(con),
+    ]),
+]
+
+SCHEMA_VERSION = _MIGRATIONS[-1][0]
+
+def _add_column(con, table: str, column: str, decl: str):
+    cols = {r[1] for r in con.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        con.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _migrate(con):
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        current = con.execute("PRAGMA user_version;").fetchone()[0]
+        applied = False
+        for version, _desc, steps in _MIGRATIONS:
+            if version <= current:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(con)
+                else:
+                    con.execute(step)
+            con.execute(f"PRAGMA user_version={int(version)};")
+            applied = True
+        if applied:
+            con.execute("ANALYZE;")
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+    if applied:
+        con.execute("PRAGMA optimize;")
 
 def _now():
     return datetime.utcnow().isoformat(timespec="seconds")
 
 def _iso(d):
-    if d is None:
+    """Datum als YYYY-MM-DD (date, datetime oder ISO-Text, Uhrzeit wird abgeschnitten); sonst ValueError."""
+    if d is None or d == "":
         return None
-    if isinstance(d, str):
-        return d
+    if isinstance(d, datetime):
+        return d.date().isoformat()
     if isinstance(d, date):
         return d.isoformat()
-    return str(d)
+    text = str(d).strip()
+    try:
+        return date.fromisoformat(text).isoformat()
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text).date().isoformat()
+    except ValueError:
+        raise ValueError(f"Ungültiges Datum: {d!r} (erwartet JJJJ-MM-TT)") from None
 
 # -------- items --------
+@_cached
 def get_items(data_dir: str) -> pd.DataFrame:
-    con = _conn(_db_path(data_dir))
-    df = pd.read_sql_query("SELECT id, sku, name, created_at FROM items ORDER BY sku", con)
-    con.close()
-    return df
+    with _connect(data_dir) as con:
+        return pd.read_sql_query("SELECT id, sku, name, created_at FROM items ORDER BY sku", con)
 
 def add_item(data_dir: str, sku: str, name: str):
-    con = _conn(_db_path(data_dir))
-    con.execute("INSERT OR IGNORE INTO items(sku,name,created_at) VALUES (?,?,?)", (sku, name, _now()))
-    con.commit()
-    con.close()
+    _write(data_dir, lambda con: con.execute(
+        "INSERT OR IGNORE INTO items(sku,name,created_at) VALUES (?,?,?)", (sku, name, _now())
+    ))
 
 # -------- locations --------
+@_cached
 def get_locations(data_dir: str) -> pd.DataFrame:
-    con = _conn(_db_path(data_dir))
-    df = pd.read_sql_query("SELECT id, code, description, created_at FROM locations ORDER BY code", con)
-    con.close()
-    return df
+    with _connect(data_dir) as con:
+        return pd.read_sql_query("SELECT id, code, description, created_at FROM locations ORDER BY code", con)
 
 def add_location(data_dir: str, code: str, description: str):
-    con = _conn(_db_path(data_dir))
-    con.execute("INSERT OR IGNORE INTO locations(code,description,created_at) VALUES (?,?,?)", (code, description, _now()))
-    con.commit()
-    con.close()
+    _write(data_dir, lambda con: con.execute(
+        "INSERT OR IGNORE INTO locations(code,description,created_at) VALUES (?,?,?)", (code, description, _now())
+    ))
 
 # -------- lots --------
+@_cached
 def get_lots(data_dir: str) -> pd.DataFrame:
-    con = _conn(_db_path(data_dir))
-    df = pd.read_sql_query("""
-        SELECT l.id, l.item_id, i.sku, i.name, l.batch, l.mhd, l.created_at
-        FROM lots l
-        JOIN items i ON i.id = l.item_id
-        ORDER BY i.sku, l.batch
-    """, con)
-    con.close()
-    return df
+    with _connect(data_dir) as con:
+        return pd.read_sql_query("""
+            SELECT l.id, l.item_id, i.sku, i.name, l.batch, l.mhd, l.created_at
+            FROM lots l
+            JOIN items i ON i.id = l.item_id
+            ORDER BY i.sku, l.batch
+        """, con)
 
 def add_lot(data_dir: str, item_id: int, batch: str, mhd):
-    con = _conn(_db_path(data_dir))
-    con.execute(
+    _write(data_dir, lambda con: con.execute(
         "INSERT OR IGNORE INTO lots(item_id,batch,mhd,created_at) VALUES (?,?,?,?)",
         (item_id, batch, _iso(mhd), _now())
-    )
-    con.commit()
-    con.close()
+    ))
+
+# -------- master data index --------
+@_cached
+def get_master_index(data_dir: str) -> MasterIndex:
+    """id→Label-Index für Auswahlfelder, einmal je Daten-Generation aufgebaut."""
+    return MasterIndex(get_items(data_dir), get_lots(data_dir), get_locations(data_dir))
 
 # -------- inventory --------
-def get_inventory(data_dir: str) -> pd.DataFrame:
-    con = _conn(_db_path(data_dir))
-    df = pd.read_sql_query("""
-        SELECT
-            inv.lot_id,
-            inv.location_id,
-            i.sku,
-            i.name AS artikel,
-            l.batch,
-            l.mhd,
-            loc.code AS lagerplatz,
-            inv.paletten,
-            inv.koli,
-            inv.updated_at
-        FROM inventory inv
-        JOIN lots l ON l.id = inv.lot_id
-        JOIN items i ON i.id = l.item_id
-        JOIN locations loc ON loc.id = inv.location_id
-        WHERE (inv.paletten <> 0 OR inv.koli <> 0)
-        ORDER BY i.sku, l.batch, loc.code
-    """, con)
-    con.close()
-    return df
+@_cached
+def get_inventory(data_dir: str, sku: str = None, lot_id: int = None, location_id: int = None) -> pd.DataFrame:
+    """Aktueller Bestand (ohne Nullzeilen), optional nur für eine SKU/Charge/Lagerplatz."""
+    where, params = ["(inv.paletten <> 0 OR inv.koli <> 0)"], []
+    for clause, value in (("i.sku = ?", sku), ("inv.lot_id = ?", lot_id), ("inv.location_id = ?", location_id)):
+        if value is not None:
+            where.append(clause)
+            params.append(value)
+    with _connect(data_dir) as con:
+        return pd.read_sql_query(f"""
+            SELECT
+                inv.lot_id,
+                inv.location_id,
+                i.sku,
+                i.name AS artikel,
+                l.batch,
+                l.mhd,
+                loc.code AS lagerplatz,
+                inv.paletten,
+                inv.koli,
+                inv.reserved_paletten AS reserviert_paletten,
+                inv.reserved_koli AS reserviert_koli,
+                inv.paletten - inv.reserved_paletten AS frei_paletten,
+                inv.koli - inv.reserved_koli AS frei_koli,
+                inv.updated_at
+            FROM inventory inv
+            JOIN lots l ON l.id = inv.lot_id
+            JOIN items i ON i.id = l.item_id
+            JOIN locations loc ON loc.id = inv.location_id
+            WHERE {" AND ".join(where)}
+            ORDER BY i.sku, l.batch, loc.code
+        """, con, params=params)
+
+def _rebuild_stock_summary(con):
+    con.execute("DELETE FROM stock_by_item")
+    con.execute("DELETE FROM stock_by_location")
+    con.execute("DELETE FROM stock_total")
+    con.execute("""
+        INSERT INTO stock_by_item(item_id, positionen, paletten, koli)
+        SELECT l.item_id, SUM(inv.paletten <> 0 OR inv.koli <> 0), SUM(inv.paletten), SUM(inv.koli)
+        FROM inventory inv JOIN lots l ON l.id = inv.lot_id
+        GROUP BY l.item_id
+    """)
+    con.execute("""
+        INSERT INTO stock_by_location(location_id, positionen, paletten, koli)
+        SELECT location_id, SUM(paletten <> 0 OR koli <> 0), SUM(paletten), SUM(koli)
+        FROM inventory GROUP BY location_id
+    """)
+    con.execute("""
+        INSERT INTO stock_total(id, positionen, paletten, koli)
+        SELECT 1, COALESCE(SUM(paletten <> 0 OR koli <> 0), 0), COALESCE(SUM(paletten), 0), COALESCE(SUM(koli), 0)
+        FROM inventory
+    """)
+
+def rebuild_stock_summary(data_dir: str):
+    """Baut die Bestandssummen (je Artikel, Lagerplatz, gesamt) aus inventory neu auf."""
+    _write(data_dir, _rebuild_stock_summary)
+
+@_cached
+def get_stock_totals(data_dir: str) -> dict:
+    """Positionen, Summe Paletten und Koli des aktuellen Bestands (eine Zeile lesen)."""
+    with _connect(data_dir) as con:
+        row = con.execute("SELECT positionen, paletten, koli FROM stock_total WHERE id = 1").fetchone()
+    return dict(zip(("positionen", "paletten", "koli"), row or (0, 0, 0)))
+
+@_cached
+def get_stock_by_item(data_dir: str, item_id: int = None) -> pd.DataFrame:
+    """Bestandssummen je Artikel (ohne Artikel ohne Bestand)."""
+    where, params = "", []
+    if item_id is not None:
+        where, params = "AND s.item_id = ?", [item_id]
+    with _connect(data_dir) as con:
+        return pd.read_sql_query(f"""
+            SELECT s.item_id, i.sku, i.name AS artikel, s.positionen, s.paletten, s.koli
+            FROM stock_by_item s JOIN items i ON i.id = s.item_id
+            WHERE s.positionen <> 0 {where}
+            ORDER BY i.sku
+        """, con, params=params)
+
+@_cached
+def get_stock_by_location(data_dir: str, location_id: int = None) -> pd.DataFrame:
+    """Bestandssummen je Lagerplatz (ohne leere Lagerplätze)."""
+    where, params = "", []
+    if location_id is not None:
+        where, params = "AND s.location_id = ?", [location_id]
+    with _connect(data_dir) as con:
+        return pd.read_sql_query(f"""
+            SELECT s.location_id, loc.code AS lagerplatz, s.positionen, s.paletten, s.koli
+            FROM stock_by_location s JOIN locations loc ON loc.id = s.location_id
+            WHERE s.positionen <> 0 {where}
+            ORDER BY loc.code
+        """, con, params=params)
+
+def _upsert_inventory_delta(con, lot_id: int, location_id: int, d_pallets: int, d_koli: int):
+    con.execute(
+        """INSERT INTO inventory(lot_id,location_id,paletten,koli,updated_at) VALUES (?,?,?,?,?)
+             ON CONFLICT(lot_id, location_id) DO UPDATE SET
+                 paletten = paletten + excluded.paletten,
+                 koli = koli + excluded.koli,
+                 updated_at = excluded.updated_at""",
+        (lot_id, location_id, int(d_pallets), int(d_koli), _now())
+    )
 
 def upsert_inventory_delta(data_dir: str, lot_id: int, location_id: int, d_pallets: int, d_koli: int):
-    con = _conn(_db_path(data_dir))
-    cur = con.cursor()
-    cur.execute("SELECT paletten, koli FROM inventory WHERE lot_id=? AND location_id=?", (lot_id, location_id))
-    row = cur.fetchone()
-    if row is None:
-        new_p = d_pallets
-        new_k = d_koli
-        cur.execute(
-            "INSERT INTO inventory(lot_id,location_id,paletten,koli,updated_at) VALUES (?,?,?,?,?)",
-            (lot_id, location_id, new_p, new_k, _now())
-        )
-    else:
-        new_p = int(row[0]) + int(d_pallets)
-        new_k = int(row[1]) + int(d_koli)
-        cur.execute(
-            "UPDATE inventory SET paletten=?, koli=?, updated_at=? WHERE lot_id=? AND location_id=?",
-            (new_p, new_k, _now(), lot_id, location_id)
-        )
-    con.commit()
-    con.close()
+    _write(data_dir, _upsert_inventory_delta, lot_id, location_id, d_pallets, d_koli)
 
 # -------- movements --------
+def _add_movement(con, typ: str, lot_id: int, location_id: int, paletten: int, koli: int,
+                  partner: str, reference: str, notes: str, datum):
+    try:
+        day = _iso(datum)
+    except ValueError as e:
+        raise BookingError(str(e)) from None
+    if day is None:
+        raise BookingError("Buchungsdatum fehlt.")
+    try:
+        cur = con.execute(
+            """INSERT INTO movements(typ,lot_id,location_id,paletten,koli,partner,reference,notes,datum,created_at)
+                 VALUES (?,?,?,?,?,?,?,?,?,?)""",
+            (typ, lot_id, location_id, paletten, koli, partner, reference, notes, day, _now())
+        )
+    except sqlite3.IntegrityError as e:
+        if CLOSED_PERIOD_MESSAGE in str(e):
+            raise BookingError(f"{CLOSED_PERIOD_MESSAGE} (bis {_archive_cutoff(con)}).") from None
+        raise
+    return cur.lastrowid
+
 def add_movement(data_dir: str, typ: str, lot_id: int, location_id: int, paletten: int, koli: int,
                  partner: str, reference: str, notes: str, datum):
-    con = _conn(_db_path(data_dir))
-    cur = con.cursor()
-    cur.execute(
-        """INSERT INTO movements(typ,lot_id,location_id,paletten,koli,partner,reference,notes,datum,created_at)
-             VALUES (?,?,?,?,?,?,?,?,?,?)""",
-        (typ, lot_id, location_id, paletten, koli, partner, reference, notes, _iso(datum), _now())
-    )
-    con.commit()
-    mid = cur.lastrowid
-    con.close()
+    return _write(data_dir, _add_movement, typ, lot_id, location_id, paletten, koli,
+                  partner, reference, notes, datum)
+
+class BookingError(ValueError):
+    """Buchung abgelehnt (z.B. nicht genug Bestand); es wurde nichts geschrieben."""
+
+# Max. Positionen je Bestandsprüfungs-Abfrage (4 Parameter je Position)
+_STOCK_CHECK_CHUNK = 2000
+
+def _begin_immediate(con):
+    # Schreibsperre sofort holen, damit Prüfung und Buchung atomar sind
+    if not con.in_transaction:
+        con.execute("BEGIN IMMEDIATE")
+
+def _normalize_lines(lines):
+    out = []
+    for n, line in enumerate(lines, start=1):
+        lot_id, location_id, paletten, koli = line
+        try:
+            lot_id, location_id, paletten, koli = int(lot_id), int(location_id), int(paletten), int(koli)
+        except (TypeError, ValueError):
+            raise BookingError(f"Position {n}: ungültige Werte.") from None
+        if paletten < 0 or koli < 0:
+            raise BookingError(f"Position {n}: negative Mengen sind nicht erlaubt.")
+        if paletten == 0 and koli == 0:
+            raise BookingError(f"Position {n}: Paletten oder Koli muss > 0 sein.")
+        out.append((lot_id, location_id, paletten, koli))
+    if not out:
+        raise BookingError("Keine Positionen angegeben.")
+    return out
+
+# Bedingte Abbuchung: greift nur, wenn der freie Bestand (ohne Reservierungen) reicht
+_TAKE_STOCK = """
+    UPDATE inventory SET paletten = paletten - :p, koli = koli - :k, updated_at = :now
+    WHERE lot_id = :lot AND location_id = :loc
+      AND paletten - reserved_paletten >= :p AND koli - reserved_koli >= :k
+"""
+
+def _take_stock(con, lines):
+    """Bucht OUT-Mengen ab (summiert je Charge/Lagerplatz), jede Position per
+    bedingtem UPDATE ohne vorherige Lese-Prüfung; reicht der freie Bestand
+    irgendwo nicht, BookingError für alle Fehlmengen."""
+    _expire_reservations(con)
+    need = {}
+    for lot_id, location_id, paletten, koli in lines:
+        p, k = need.get((lot_id, location_id), (0, 0))
+        need[(lot_id, location_id)] = (p + paletten, k + koli)
+    now = _now()
+    short = []
+    for (lot_id, location_id), (p, k) in need.items():
+        cur = con.execute(_TAKE_STOCK, {"p": p, "k": k, "now": now, "lot": lot_id, "loc": location_id})
+        if cur.rowcount == 0:
+            short.append((lot_id, location_id, p, k))
+    if short:
+        lot_id, loc_id, p, k = short[0]
+        have = con.execute("SELECT paletten, koli, reserved_paletten, reserved_koli FROM inventory "
+                           "WHERE lot_id=? AND location_id=?", (lot_id, loc_id)).fetchone() or (0, 0, 0, 0)
+        reserved = f" (davon reserviert {have[2]} Pal / {have[3]} Koli)" if have[2] or have[3] else ""
+        raise BookingError(
+            f"Nicht genug Bestand für {len(short)} Position(en), z.B. Charge {lot_id} / Lagerplatz {loc_id}: "
+            f"benötigt {p} Pal / {k} Koli, vorhanden {have[0]} Pal / {have[1]} Koli{reserved}."
+        )
+
+def _book_movements(con, typ: str, lines, partner: str, reference: str, notes: str, datum, documents=()):
+    if typ == "OUT":
+        _begin_immediate(con)
+        _take_stock(con, lines)
+    ids = []
+    for lot_id, location_id, paletten, koli in lines:
+        mid = _add_movement(con, typ, lot_id, location_id, paletten, koli, partner, reference, notes, datum)
+        if typ == "IN":
+            _upsert_inventory_delta(con, lot_id, location_id, paletten, koli)
+        for doc in documents:
+            _add_document(con, mid, *doc)
+        ids.append(mid)
+    return ids
+
+def book_movements(data_dir: str, typ: str, lines, partner: str, reference: str, notes: str, datum,
+                   documents=()) -> list:
+    """Bucht mehrere Positionen (z.B. eine LKW-Ladung) ganz oder gar nicht.
+
+    lines: Folge von (lot_id, location_id, paletten, koli); Partner, Referenz,
+    Notizen, Datum und Dokumente gelten für alle Positionen. Bei OUT wird nur
+    freier Bestand (ohne Reservierungen) abgebucht, sonst BookingError.
+    Gibt die IDs der neuen Bewegungen zurück.
+    """
+    if typ not in ("IN", "OUT"):
+        raise ValueError(f"Unbekannter Bewegungstyp: {typ}")
+    return _write(data_dir, _book_movements, typ, _normalize_lines(lines),
+                  partner, reference, notes, datum, list(documents))
+
+def book_movement(data_dir: str, typ: str, lot_id: int, location_id: int, paletten: int, koli: int,
+                  partner: str, reference: str, notes: str, datum, documents=()):
+    """Bucht Bewegung, Bestandsänderung und Dokumente in einer Transaktion.
+
+    documents: Folge von (filename, stored_path, mime, size_bytes[, sha256]).
+    Gibt die ID der neuen Bewegung zurück.
+    """
+    return book_movements(data_dir, typ, [(lot_id, location_id, paletten, koli)],
+                          partner, reference, notes, datum, documents)[0]
+
+# -------- FEFO allocation --------
+def _normalize_order(order):
+    out = []
+    for n, line in enumerate(order, start=1):
+        item_id, paletten, koli = line
+        try:
+            item_id, paletten, koli = int(item_id), int(paletten), int(koli)
+        except (TypeError, ValueError):
+            raise BookingError(f"Auftragszeile {n}: ungültige Werte.") from None
+        if paletten < 0 or koli < 0:
+            raise BookingError(f"Auftragszeile {n}: negative Mengen sind nicht erlaubt.")
+        if paletten == 0 and koli == 0:
+            raise BookingError(f"Auftragszeile {n}: Paletten oder Koli muss > 0 sein.")
+        out.append((item_id, paletten, koli))
+    if not out:
+        raise BookingError("Keine Auftragszeilen angegeben.")
+    return out
+
+def _fefo_candidates(con, item_ids, min_mhd=None):
+    """Freie Bestandspositionen je Artikel in FEFO-Reihenfolge: frühestes MHD zuerst,
+    Chargen ohne MHD zuletzt, Chargen mit MHD vor min_mhd gar nicht;
+    {item_id: [[lot_id, location_id, paletten, koli], ...]}."""
+    candidates = {}
+    min_mhd = _iso(min_mhd)
+    item_ids = sorted(set(item_ids))
+    for start in range(0, len(item_ids), _STOCK_CHECK_CHUNK):
+        chunk = item_ids[start:start + _STOCK_CHECK_CHUNK]
+        values = ",".join("(?)" for _ in chunk)
+        rows = con.execute(f"""
+            WITH req(item_id) AS (VALUES {values})
+            SELECT l.item_id, inv.lot_id, inv.location_id,
+                   inv.paletten - inv.reserved_paletten, inv.koli - inv.reserved_koli
+            FROM req
+            JOIN lots l ON l.item_id = req.item_id
+            JOIN inventory inv ON inv.lot_id = l.id
+            WHERE (inv.paletten > inv.reserved_paletten OR inv.koli > inv.reserved_koli)
+              AND (? IS NULL OR l.mhd IS NULL OR l.mhd >= ?)
+            ORDER BY l.item_id, l.mhd IS NULL, l.mhd, l.id, inv.location_id
+        """, chunk + [min_mhd, min_mhd])
+        for item_id, lot_id, location_id, paletten, koli in rows:
+            candidates.setdefault(item_id, []).append([lot_id, location_id, max(paletten, 0), max(koli, 0)])
+    return candidates
+
+def _allocate_fefo(con, order, min_mhd=None):
+    """Verteilt Auftragszeilen (item_id, paletten, koli) per FEFO auf Chargen und
+    Lagerplätze. Gibt (zeile, item_id, lot_id, location_id, paletten, koli) zurück;
+    reicht der Bestand eines Artikels nicht, BookingError für alle Fehlmengen."""
+    candidates = _fefo_candidates(con, [item_id for item_id, _, _ in order], min_mhd)
+    out, short = [], []
+    for n, (item_id, need_p, need_k) in enumerate(order, start=1):
+        for cand in candidates.get(item_id, []):
+            if need_p == 0 and need_k == 0:
+                break
+            take_p, take_k = min(need_p, cand[2]), min(need_k, cand[3])
+            if take_p == 0 and take_k == 0:
+                continue
+            # gemeinsamer Restbestand, falls ein Artikel in mehreren Zeilen vorkommt
+            cand[2] -= take_p
+            cand[3] -= take_k
+            need_p -= take_p
+            need_k -= take_k
+            out.append((n, item_id, cand[0], cand[1], take_p, take_k))
+        if need_p or need_k:
+            short.append((n, item_id, need_p, need_k))
+    if short:
+        n, item_id, p, k = short[0]
+        sku = con.execute("SELECT sku FROM items WHERE id=?", (item_id,)).fetchone()
+        raise BookingError(
+            f"Nicht genug Bestand für {len(short)} Auftragszeile(n), z.B. Zeile {n} "
+            f"({sku[0] if sku else f'Artikel {item_id}'}): es fehlen {p} Pal / {k} Koli."
+        )
+    return out
+
+def allocate_fefo(data_dir: str, order, min_mhd=None) -> pd.DataFrame:
+    """Vorschau der FEFO-Zuteilung ohne Buchung (siehe book_fefo)."""
+    order = _normalize_order(order)
+    with _connect(data_dir) as con:
+        rows = _allocate_fefo(con, order, min_mhd)
+    return pd.DataFrame(rows, columns=["zeile", "item_id", "lot_id", "location_id", "paletten", "koli"])
+
+def _book_fefo(con, order, partner, reference, notes, datum, documents, min_mhd):
+    _begin_immediate(con)
+    allocation = _allocate_fefo(con, order, min_mhd)
+    lines = [(lot_id, location_id, p, k) for _, _, lot_id, location_id, p, k in allocation]
+    return _book_movements(con, "OUT", lines, partner, reference, notes, datum, documents)
+
+def book_fefo(data_dir: str, order, partner: str, reference: str, notes: str, datum, documents=(),
+              min_mhd=None) -> list:
+    """Versand nach Artikel statt nach Bestandsposition (First-Expired-First-Out).
+
+    order: Folge von (item_id, paletten, koli). Jede Zeile wird über alle
+    Lagerplätze auf die Chargen mit dem frühesten MHD (nicht vor min_mhd)
+    verteilt und als OUT-Bewegungen gebucht – alles oder nichts, Zuteilung und
+    Buchung unter derselben Schreibsperre. Gibt die IDs der neuen Bewegungen zurück.
+    """
+    return _write(data_dir, _book_fefo, _normalize_order(order), partner, reference, notes, datum,
+                  list(documents), min_mhd)
+
+# -------- reservations --------
+# Reservierte Mengen stehen in inventory.reserved_*; OUT-Buchungen greifen nur auf
+# den Rest zu (_take_stock). Offene Reservierungen verfallen nach der Haltezeit.
+RESERVATION_TTL_MINUTES = int(os.environ.get("LAGER_RESERVATION_TTL_MIN", "120"))
+
+def _expire_reservations(con) -> int:
+    return con.execute("UPDATE reservations SET status = 'abgelaufen', closed_at = ? "
+                       "WHERE status = 'offen' AND expires_at < ?", (_now(), _now())).rowcount
+
+def expire_reservations(data_dir: str) -> int:
+    """Setzt überfällige Reservierungen auf 'abgelaufen' und gibt ihre Mengen frei;
+    schreibt nur, wenn es welche gibt (Seitenaufbau, cron)."""
+    with _connect(data_dir) as con:
+        due = con.execute("SELECT 1 FROM reservations WHERE status = 'offen' AND expires_at < ? LIMIT 1",
+                          (_now(),)).fetchone()
+    return _write(data_dir, _expire_reservations) if due else 0
+
+def _reserve_stock(con, lot_id, location_id, paletten, koli, partner, reference, ttl_minutes):
+    _expire_reservations(con)
+    cur = con.execute("""
+        UPDATE inventory SET reserved_paletten = reserved_paletten + :p, reserved_koli = reserved_koli + :k
+        WHERE lot_id = :lot AND location_id = :loc
+          AND paletten - reserved_paletten >= :p AND koli - reserved_koli >= :k
+    """, {"p": paletten, "k": koli, "lot": lot_id, "loc": location_id})
+    if cur.rowcount == 0:
+        have = con.execute("SELECT paletten - reserved_paletten, koli - reserved_koli FROM inventory "
+                           "WHERE lot_id=? AND location_id=?", (lot_id, location_id)).fetchone() or (0, 0)
+        raise BookingError(f"Nicht genug freier Bestand für Charge {lot_id} / Lagerplatz {location_id}: "
+                           f"benötigt {paletten} Pal / {koli} Koli, frei {have[0]} Pal / {have[1]} Koli.")
+    now = datetime.utcnow()
+    return con.execute(
+        """INSERT INTO reservations(lot_id, location_id, paletten, koli, partner, reference, created_at, expires_at)
+             VALUES (?,?,?,?,?,?,?,?)""",
+        (lot_id, location_id, paletten, koli, partner, reference, now.isoformat(timespec="seconds"),
+         (now + timedelta(minutes=ttl_minutes)).isoformat(timespec="seconds"))
+    ).lastrowid
+
+def reserve_stock(data_dir: str, lot_id: int, location_id: int, paletten: int, koli: int,
+                  partner: str = "", reference: str = "", ttl_minutes: int = None) -> int:
+    """Hält Bestand einer Charge/eines Lagerplatzes für einen Versand zurück.
+
+    Prüfung und Reservierung sind ein bedingtes UPDATE (kein Lesen vorab), zwei
+    gleichzeitige Reservierungen können den freien Bestand also nicht überbuchen.
+    Die Reservierung verfällt nach ttl_minutes (Default RESERVATION_TTL_MINUTES).
+    Gibt die ID der Reservierung zurück; reicht der freie Bestand nicht, BookingError.
+    """
+    lot_id, location_id, paletten, koli = _normalize_lines([(lot_id, location_id, paletten, koli)])[0]
+    ttl = RESERVATION_TTL_MINUTES if ttl_minutes is None else int(ttl_minutes)
+    if ttl <= 0:
+        raise BookingError("Haltezeit muss > 0 Minuten sein.")
+    return _write(data_dir, _reserve_stock, lot_id, location_id, paletten, koli, partner, reference, ttl)
+
+def _close_reservation(con, reservation_id: int, status: str):
+    """Schließt eine offene Reservierung (Trigger gibt die Menge frei); gibt ihre Zeile zurück."""
+    row = con.execute("SELECT lot_id, location_id, paletten, koli, partner, reference, status, expires_at "
+                      "FROM reservations WHERE id=?", (reservation_id,)).fetchone()
+    if row is None:
+        raise BookingError(f"Reservierung {reservation_id} gibt es nicht.")
+    if row[6] == "offen" and row[7] < _now():
+        raise BookingError(f"Reservierung {reservation_id} ist abgelaufen.")
+    cur = con.execute("UPDATE reservations SET status = ?, closed_at = ? WHERE id = ? AND status = 'offen'",
+                      (status, _now(), reservation_id))
+    if cur.rowcount == 0:
+        raise BookingError(f"Reservierung {reservation_id} ist nicht mehr offen ({row[6]}).")
+    return row
+
+def _commit_reservation(con, reservation_id, partner, reference, notes, datum, documents):
+    lot_id, location_id, paletten, koli, r_partner, r_reference, _, _ = _close_reservation(
+        con, reservation_id, "gebucht")
+    mid = _book_movements(con, "OUT", [(lot_id, location_id, paletten, koli)], partner or r_partner or "",
+                          reference or r_reference or "", notes, datum, documents)[0]
+    con.execute("UPDATE reservations SET movement_id = ? WHERE id = ?", (mid, reservation_id))
     return mid
 
+def commit_reservation(data_dir: str, reservation_id: int, datum, partner: str = "", reference: str = "",
+                       notes: str = "", documents=()) -> int:
+    """Bucht eine offene Reservierung als OUT-Bewegung (Partner/Referenz ohne
+    Angabe aus der Reservierung). Gibt die ID der Bewegung zurück."""
+    return _write(data_dir, _commit_reservation, int(reservation_id), partner, reference, notes, datum,
+                  list(documents))
+
+def release_reservation(data_dir: str, reservation_id: int):
+    """Gibt eine offene Reservierung ohne Buchung frei."""
+    _write(data_dir, _close_reservation, int(reservation_id), "freigegeben")
+
+# Nicht @_cached: ob eine Reservierung noch offen ist, hängt von der Uhrzeit ab,
+# data_version ändert sich beim Ablaufen aber erst mit dem nächsten Schreibzugriff
+def get_reservations(data_dir: str, status: str = "offen", lot_id: int = None,
+                     location_id: int = None) -> pd.DataFrame:
+    """Reservierungen (status None = alle), neueste zuerst; überfällige, noch
+    nicht aufgeräumte offene Reservierungen erscheinen als 'abgelaufen'."""
+    where, params = [], [_now()]
+    if status == "offen":
+        where += ["r.status = ?", "r.expires_at >= ?"]
+        params += [status, params[0]]
+    elif status == "abgelaufen":
+        where.append("(r.status = 'abgelaufen' OR (r.status = 'offen' AND r.expires_at < ?))")
+        params.append(params[0])
+    elif status is not None:
+        where.append("r.status = ?")
+        params.append(status)
+    for clause, value in (("r.lot_id = ?", lot_id), ("r.location_id = ?", location_id)):
+        if value is not None:
+            where.append(clause)
+            params.append(value)
+    with _connect(data_dir) as con:
+        return pd.read_sql_query(f"""
+            SELECT
+                r.id,
+                r.lot_id,
+                r.location_id,
+                i.sku,
+                l.batch,
+                loc.code AS lagerplatz,
+                r.paletten,
+                r.koli,
+                r.partner,
+                r.reference,
+                CASE WHEN r.status = 'offen' AND r.expires_at < ? THEN 'abgelaufen' ELSE r.status END AS status,
+                r.created_at,
+                r.expires_at,
+                r.movement_id
+            FROM reservations r
+            JOIN lots l ON l.id = r.lot_id
+            JOIN items i ON i.id = l.item_id
+            JOIN locations loc ON loc.id = r.location_id
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY r.id DESC
+        """, con, params=params)
+
+@_cached
 def get_movements(data_dir: str) -> pd.DataFrame:
-    con = _conn(_db_path(data_dir))
-    df = pd.read_sql_query("""
-        SELECT
-            m.id,
-            m.typ,
-            m.datum,
-            i.sku,
-            i.name AS artikel,
-            l.batch,
-            l.mhd,
-            loc.code AS lagerplatz,
-            m.paletten,
-            m.koli,
-            m.partner,
-            m.reference,
-            m.notes,
-            m.created_at
+    with _connect(data_dir) as con:
+        return pd.read_sql_query("""
+            SELECT
+                m.id,
+                m.typ,
+                m.datum,
+                i.sku,
+                i.name AS artikel,
+                l.batch,
+                l.mhd,
+                loc.code AS lagerplatz,
+                m.paletten,
+                m.koli,
+                m.partner,
+                m.reference,
+                m.notes,
+                m.created_at
+            FROM movements m
+            JOIN lots l ON l.id = m.lot_id
+            JOIN items i ON i.id = l.item_id
+            JOIN locations loc ON loc.id = m.location_id
+            ORDER BY m.id DESC
+        """, con)
+
+def _like_pattern(text: str) -> str:
+    esc = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{esc}%"
+
+_MOVEMENT_SELECT = """
+    SELECT
+        m.id,
+        m.typ,
+        m.datum,
+        i.sku,
+        i.name AS artikel,
+        l.batch,
+        l.mhd,
+        loc.code AS lagerplatz,
+        m.paletten,
+        m.koli,
+        m.partner,
+        m.reference,
+        m.notes,
+        m.created_at
+    FROM movements m
+    JOIN lots l ON l.id = m.lot_id
+    JOIN items i ON i.id = l.item_id
+    JOIN locations loc ON loc.id = m.location_id
+"""
+
+def _movement_select(include_archive: bool = False) -> str:
+    if include_archive:
+        return _MOVEMENT_SELECT.replace("FROM movements m", "FROM movements_all m", 1)
+    return _MOVEMENT_SELECT
+
+def _movement_filters(typ=None, partner_like=None, date_from=None, date_to=None):
+    clauses, params = [], []
+    if typ:
+        clauses.append("m.typ = ?")
+        params.append(typ)
+    if partner_like:
+        clauses.append("m.partner LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(partner_like))
+    if date_from:
+        clauses.append("m.datum >= ?")
+        params.append(_iso(date_from))
+    if date_to:
+        clauses.append("m.datum <= ?")
+        params.append(_iso(date_to))
+    return clauses, params
+
+@_cached
+def query_movements(data_dir: str, typ=None, partner_like=None, date_from=None, date_to=None,
+                    after_id=None, limit=500, include_archive: bool = False) -> pd.DataFrame:
+    """Gefilterte Bewegungen, neueste zuerst, seitenweise per Keyset (id < after_id).
+    include_archive=True bezieht archivierte Jahre im Zeitraum mit ein."""
+    clauses, params = _movement_filters(typ, partner_like, date_from, date_to)
+    if after_id is not None:
+        clauses.append("m.id < ?")
+        params.append(int(after_id))
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    params.append(int(limit))
+    archived = include_archive and _reaches_archive(data_dir, date_from)
+    sql = f"""
+        {_movement_select(archived)}
+        {where}
+        ORDER BY m.id DESC
+        LIMIT ?
+    """
+    if not archived:
+        with _connect(data_dir) as con:
+            return pd.read_sql_query(sql, con, params=params)
+    with _connect(data_dir) as con:
+        years = _archived_years(con, date_from, date_to)
+    # je Gruppe von Jahresarchiven die neuesten `limit`, daraus die neuesten `limit`
+    frames = [pd.read_sql_query(sql, con, params=params) for con in _archive_batches(data_dir, years)]
+    if len(frames) == 1:
+        return frames[0]
+    frames = [f for f in frames if not f.empty] or frames[:1]
+    return pd.concat(frames, ignore_index=True).sort_values("id", ascending=False, ignore_index=True).head(int(limit))
+
+# -------- full-text search --------
+def _fts_query(text: str):
+    """Suchtext → FTS5-Ausdruck: jedes Wort als Präfix, alle Wörter müssen vorkommen."""
+    words = re.findall(r"\w+", text or "")
+    return " ".join(f'"{w}"*' for w in words) or None
+
+@_cached
+def search_movements(data_dir: str, text: str, typ=None, partner_like=None, date_from=None, date_to=None,
+                     limit: int = 100) -> pd.DataFrame:
+    """Volltextsuche über Partner, Referenz, Notizen und Dokumentnamen (Präfixsuche,
+    alle Wörter). Beste Treffer zuerst (bm25, Spalte rang: kleiner = besser);
+    Filter wie in query_movements."""
+    match = _fts_query(text)
+    if match is None:
+        return pd.DataFrame()
+    clauses, params = _movement_filters(typ, partner_like, date_from, date_to)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    # Erst ranken und auf limit kürzen, dann die Stammdaten nur für die Treffer nachladen
+    select = _MOVEMENT_SELECT.replace("FROM movements m", "FROM top h JOIN movements m ON m.id = h.id", 1)
+    select = select.replace("SELECT", "SELECT round(h.rang, 3) AS rang, h.dokument,", 1)
+    with _connect(data_dir) as con:
+        return pd.read_sql_query(f"""
+            WITH raw(id, rang, dokument) AS (
+                SELECT rowid, bm25(movements_fts), NULL FROM movements_fts WHERE movements_fts MATCH ?
+                UNION ALL
+                SELECT d.movement_id, bm25(documents_fts), d.filename
+                FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid
+                WHERE documents_fts MATCH ?
+            ),
+            hits(id, rang, dokument) AS (
+                SELECT id, MIN(rang), MAX(dokument) FROM raw GROUP BY id
+            ),
+            top(id, rang, dokument) AS MATERIALIZED (
+                SELECT h.id, h.rang, h.dokument FROM hits h JOIN movements m ON m.id = h.id
+                {where}
+                ORDER BY h.rang, h.id DESC
+                LIMIT ?
+            )
+            {select}
+            ORDER BY h.rang, m.id DESC
+        """, con, params=[match, match] + params + [int(limit)])
+
+# -------- exports --------
+EXPORT_CHUNK_ROWS = 5000
+
+def _pooled(data_dir: str):
+    with _connect(data_dir) as con:
+        yield con
+
+def _iter_rows(data_dir: str, sql: str, params, chunk_rows: int, connections=None):
+    """Generator: zuerst die Spaltennamen, dann Zeilenblöcke per fetchmany.
+    Die Abfrage läuft nacheinander auf jeder Verbindung aus `connections`
+    (Default: eine gepoolte, also ein einziger Lesesnapshot); die Verbindung
+    bleibt bis zum Ende (oder close()) des Generators belegt."""
+    header = True
+    with closing(connections or _pooled(data_dir)) as cons:
+        for con in cons:
+            cur = con.execute(sql, params)
+            try:
+                if header:
+                    yield [d[0] for d in cur.description]
+                    header = False
+                while True:
+                    rows = cur.fetchmany(chunk_rows)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                cur.close()
+
+def iter_movements(data_dir: str, typ=None, partner_like=None, date_from=None, date_to=None,
+                   chunk_rows: int = EXPORT_CHUNK_ROWS, include_archive: bool = False):
+    """Alle Bewegungen zu den Filtern der Bewegungsansicht, älteste zuerst, blockweise
+    (siehe _iter_rows); für Exporte ohne DataFrame."""
+    clauses, params = _movement_filters(typ, partner_like, date_from, date_to)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    archived = include_archive and _reaches_archive(data_dir, date_from)
+    connections = None
+    if archived:
+        # älteste Jahresarchive zuerst, aktuelle Tabelle zuletzt; innerhalb je Gruppe nach id
+        with _connect(data_dir) as con:
+            connections = _archive_batches(data_dir, _archived_years(con, date_from, date_to))
+    return _iter_rows(data_dir, f"{_movement_select(archived)} {where} ORDER BY m.id", params, chunk_rows,
+                      connections)
+
+def iter_inventory(data_dir: str, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """Aktueller Bestand (ohne Nullzeilen) blockweise, wie get_inventory()."""
+    return _iter_rows(data_dir, f"""
+        SELECT inv.lot_id, inv.location_id, i.sku, i.name AS artikel, l.batch, l.mhd,
+               loc.code AS lagerplatz, inv.paletten, inv.koli, inv.updated_at
+        FROM inventory inv
+        JOIN lots l ON l.id = inv.lot_id
+        JOIN items i ON i.id = l.item_id
+        JOIN locations loc ON loc.id = inv.location_id
+        WHERE inv.paletten <> 0 OR inv.koli <> 0
+        ORDER BY i.sku, l.batch, loc.code
+    """, (), chunk_rows)
+
+# -------- point-in-time inventory --------
+# Bestand (lot, location) am Ende von :upto = Snapshot :base + Bewegungen in (:base, :upto]
+# datum ist ein reiner Tag (DATE_ONLY_MESSAGE), daher direkt vergleichbar und per Index
+_STOCK_AS_OF_SQL = """
+    SELECT lot_id, location_id, SUM(p) AS paletten, SUM(k) AS koli
+    FROM (
+        SELECT lot_id, location_id, paletten AS p, koli AS k
+        FROM inventory_snapshots WHERE snap_date = :base
+        UNION ALL
+        SELECT lot_id, location_id,
+               CASE typ WHEN 'OUT' THEN -paletten ELSE paletten END,
+               CASE typ WHEN 'OUT' THEN -koli ELSE koli END
+        FROM movements
+        WHERE datum > :base AND datum <= :upto
+    )
+    GROUP BY lot_id, location_id
+    HAVING SUM(p) <> 0 OR SUM(k) <> 0
+"""
+
+def _month_ends(first: date, last: date):
+    y, m = first.year, first.month
+    while True:
+        nxt = date(y + (m == 12), m % 12 + 1, 1)
+        end = date.fromordinal(nxt.toordinal() - 1)
+        if end > last:
+            return
+        yield end
+        y, m = nxt.year, nxt.month
+
+def _latest_snapshot(con, upto: str) -> str:
+    row = con.execute("SELECT MAX(snap_date) FROM snapshot_dates WHERE snap_date <= ?", (upto,)).fetchone()
+    return row[0] or ""
+
+def _build_snapshot(con, snap_date: str):
+    _begin_immediate(con)
+    if con.execute("SELECT 1 FROM snapshot_dates WHERE snap_date=?", (snap_date,)).fetchone():
+        return False
+    base = _latest_snapshot(con, snap_date)
+    con.execute(
+        f"INSERT INTO inventory_snapshots(snap_date, lot_id, location_id, paletten, koli) "
+        f"SELECT :snap, lot_id, location_id, paletten, koli FROM ({_STOCK_AS_OF_SQL})",
+        {"snap": snap_date, "base": base, "upto": snap_date}
+    )
+    con.execute("INSERT INTO snapshot_dates(snap_date, created_at) VALUES (?,?)", (snap_date, _now()))
+    return True
+
+def build_inventory_snapshots(data_dir: str, until=None) -> list:
+    """Legt fehlende Monatsend-Snapshots bis einschließlich `until` an (Default: heute).
+    Jeder Snapshot baut auf dem vorherigen auf. Gibt die neu angelegten Daten zurück."""
+    until = date.fromisoformat(_iso(until)) if until else date.today()
+    with _connect(data_dir) as con:
+        first = con.execute("SELECT MIN(datum) FROM movements").fetchone()[0]
+    if not first:
+        return []
+    built = []
+    for end in _month_ends(date.fromisoformat(first[:10]), until):
+        if _write(data_dir, _build_snapshot, end.isoformat()):
+            built.append(end.isoformat())
+    return built
+
+_AS_OF_QUERY = """
+    SELECT
+        s.lot_id,
+        s.location_id,
+        i.sku,
+        i.name AS artikel,
+        l.batch,
+        l.mhd,
+        loc.code AS lagerplatz,
+        s.paletten,
+        s.koli
+    FROM ({stock}) s
+    JOIN lots l ON l.id = s.lot_id
+    JOIN items i ON i.id = l.item_id
+    JOIN locations loc ON loc.id = s.location_id
+    ORDER BY i.sku, l.batch, loc.code
+"""
+# Bestand [[lot_id, location_id, paletten, koli], ...] als JSON-Parameter :stock
+_STOCK_FROM_JSON_SQL = """
+    SELECT json_extract(value, '$[0]') AS lot_id, json_extract(value, '$[1]') AS location_id,
+           json_extract(value, '$[2]') AS paletten, json_extract(value, '$[3]') AS koli
+    FROM json_each(:stock)
+"""
+
+@_cached
+def get_inventory_as_of(data_dir: str, as_of) -> pd.DataFrame:
+    """Bestand je Charge/Lagerplatz am Ende des Tages `as_of`: nächster Snapshot
+    davor plus die Bewegungen danach."""
+    upto = _iso(as_of)
+    with _connect(data_dir) as con:
+        base = _latest_snapshot(con, upto)
+        cutoff = _archive_cutoff(con)
+        # Zeitraum (base, upto] ganz oder teilweise archiviert: Jahresarchive dazunehmen
+        if cutoff is None or base >= cutoff:
+            return pd.read_sql_query(_AS_OF_QUERY.format(stock=_STOCK_AS_OF_SQL), con,
+                                     params={"base": base, "upto": upto})
+        years = _archived_years(con, base or None, upto)
+    # Summen je Gruppe von Jahresarchiven (Snapshot nur einmal), zusammen in einer Abfrage
+    totals = {}
+    for n, con in enumerate(_archive_batches(data_dir, years)):
+        sql = _STOCK_AS_OF_SQL.replace("FROM movements", "FROM movements_all")
+        if n:
+            sql = sql.replace("WHERE snap_date = :base", "WHERE 0")
+        for lot_id, location_id, p, k in con.execute(sql, {"base": base, "upto": upto}):
+            have = totals.get((lot_id, location_id), (0, 0))
+            totals[(lot_id, location_id)] = (have[0] + p, have[1] + k)
+    stock = [[lot, loc, p, k] for (lot, loc), (p, k) in totals.items() if p or k]
+    with _connect(data_dir) as con:
+        return pd.read_sql_query(_AS_OF_QUERY.format(stock=_STOCK_FROM_JSON_SQL), con,
+                                 params={"stock": json.dumps(stock)})
+
+# -------- expiry watchlist --------
+# Obergrenzen (Tage bis MHD) der Warnstufen; abgelaufene Chargen bilden eine eigene Stufe
+EXPIRY_BUCKETS = (14, 30, 60)
+EXPIRY_BUCKET_LABELS = ["abgelaufen"] + [f"≤ {d} Tage" for d in EXPIRY_BUCKETS]
+# Stufe für Chargen jenseits der letzten Grenze (nur bei days > EXPIRY_BUCKETS[-1])
+EXPIRY_OVERFLOW_LABEL = f"> {EXPIRY_BUCKETS[-1]} Tage"
+
+@_cached
+def _expiry_watchlist(data_dir: str, as_of: str, days: int) -> pd.DataFrame:
+    bucket = "CASE WHEN tage < 0 THEN ? " + "".join(f"WHEN tage <= {int(d)} THEN ? " for d in EXPIRY_BUCKETS) \
+             + "ELSE ? END"
+    with _connect(data_dir) as con:
+        return pd.read_sql_query(f"""
+            SELECT w.*, {bucket} AS stufe
+            FROM (
+                SELECT inv.lot_id, inv.location_id, i.sku, i.name AS artikel, l.batch, l.mhd,
+                       CAST(julianday(l.mhd) - julianday(?) AS INTEGER) AS tage,
+                       loc.code AS lagerplatz, inv.paletten, inv.koli
+                FROM lots l
+                JOIN inventory inv ON inv.lot_id = l.id
+                JOIN items i ON i.id = l.item_id
+                JOIN locations loc ON loc.id = inv.location_id
+                WHERE l.mhd IS NOT NULL AND l.mhd <= date(?, '+' || ? || ' days')
+                  AND (inv.paletten <> 0 OR inv.koli <> 0)
+            ) w
+            ORDER BY w.mhd, w.sku, w.lagerplatz
+        """, con, params=EXPIRY_BUCKET_LABELS + [EXPIRY_OVERFLOW_LABEL, as_of, as_of, int(days)])
+
+def get_expiry_watchlist(data_dir: str, as_of=None, days: int = EXPIRY_BUCKETS[-1]) -> pd.DataFrame:
+    """Bestandspositionen, deren Charge bis as_of + days (Default: heute + 60)
+    abläuft oder schon abgelaufen ist, nach MHD sortiert; tage = Resttage,
+    stufe = Warnstufe (siehe EXPIRY_BUCKETS)."""
+    return _expiry_watchlist(data_dir, _iso(as_of or date.today()), int(days))
+
+def get_expiry_summary(data_dir: str, as_of=None, days: int = EXPIRY_BUCKETS[-1]) -> pd.DataFrame:
+    """Je Warnstufe der Warnliste (as_of, days): Positionen, Chargen, Paletten und
+    Koli (alle Stufen, auch leere; "> 60 Tage" nur bei days über der letzten Grenze)."""
+    watch = get_expiry_watchlist(data_dir, as_of, days)
+    summary = watch.groupby("stufe").agg(positionen=("lot_id", "size"), chargen=("lot_id", "nunique"),
+                                         paletten=("paletten", "sum"), koli=("koli", "sum"))
+    labels = EXPIRY_BUCKET_LABELS + ([EXPIRY_OVERFLOW_LABEL] if int(days) > EXPIRY_BUCKETS[-1] else [])
+    return summary.reindex(labels, fill_value=0).rename_axis("stufe").reset_index()
+
+# -------- reports --------
+_REPORT_GROUPS = {
+    "partner": ("r.partner", "partner"),
+    "sku": ("i.sku", "sku"),
+    "lagerplatz": ("loc.code", "lagerplatz"),
+    "tag": ("r.day", "tag"),
+}
+
+def _rebuild_daily_rollup(con, date_from=None, date_to=None):
+    day_from, day_to = _iso(date_from) or "", _iso(date_to) or "9999-12-31"
+    params = (day_from, day_to)
+    con.execute("DELETE FROM movement_daily_rollup WHERE day >= ? AND day <= ?", params)
+    con.execute("""
+        INSERT INTO movement_daily_rollup(day,typ,item_id,partner,location_id,paletten,koli,n)
+        SELECT substr(m.datum,1,10), m.typ, l.item_id, COALESCE(m.partner,''), m.location_id,
+               SUM(m.paletten), SUM(m.koli), COUNT(*)
         FROM movements m
         JOIN lots l ON l.id = m.lot_id
-        JOIN items i ON i.id = l.item_id
-        JOIN locations loc ON loc.id = m.location_id
-        ORDER BY m.id DESC
-    """, con)
-    con.close()
-    return df
+        WHERE substr(m.datum,1,10) >= ? AND substr(m.datum,1,10) <= ?
+        GROUP BY 1, 2, 3, 4, 5
+    """, params)
+
+def rebuild_daily_rollup(data_dir: str, date_from=None, date_to=None):
+    """Baut die Tagesverdichtung (ganz oder für einen Datumsbereich) aus movements neu auf."""
+    # Archivierte Tage stehen nicht mehr in movements; ihre Verdichtung bleibt
+    cutoff = get_archive_cutoff(data_dir)
+    if cutoff and (_iso(date_from) or "") <= cutoff:
+        date_from = date.fromisoformat(cutoff) + timedelta(days=1)
+    _write(data_dir, _rebuild_daily_rollup, date_from, date_to)
+
+@_cached
+def get_movement_report(data_dir: str, typ="OUT", group_by="partner", date_from=None, date_to=None) -> pd.DataFrame:
+    """Summen je Gruppe (partner | sku | lagerplatz | tag) aus der Tagesverdichtung."""
+    if group_by not in _REPORT_GROUPS:
+        raise ValueError(f"Unbekannte Gruppierung: {group_by}")
+    expr, name = _REPORT_GROUPS[group_by]
+    clauses, params = [], []
+    if typ:
+        clauses.append("r.typ = ?")
+        params.append(typ)
+    if date_from:
+        clauses.append("r.day >= ?")
+        params.append(_iso(date_from))
+    if date_to:
+        clauses.append("r.day <= ?")
+        params.append(_iso(date_to))
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    with _connect(data_dir) as con:
+        return pd.read_sql_query(f"""
+            SELECT {expr} AS {name}, SUM(r.paletten) AS paletten, SUM(r.koli) AS koli, SUM(r.n) AS bewegungen
+            FROM movement_daily_rollup r
+            JOIN items i ON i.id = r.item_id
+            JOIN locations loc ON loc.id = r.location_id
+            {where}
+            GROUP BY {expr}
+            ORDER BY {expr}
+        """, con, params=params)
 
 # -------- documents --------
-def add_document(data_dir: str, movement_id: int, filename: str, stored_path: str, mime: str, size_bytes: int):
-    con = _conn(_db_path(data_dir))
+def _add_document(con, movement_id: int, filename: str, stored_path: str, mime: str, size_bytes: int,
+                  sha256: str = None):
     con.execute(
-        "INSERT INTO documents(movement_id,filename,stored_path,mime,size_bytes,uploaded_at) VALUES (?,?,?,?,?,?)",
-        (movement_id, filename, stored_path, mime, size_bytes, _now())
+        "INSERT INTO documents(movement_id,filename,stored_path,mime,size_bytes,uploaded_at,sha256) VALUES (?,?,?,?,?,?,?)",
+        (movement_id, filename, stored_path, mime, size_bytes, _now(), sha256)
     )
-    con.commit()
-    con.close()
 
+def add_document(data_dir: str, movement_id: int, filename: str, stored_path: str, mime: str, size_bytes: int,
+                 sha256: str = None):
+    _write(data_dir, _add_document, movement_id, filename, stored_path, mime, size_bytes, sha256)
+
+@_cached
 def get_documents_for_movement(data_dir: str, movement_id: int) -> pd.DataFrame:
-    con = _conn(_db_path(data_dir))
-    df = pd.read_sql_query(
-        "SELECT id, movement_id, filename, stored_path, mime, size_bytes, uploaded_at FROM documents WHERE movement_id=? ORDER BY id DESC",
-        con, params=(movement_id,)
-    )
-    con.close()
-    return df
+    """Dokumente einer Bewegung; bei archivierten Bewegungen aus dem Jahresarchiv."""
+    sql = "SELECT id, movement_id, filename, stored_path, mime, size_bytes, uploaded_at, sha256 FROM {t} WHERE movement_id=? ORDER BY id DESC"
+    with _connect(data_dir) as con:
+        docs = pd.read_sql_query(sql.format(t="documents"), con, params=(movement_id,))
+        archived = docs.empty and _archive_cutoff(con) is not None
+        years = _archived_years_with(con, "movement", movement_id) if archived else []
+    # nur die Jahresarchive, deren Bewegungs-ids movement_id umfassen (meist eines)
+    for con in _archive_batches(data_dir, years) if years else ():
+        docs = pd.read_sql_query(sql.format(t="documents_all"), con, params=(movement_id,))
+        if not docs.empty:
+            break
+    return docs
+
+def get_document_info(data_dir: str, document_id: int):
+    """Metadaten eines Dokuments als dict (ohne Inhalt) oder None."""
+    sql = "SELECT id, movement_id, filename, stored_path, mime, size_bytes, sha256 FROM {t} WHERE id=?"
+    with _connect(data_dir) as con:
+        row = con.execute(sql.format(t="documents"), (document_id,)).fetchone()
+        archived = not row and _archive_cutoff(con) is not None
+        years = _archived_years_with(con, "document", document_id) if archived else []
+    for con in _archive_batches(data_dir, years) if years else ():
+        row = con.execute(sql.format(t="documents_all"), (document_id,)).fetchone()
+        if row:
+            break
+    if not row:
+        return None
+    keys = ("id", "movement_id", "filename", "stored_path", "mime", "size_bytes", "sha256")
+    return dict(zip(keys, row))
 
 def get_document_blob(data_dir: str, document_id: int) -> bytes:
-    con = _conn(_db_path(data_dir))
-    cur = con.cursor()
-    cur.execute("SELECT stored_path FROM documents WHERE id=?", (document_id,))
-    row = cur.fetchone()
-    con.close()
+    with _connect(data_dir) as con:
+        row = con.execute("SELECT stored_path FROM documents WHERE id=?", (document_id,)).fetchone()
     if not row:
         return b""
     path = row[0]
     with open(path, "rb") as f:
         return f.read()
+
+# -------- blobs --------
+def get_blobs(data_dir: str, unreferenced_only: bool = False) -> list:
+    """(sha256, stored_path) der bekannten Blobs, optional nur ohne Referenz."""
+    sql = "SELECT sha256, stored_path FROM blobs"
+    if unreferenced_only:
+        sql += " WHERE refcount <= 0"
+    with _connect(data_dir) as con:
+        return con.execute(sql).fetchall()
+
+def drop_blob(data_dir: str, sha256: str) -> bool:
+    """Entfernt die blobs-Zeile, falls der Blob (noch) unreferenziert ist."""
+    return _write(data_dir, lambda con: con.execute(
+        "DELETE FROM blobs WHERE sha256=? AND refcount <= 0", (sha256,)
+    ).rowcount > 0)
+
+# -------- archive --------
+# Jahresarchive der Bewegungen/Dokumente (angelegt von src/archive.py)
+ARCHIVE_DIR = "archive"
+ARCHIVE_COLUMNS = {
+    "movements": "id, typ, lot_id, location_id, paletten, koli, partner, reference, notes, datum, created_at",
+    "documents": "id, movement_id, filename, stored_path, mime, size_bytes, uploaded_at, sha256",
+}
+
+def archive_path(data_dir: str, year: int) -> str:
+    return os.path.join(data_dir, ARCHIVE_DIR, f"movements_{int(year)}.db")
+
+def _archive_cutoff(con):
+    row = con.execute("SELECT cutoff FROM archive_state WHERE id = 1").fetchone()
+    return row[0] if row else None
+
+@_cached
+def get_archive_cutoff(data_dir: str):
+    """Stichtag der Archivierung (bis einschließlich) oder None."""
+    with _connect(data_dir) as con:
+        return _archive_cutoff(con)
+
+def _reaches_archive(data_dir: str, date_from) -> bool:
+    cutoff = get_archive_cutoff(data_dir)
+    return cutoff is not None and (not date_from or _iso(date_from) <= cutoff)
+
+def _archived_years(con, date_from=None, date_to=None) -> list:
+    """Archivierte Jahre im Zeitraum (ohne Grenzen: alle)."""
+    y_from = int(_iso(date_from)[:4]) if date_from else 0
+    y_to = int(_iso(date_to)[:4]) if date_to else 9999
+    return [y for (y,) in con.execute(
+        "SELECT DISTINCT year FROM archive_log WHERE year BETWEEN ? AND ? ORDER BY year", (y_from, y_to))]
+
+def _archived_years_with(con, kind: str, row_id: int) -> list:
+    """Jahre, deren archivierter id-Bereich (kind movement|document) row_id enthält;
+    Läufe ohne bekannten Bereich (Archivdatei fehlte bei Migration 14) zählen mit."""
+    rows = "movements" if kind == "movement" else "documents"
+    return [y for (y,) in con.execute(f"""
+        SELECT DISTINCT year FROM archive_log
+        WHERE {rows} > 0 AND (? BETWEEN {kind}_id_min AND {kind}_id_max OR {kind}_id_min IS NULL)
+        ORDER BY year
+    """, (int(row_id),))]
+
+def _attach_limit(con) -> int:
+    # Python < 3.11 kennt getlimit() nicht; 10 ist der SQLite-Standard
+    getlimit = getattr(con, "getlimit", None)
+    return getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) if getlimit else 10
+
+@contextmanager
+def _attach_archives(data_dir: str, years, with_main: bool = True):
+    """Eigene (nicht gepoolte) Verbindung, an die die Jahresarchive `years`
+    angehängt sind, mit den TEMP-Views movements_all und documents_all
+    (aktuelle Tabelle, falls with_main, UNION ALL Archive). Nur lesend;
+    höchstens _attach_limit() Jahre, sonst _archive_batches()."""
+    con = _conn(_db_path(data_dir))
+    try:
+        if len(years) > _attach_limit(con):
+            raise ValueError(f"Zu viele Jahresarchive auf einmal ({len(years)}), siehe _archive_batches().")
+        for year in years:
+            path = archive_path(data_dir, year)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Archivdatei fehlt: {path}")
+            con.execute(f"ATTACH DATABASE ? AS arch_{int(year)}", (path,))
+        for table, cols in ARCHIVE_COLUMNS.items():
+            parts = [f"SELECT {cols} FROM main.{table}"] if with_main else []
+            parts += [f"SELECT {cols} FROM arch_{int(y)}.{table}" for y in years]
+            con.execute(f"CREATE TEMP VIEW {table}_all AS " + " UNION ALL ".join(parts))
+        con.execute("PRAGMA query_only=ON;")
+        yield con
+    finally:
+        con.close()
+
+def _archive_batches(data_dir: str, years):
+    """Generator: nacheinander Verbindungen wie _attach_archives() mit je so vielen
+    Jahresarchiven, wie SQLite auf einmal anhängen kann (älteste zuerst); nur die
+    letzte enthält auch die aktuellen Tabellen. Ergebnisse muss der Aufrufer
+    zusammenführen."""
+    years = list(years)
+    with _connect(data_dir) as con:
+        size = _attach_limit(con)
+    groups = [years[n:n + size] for n in range(0, len(years), size)] or [[]]
+    for n, group in enumerate(groups):
+        with _attach_archives(data_dir, group, with_main=n == len(groups) - 1) as con:
+            yield con
+
+def _backfill_archive_ranges(con):
+    """Migration 14: id-Bereiche älterer Archivläufe aus den Jahresdateien (ganze
+    Datei je Jahr). ATTACH geht in der Migrationstransaktion nicht, daher eine
+    eigene Verbindung je Datei."""
+    data_dir = os.path.dirname(con.execute("PRAGMA database_list").fetchone()[2])
+    for (year,) in con.execute("SELECT DISTINCT year FROM archive_log WHERE movement_id_min IS NULL").fetchall():
+        path = archive_path(data_dir, year)
+        if not os.path.exists(path):
+            continue
+        arch = sqlite3.connect(path)
+        try:
+            ranges = arch.execute("SELECT (SELECT MIN(id) FROM movements), (SELECT MAX(id) FROM movements), "
+                                  "(SELECT MIN(id) FROM documents), (SELECT MAX(id) FROM documents)").fetchone()
+        finally:
+            arch.close()
+        con.execute("UPDATE archive_log SET movement_id_min = ?, movement_id_max = ?, document_id_min = ?, "
+                    "document_id_max = ? WHERE year = ? AND movement_id_min IS NULL", (*ranges, year))
+
+@contextmanager
+def archive_connection(data_dir: str, year: int):
+    """Eigene Verbindung zur Hauptdatenbank mit der Jahresdatei `year` als Schema
+    arch (für src/archive.py; legt die Datei bei Bedarf an)."""
+    con = _conn(_db_path(data_dir))
+    try:
+        con.execute("ATTACH DATABASE ? AS arch", (archive_path(data_dir, year),))
+        con.execute("PRAGMA arch.synchronous=FULL;")
+        yield con
+    finally:
+        con.close()
+
+def database_files(data_dir: str) -> list:
+    """(Name relativ zu data_dir, Pfad) aller SQLite-Dateien: app.db und Jahresarchive."""
+    files = [("app.db", _db_path(data_dir))]
+    folder = os.path.join(data_dir, ARCHIVE_DIR)
+    if os.path.isdir(folder):
+        for name in sorted(os.listdir(folder)):
+            if re.fullmatch(r"movements_\d{4}\.db", name):
+                files.append((f"{ARCHIVE_DIR}/{name}", os.path.join(folder, name)))
+    return files
+
+@_cached
+def get_archive_info(data_dir: str) -> pd.DataFrame:
+    """Archivierte Jahre mit Zeilen- und Mengensummen (alle Läufe zusammen)."""
+    with _connect(data_dir) as con:
+        return pd.read_sql_query("""
+            SELECT year AS jahr, SUM(movements) AS bewegungen, SUM(documents) AS dokumente,
+                   SUM(paletten_in) AS paletten_in, SUM(koli_in) AS koli_in,
+                   SUM(paletten_out) AS paletten_out, SUM(koli_out) AS koli_out,
+                   MAX(cutoff) AS bis, MAX(archived_at) AS archiviert_am, MAX(path) AS datei
+            FROM archive_log
+            GROUP BY year
+            ORDER BY year
+        """, con)
+
+# -------- tracing --------
+# Öffentliche Funktionen (data_dir als erstes Argument) für src/tracing.py umhüllen;
+# muss am Dateiende stehen, damit alle Funktionen erfasst werden.
+for _name, _fn in list(globals().items()):
+    if (not _name.startswith("_") and callable(_fn) and not isinstance(_fn, type)
+            and getattr(_fn, "__module__", None) == __name__
+            and _name not in ("configure_connections", "close_all_connections", "writer_stats", "cache_stats",
+                              "clear_cache")):
+        globals()[_name] = tracing.traced(_fn)
+del _name, _fn
@@ -0,0 +1,81 @@
+"""Streaming-Exporte (CSV/JSONL) für Bewegungen und Bestand.
+
+Die Zeilen kommen blockweise aus db.iter_movements / db.iter_inventory und
+werden blockweise kodiert; der Speicherbedarf hängt nur von der Blockgröße ab,
+nicht von der Zahl der Zeilen.
+"""
+import io
+import os
+import csv
+import json
+import tempfile
+
+from src.db import iter_movements, iter_inventory
+
+FORMATS = {"csv": ("text/csv", ".csv"), "jsonl": ("application/x-ndjson", ".jsonl")}
+
+
+def _csv_chunks(rows_iter, delimiter=","):
+    buf = io.StringIO()
+    w = csv.writer(buf, delimiter=delimiter)
+    # BOM, damit Excel Umlaute korrekt liest
+    buf.write("﻿")
+    w.writerow(next(rows_iter))
+    for rows in rows_iter:
+        w.writerows(rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def _jsonl_chunks(rows_iter):
+    columns = next(rows_iter)
+    dumps = json.JSONEncoder(ensure_ascii=False).encode
+    for rows in rows_iter:
+        yield "".join(dumps(dict(zip(columns, r))) + "\n" for r in rows).encode("utf-8")
+
+
+def encode(rows_iter, fmt: str = "csv", delimiter: str = ","):
+    """Kodiert (Spalten, Blöcke…) aus db.iter_* als Folge von bytes-Blöcken."""
+    if fmt == "csv":
+        return _csv_chunks(rows_iter, delimiter)
+    if fmt == "jsonl":
+        return _jsonl_chunks(rows_iter)
+    raise ValueError(f"Unbekanntes Exportformat: {fmt}")
+
+
+def export_movements(data_dir: str, fmt: str = "csv", typ=None, partner_like=None, date_from=None, date_to=None,
+                     delimiter: str = ",", include_archive: bool = False):
+    """bytes-Blöcke aller Bewegungen zu den Filtern der Bewegungsansicht."""
+    return encode(iter_movements(data_dir, typ, partner_like, date_from, date_to, include_archive=include_archive),
+                  fmt, delimiter)
+
+
+def export_inventory(data_dir: str, fmt: str = "csv", delimiter: str = ","):
+    """bytes-Blöcke des aktuellen Bestands."""
+    return encode(iter_inventory(data_dir), fmt, delimiter)
+
+
+def write_chunks(chunks, path: str) -> int:
+    """Schreibt die Blöcke atomar nach path (Temp-Datei + replace); gibt die Bytes zurück."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".export-")
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+    return size
@@ -0,0 +1,281 @@
+"""Massenimport von Stammdaten und Anfangsbestand aus CSV-Dateien.
+
+Dateien werden zeilenweise gelesen, blockweise geprüft und per executemany in
+einer einzigen Transaktion geschrieben. Erwartete Spalten (Kopfzeile):
+
+    items      sku, name
+    locations  code, description
+    lots       sku, batch, mhd
+    stock      sku, batch, mhd, location, paletten, koli
+
+Anfangsbestand wird als IN-Bewegung gebucht, damit Bestand und Bewegungen
+übereinstimmen; fehlende Chargen werden dabei angelegt.
+"""
+import csv
+from datetime import date, datetime
+
+from src.db import write_transaction
+
+CHUNK_ROWS = 10_000
+# Seiten-Cache (KiB, negativ wie bei PRAGMA cache_size) für die Dauer des Imports
+IMPORT_CACHE_KIB = 256 * 1024
+MAX_KEPT_REJECTS = 1000
+OPENING_PARTNER = "Anfangsbestand"
+
+COLUMNS = {
+    "items": ("sku", "name"),
+    "locations": ("code", "description"),
+    "lots": ("sku", "batch", "mhd"),
+    "stock": ("sku", "batch", "mhd", "location", "paletten", "koli"),
+}
+REQUIRED = {
+    "items": ("sku", "name"),
+    "locations": ("code",),
+    "lots": ("sku", "batch"),
+    "stock": ("sku", "batch", "location"),
+}
+
+
+class ImportResult:
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.rows = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.rejected = 0
+        self.rejects = []  # (zeile, grund, rohdaten) – die ersten MAX_KEPT_REJECTS
+
+    def reject(self, line_no: int, reason: str, raw: dict):
+        self.rejected += 1
+        if len(self.rejects) < MAX_KEPT_REJECTS:
+            self.rejects.append((line_no, reason, raw))
+
+    def summary(self) -> str:
+        return (f"{self.kind}: {self.rows} Zeilen, {self.inserted} neu, "
+                f"{self.skipped} bereits vorhanden, {self.rejected} abgelehnt")
+
+
+class ImportFileError(ValueError):
+    """Datei als Ganzes nicht importierbar (z.B. fehlende Spalten)."""
+
+
+def _now():
+    return datetime.utcnow().isoformat(timespec="seconds")
+
+
+def _parse_date(value: str):
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(value, "%d.%m.%Y").date().isoformat()
+    except ValueError:
+        raise ValueError(f"ungültiges Datum '{value}'") from None
+
+
+def _parse_qty(value: str) -> int:
+    value = (value or "").strip()
+    if not value:
+        return 0
+    n = int(value)
+    if n < 0:
+        raise ValueError(f"negative Menge '{value}'")
+    return n
+
+
+def _reader(fileobj, delimiter=None):
+    header = fileobj.readline()
+    if not header:
+        raise ImportFileError("Datei ist leer.")
+    if delimiter is None:
+        delimiter = max(",;\t", key=header.count)
+    fields = [h.strip().lower() for h in next(csv.reader([header], delimiter=delimiter))]
+    return fields, csv.reader(fileobj, delimiter=delimiter)
+
+
+def _chunks(kind, fileobj, delimiter, result):
+    """Liefert Blöcke von (zeilennr, dict) mit allen erwarteten Spalten."""
+    fields, reader = _reader(fileobj, delimiter)
+    missing = [c for c in REQUIRED[kind] if c not in fields]
+    if missing:
+        raise ImportFileError(f"Fehlende Spalten für {kind}: {', '.join(missing)}")
+    wanted = [(c, fields.index(c)) for c in COLUMNS[kind] if c in fields]
+    chunk = []
+    for line_no, values in enumerate(reader, start=2):
+        if not values or not any(v.strip() for v in values):
+            continue
+        result.rows += 1
+        row = {c: (values[i].strip() if i < len(values) else "") for c, i in wanted}
+        chunk.append((line_no, row))
+        if len(chunk) >= CHUNK_ROWS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _valid(kind, chunk, result, parse):
+    out = []
+    for line_no, row in chunk:
+        empty = [c for c in REQUIRED[kind] if not row.get(c)]
+        if empty:
+            result.reject(line_no, f"leere Pflichtfelder: {', '.join(empty)}", row)
+            continue
+        try:
+            out.append((line_no, row, parse(row)))
+        except ValueError as e:
+            result.reject(line_no, str(e), row)
+    return out
+
+
+def _insert_counted(con, sql, params, result):
+    before = con.total_changes
+    con.executemany(sql, params)
+    n = con.total_changes - before
+    result.inserted += n
+    result.skipped += len(params) - n
+
+
+def _import_items(con, chunks, result):
+    for chunk in chunks:
+        rows = _valid("items", chunk, result, lambda r: (r["sku"], r["name"]))
+        now = _now()
+        _insert_counted(con, "INSERT OR IGNORE INTO items(sku,name,created_at) VALUES (?,?,?)",
+                        [(sku, name, now) for _, _, (sku, name) in rows], result)
+
+
+def _import_locations(con, chunks, result):
+    for chunk in chunks:
+        rows = _valid("locations", chunk, result, lambda r: (r["code"], r.get("description", "")))
+        now = _now()
+        _insert_counted(con, "INSERT OR IGNORE INTO locations(code,description,created_at) VALUES (?,?,?)",
+                        [(code, desc, now) for _, _, (code, desc) in rows], result)
+
+
+def _item_map(con):
+    return dict(con.execute("SELECT sku, id FROM items"))
+
+
+def _import_lots(con, chunks, result):
+    items = _item_map(con)
+    for chunk in chunks:
+        rows = _valid("lots", chunk, result, lambda r: (r["sku"], r["batch"], _parse_date(r.get("mhd"))))
+        params = []
+        now = _now()
+        for line_no, raw, (sku, batch, mhd) in rows:
+            item_id = items.get(sku)
+            if item_id is None:
+                result.reject(line_no, f"unbekannte SKU '{sku}'", raw)
+                continue
+            params.append((item_id, batch, mhd, now))
+        _insert_counted(con, "INSERT OR IGNORE INTO lots(item_id,batch,mhd,created_at) VALUES (?,?,?,?)",
+                        params, result)
+
+
+def _import_stock(con, chunks, result, datum, reference):
+    items = _item_map(con)
+    locations = dict(con.execute("SELECT code, id FROM locations"))
+    lots = {(item_id, batch, mhd): lot_id for lot_id, item_id, batch, mhd
+            in con.execute("SELECT id, item_id, batch, COALESCE(mhd,'') FROM lots")}
+
+    def parse(r):
+        return (r["sku"], r["batch"], _parse_date(r.get("mhd")), r["location"],
+                _parse_qty(r.get("paletten")), _parse_qty(r.get("koli")))
+
+    for chunk in chunks:
+        rows = _valid("stock", chunk, result, parse)
+        now = _now()
+        new_lots, lines = [], []
+        for line_no, raw, (sku, batch, mhd, loc, pal, koli) in rows:
+            item_id, location_id = items.get(sku), locations.get(loc)
+            if item_id is None:
+                result.reject(line_no, f"unbekannte SKU '{sku}'", raw)
+                continue
+            if location_id is None:
+                result.reject(line_no, f"unbekannter Lagerplatz '{loc}'", raw)
+                continue
+            if pal == 0 and koli == 0:
+                result.reject(line_no, "Paletten und Koli sind 0", raw)
+                continue
+            key = (item_id, batch, mhd or "")
+            if key not in lots:
+                lots[key] = None
+                new_lots.append((item_id, batch, mhd, now))
+            lines.append((key, location_id, pal, koli))
+
+        if new_lots:
+            con.executemany("INSERT OR IGNORE INTO lots(item_id,batch,mhd,created_at) VALUES (?,?,?,?)", new_lots)
+            for item_id, batch, mhd, _ in new_lots:
+                key = (item_id, batch, mhd or "")
+                lots[key] = con.execute(
+                    "SELECT id FROM lots WHERE item_id=? AND batch=? AND COALESCE(mhd,'')=?", key
+                ).fetchone()[0]
+
+        last_id = con.execute("SELECT COALESCE(MAX(id), 0) FROM movements").fetchone()[0]
+        con.executemany(
+            """INSERT INTO movements(typ,lot_id,location_id,paletten,koli,partner,reference,notes,datum,created_at)
+                 VALUES ('IN',?,?,?,?,?,?,'',?,?)""",
+            [(lots[key], loc, pal, koli, OPENING_PARTNER, reference, datum, now) for key, loc, pal, koli in lines]
+        )
+        # Volltextindex für den ganzen Block in einer Anweisung (Trigger ist abgeschaltet)
+        con.execute("""INSERT INTO movements_fts(rowid, partner, reference, notes)
+                       SELECT id, partner, reference, notes FROM movements WHERE id > ?""", (last_id,))
+        con.executemany(
+            """INSERT INTO inventory(lot_id,location_id,paletten,koli,updated_at) VALUES (?,?,?,?,?)
+                 ON CONFLICT(lot_id, location_id) DO UPDATE SET
+                     paletten = paletten + excluded.paletten,
+                     koli = koli + excluded.koli,
+                     updated_at = excluded.updated_at""",
+            [(lots[key], loc, pal, koli, now) for key, loc, pal, koli in lines]
+        )
+        result.inserted += len(lines)
+
+
+def import_csv(data_dir: str, kind: str, fileobj, delimiter=None, datum=None, reference="CSV-Import") -> ImportResult:
+    """Importiert eine CSV-Datei (Textmodus) des Typs items|locations|lots|stock.
+
+    Die gültigen Zeilen werden in einer Transaktion geschrieben (bei einem Abbruch
+    gar nichts), ungültige Zeilen landen in ImportResult.rejects. datum gilt für
+    den Anfangsbestand (Default: heute).
+    """
+    if kind not in COLUMNS:
+        raise ValueError(f"Unbekannter Import-Typ: {kind}")
+    # Buchungsdatum wie bei db.book_movement nur als JJJJ-MM-TT speichern
+    if isinstance(datum, datetime):
+        datum = datum.date()
+    datum = datum.isoformat() if isinstance(datum, date) else _parse_date(datum)
+    result = ImportResult(kind)
+
+    def run(con):
+        chunks = _chunks(kind, fileobj, delimiter, result)
+        cache_size = con.execute("PRAGMA cache_size").fetchone()[0]
+        con.execute(f"PRAGMA cache_size=-{int(IMPORT_CACHE_KIB)}")
+        try:
+            if kind == "items":
+                _import_items(con, chunks, result)
+            elif kind == "locations":
+                _import_locations(con, chunks, result)
+            elif kind == "lots":
+                _import_lots(con, chunks, result)
+            else:
+                con.execute("INSERT OR IGNORE INTO maintenance_flags(name) VALUES ('import')")
+                _import_stock(con, chunks, result, datum or date.today().isoformat(), reference)
+                con.execute("DELETE FROM maintenance_flags WHERE name = 'import'")
+        finally:
+            con.execute(f"PRAGMA cache_size={int(cache_size)}")
+
+    write_transaction(data_dir, run)
+    return result
+
+
+def write_rejects(result: ImportResult, fileobj):
+    """Schreibt die abgelehnten Zeilen als CSV (zeile, grund, Originalspalten)."""
+    cols = list(COLUMNS[result.kind])
+    w = csv.writer(fileobj)
+    w.writerow(["zeile", "grund"] + cols)
+    for line_no, reason, raw in result.rejects:
+        w.writerow([line_no, reason] + [raw.get(c, "") for c in cols])
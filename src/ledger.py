@@ -0,0 +1,147 @@
+"""Abgleich des Bestands (inventory) mit den Bewegungen (movements).
+
+Soll-Bestand je Charge/Lagerplatz ist Σ IN − Σ OUT. Die Summen werden in
+ledger_sums fortgeschrieben; ledger_checkpoint merkt sich die zuletzt
+verarbeitete Bewegungs-ID. Ein normaler Lauf verarbeitet daher nur neue
+Bewegungen und vergleicht nur die dabei berührten Positionen, ein voller Lauf
+rechnet alles neu und vergleicht alle Positionen. Archivierte Bewegungen
+(src/archive.py) zählen über archive_balances mit.
+"""
+from datetime import datetime
+
+import pandas as pd
+
+from src.db import read_transaction, write_transaction
+
+_SIGNED = """
+    SELECT lot_id, location_id,
+           SUM(CASE typ WHEN 'OUT' THEN -paletten ELSE paletten END) AS paletten,
+           SUM(CASE typ WHEN 'OUT' THEN -koli ELSE koli END) AS koli
+    FROM movements
+    WHERE id > ? AND id <= ?
+    GROUP BY lot_id, location_id
+"""
+
+
+class LedgerReport:
+    def __init__(self, full: bool, from_id: int, to_id: int, new_movements: int, drift: pd.DataFrame,
+                 repaired: bool):
+        self.full = full
+        self.from_id = from_id
+        self.to_id = to_id
+        self.new_movements = new_movements
+        self.drift = drift
+        self.repaired = repaired
+
+    @property
+    def ok(self) -> bool:
+        return self.drift.empty
+
+    def summary(self) -> str:
+        mode = "voll" if self.full else "inkrementell"
+        text = f"Abgleich ({mode}): {self.new_movements} neue Bewegungen"
+        text += f" (ID {self.from_id + 1}–{self.to_id}), " if self.new_movements else ", "
+        if self.ok:
+            return text + "keine Abweichungen."
+        return text + f"{len(self.drift)} Abweichung(en)" + (" – repariert." if self.repaired else ".")
+
+
+def _now():
+    return datetime.utcnow().isoformat(timespec="seconds")
+
+
+def _drift(con, touched_only: bool):
+    """Positionen, deren Ist-Bestand von den Soll-Summen abweicht – alle oder nur
+    die Schlüssel in temp.ledger_keys."""
+    restrict = "" if not touched_only else "WHERE (lot_id, location_id) IN (SELECT lot_id, location_id FROM temp.ledger_keys)"
+    return pd.read_sql_query(f"""
+        SELECT d.lot_id, d.location_id, i.sku, l.batch, loc.code AS lagerplatz,
+               d.soll_paletten, d.soll_koli, d.ist_paletten, d.ist_koli
+        FROM (
+            SELECT lot_id, location_id,
+                   SUM(sp) AS soll_paletten, SUM(sk) AS soll_koli,
+                   SUM(ip) AS ist_paletten, SUM(ik) AS ist_koli
+            FROM (
+                SELECT lot_id, location_id, paletten AS sp, koli AS sk, 0 AS ip, 0 AS ik FROM ledger_sums {restrict}
+                UNION ALL
+                SELECT lot_id, location_id, 0, 0, paletten, koli FROM inventory {restrict}
+            )
+            GROUP BY lot_id, location_id
+            HAVING SUM(sp) <> SUM(ip) OR SUM(sk) <> SUM(ik)
+        ) d
+        LEFT JOIN lots l ON l.id = d.lot_id
+        LEFT JOIN items i ON i.id = l.item_id
+        LEFT JOIN locations loc ON loc.id = d.location_id
+        ORDER BY i.sku, l.batch, loc.code
+    """, con)
+
+
+def _run(con, full: bool, repair: bool) -> LedgerReport:
+    if not con.in_transaction:
+        con.execute("BEGIN IMMEDIATE")
+    if full:
+        con.execute("DELETE FROM ledger_sums")
+        con.execute("DELETE FROM ledger_checkpoint")
+        # Archivierte Bewegungen (src/archive.py) gehen als Anfangsbestand ein
+        con.execute("INSERT INTO ledger_sums(lot_id, location_id, paletten, koli) "
+                    "SELECT lot_id, location_id, paletten, koli FROM archive_balances")
+    row = con.execute("SELECT last_movement_id FROM ledger_checkpoint WHERE id = 1").fetchone()
+    from_id = row[0] if row else 0
+    to_id = con.execute("SELECT COALESCE(MAX(id), 0) FROM movements").fetchone()[0]
+    to_id = max(to_id, from_id)
+    new_movements = con.execute("SELECT COUNT(*) FROM movements WHERE id > ? AND id <= ?",
+                                (from_id, to_id)).fetchone()[0]
+
+    con.execute("CREATE TEMP TABLE IF NOT EXISTS ledger_keys (lot_id INTEGER, location_id INTEGER, "
+                "PRIMARY KEY (lot_id, location_id)) WITHOUT ROWID")
+    con.execute("DELETE FROM temp.ledger_keys")
+    con.execute(f"""
+        INSERT INTO ledger_sums(lot_id, location_id, paletten, koli)
+        SELECT lot_id, location_id, paletten, koli FROM ({_SIGNED}) WHERE true
+        ON CONFLICT(lot_id, location_id) DO UPDATE SET
+            paletten = paletten + excluded.paletten,
+            koli = koli + excluded.koli
+    """, (from_id, to_id))
+    con.execute(f"INSERT OR IGNORE INTO temp.ledger_keys SELECT lot_id, location_id FROM ({_SIGNED})",
+                (from_id, to_id))
+
+    drift = _drift(con, touched_only=not full)
+    con.execute(
+        "INSERT INTO ledger_checkpoint(id, last_movement_id, checked_at) VALUES (1, ?, ?) "
+        "ON CONFLICT(id) DO UPDATE SET last_movement_id = excluded.last_movement_id, checked_at = excluded.checked_at",
+        (to_id, _now())
+    )
+
+    if repair and not drift.empty:
+        now = _now()
+        con.executemany(
+            """INSERT INTO inventory(lot_id, location_id, paletten, koli, updated_at) VALUES (?,?,?,?,?)
+                 ON CONFLICT(lot_id, location_id) DO UPDATE SET
+                     paletten = excluded.paletten, koli = excluded.koli, updated_at = excluded.updated_at""",
+            [(int(r.lot_id), int(r.location_id), int(r.soll_paletten), int(r.soll_koli), now)
+             for r in drift.itertuples()]
+        )
+    return LedgerReport(full, from_id, to_id, new_movements, drift, repair and not drift.empty)
+
+
+def check_ledger(data_dir: str, full: bool = False, repair: bool = False) -> LedgerReport:
+    """Gleicht Bestand und Bewegungen ab.
+
+    Inkrementell (Default) werden nur Bewegungen nach dem letzten Prüfpunkt
+    verarbeitet und die davon berührten Positionen verglichen; full=True rechnet
+    alle Summen neu und vergleicht jede Position. repair=True setzt abweichende
+    Bestände auf die Soll-Summen.
+    """
+    return write_transaction(data_dir, _run, full, repair)
+
+
+def check_in_transaction(con) -> LedgerReport:
+    """Inkrementeller Abgleich ohne Reparatur in der offenen Transaktion von con
+    (z.B. vor der Archivierung, damit ledger_sums alle Bewegungen enthält)."""
+    return _run(con, False, False)
+
+
+def get_checkpoint(data_dir: str):
+    """(last_movement_id, checked_at) des letzten Abgleichs oder None."""
+    return read_transaction(data_dir, lambda con: con.execute(
+        "SELECT last_movement_id, checked_at FROM ledger_checkpoint WHERE id = 1").fetchone())
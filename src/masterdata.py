@@ -0,0 +1,57 @@
+import pandas as pd
+
+
+class MasterIndex:
+    """id→Label-Verzeichnisse für Artikel, Chargen und Lagerplätze.
+
+    Wird einmal je Daten-Generation aufgebaut (siehe db.get_master_index) und
+    von allen Auswahlfeldern geteilt; Lookups sind reine dict-Zugriffe.
+    """
+
+    def __init__(self, items: pd.DataFrame, lots: pd.DataFrame, locations: pd.DataFrame):
+        self.labels = {
+            "item": {
+                int(i): f"{sku} – {name}"
+                for i, sku, name in zip(items["id"], items["sku"], items["name"])
+            },
+            "lot": {
+                int(i): f"{sku} | Charge {batch} | MHD {mhd}"
+                for i, sku, batch, mhd in zip(lots["id"], lots["sku"], lots["batch"], lots["mhd"])
+            },
+            "location": {
+                int(i): str(code)
+                for i, code in zip(locations["id"], locations["code"])
+            },
+        }
+        self._haystack = {
+            kind: [(i, label.lower()) for i, label in labels.items()]
+            for kind, labels in self.labels.items()
+        }
+
+    def item_label(self, item_id) -> str:
+        return self.labels["item"].get(int(item_id), str(item_id))
+
+    def lot_label(self, lot_id) -> str:
+        return self.labels["lot"].get(int(lot_id), str(lot_id))
+
+    def location_label(self, location_id) -> str:
+        return self.labels["location"].get(int(location_id), str(location_id))
+
+    def ids(self, kind: str) -> list:
+        return list(self.labels[kind])
+
+    def search(self, kind: str, term: str, limit: int = 100) -> list:
+        """IDs, deren Label alle Wörter aus term enthält (ohne Groß/Klein), max. limit."""
+        words = (term or "").lower().split()
+        if not words:
+            return self.ids(kind)[:limit]
+        found = []
+        for i, label in self._haystack[kind]:
+            if all(w in label for w in words):
+                found.append(i)
+                if len(found) >= limit:
+                    break
+        return found
+
+    def __len__(self):
+        return sum(len(v) for v in self.labels.values())
@@ -1,22 +1,199 @@
 import os
+import mmap
 import time
+import shutil
+import zipfile
+import hashlib
+import tempfile
 import mimetypes
+from contextlib import contextmanager
+
+from src.db import get_blobs, drop_blob, get_document_info
+
+CHUNK_SIZE = 1024 * 1024
+# Ab dieser Größe wird ein Dokument per mmap statt per read() bereitgestellt
+MMAP_THRESHOLD = 16 * 1024 * 1024
+# ZIP-Archive bleiben bis zu dieser Größe im Speicher, darüber in einer Temp-Datei
+ZIP_SPOOL_BYTES = 8 * 1024 * 1024
+# Blobs ohne Referenz werden erst nach dieser Zeit gelöscht (laufende Uploads schützen)
+GC_GRACE_SECONDS = 3600
+
+def _uploads_dir(data_dir: str) -> str:
+    return os.path.join(data_dir, "uploads")
+
+def blob_path(data_dir: str, sha256: str) -> str:
+    """Ablageort eines Blobs: uploads/ab/cd/<sha256>"""
+    return os.path.join(_uploads_dir(data_dir), sha256[:2], sha256[2:4], sha256)
+
+def _fsync_dir(path: str):
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 def save_upload(data_dir: str, uploaded_file):
-    """Speichert Upload unter data/uploads und gibt (stored_path, mime, size) zurück."""
-    uploads_dir = os.path.join(data_dir, "uploads")
-    os.makedirs(uploads_dir, exist_ok=True)
+    """Speichert Upload inhaltsadressiert unter data/uploads und gibt
+    (stored_path, mime, size, sha256) zurück.
+
+    Der Inhalt wird blockweise in eine Temp-Datei geschrieben und dabei gehasht;
+    gleiche Inhalte werden nur einmal abgelegt.
+    """
+    tmp_dir = os.path.join(_uploads_dir(data_dir), "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    if hasattr(uploaded_file, "seek"):
+        uploaded_file.seek(0)
+    h = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, prefix="upload-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = uploaded_file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                h.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+
+        sha = h.hexdigest()
+        stored_path = blob_path(data_dir, sha)
+        if os.path.exists(stored_path):
+            os.remove(tmp_path)
+            os.utime(stored_path)  # frisch halten, siehe gc_uploads()
+        else:
+            os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+            os.replace(tmp_path, stored_path)
+            _fsync_dir(os.path.dirname(stored_path))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
-    # eindeutiger Dateiname
-    ts = int(time.time() * 1000)
     safe_name = uploaded_file.name.replace("/", "_").replace("\\", "_")
-    stored_name = f"{ts}__{safe_name}"
-    stored_path = os.path.join(uploads_dir, stored_name)
+    mime = getattr(uploaded_file, "type", None) or mimetypes.guess_type(safe_name)[0] or "application/octet-stream"
+    return stored_path, mime, size, sha
+
+def _older_than(path: str, cutoff: float) -> bool:
+    try:
+        return os.path.getmtime(path) < cutoff
+    except FileNotFoundError:
+        return True
+
+def gc_uploads(data_dir: str, grace_seconds: int = GC_GRACE_SECONDS) -> int:
+    """Löscht Blobs ohne Dokument-Referenz sowie liegengebliebene Temp-/Blob-Dateien,
+    die älter als grace_seconds sind. Gibt die Anzahl gelöschter Dateien zurück."""
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    tracked = set()
+    for sha, path in get_blobs(data_dir, unreferenced_only=True):
+        tracked.add(sha)
+        if not _older_than(path, cutoff):
+            continue
+        if drop_blob(data_dir, sha) and _older_than(path, cutoff) and os.path.exists(path):
+            os.remove(path)
+            removed += 1
+
+    # Dateien ohne blobs-Zeile (z.B. Buchung nach dem Upload fehlgeschlagen)
+    known = None
+    root = _uploads_dir(data_dir)
+    for shard in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        shard_dir = os.path.join(root, shard)
+        if len(shard) != 2 or not os.path.isdir(shard_dir):
+            continue
+        for dirpath, _dirs, files in os.walk(shard_dir):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                if name in tracked or not _older_than(path, cutoff):
+                    continue
+                if known is None:
+                    known = {sha for sha, _ in get_blobs(data_dir)}
+                if name not in known:
+                    os.remove(path)
+                    removed += 1
+
+    tmp_dir = os.path.join(root, "tmp")
+    if os.path.isdir(tmp_dir):
+        for name in os.listdir(tmp_dir):
+            path = os.path.join(tmp_dir, name)
+            if _older_than(path, cutoff):
+                os.remove(path)
+                removed += 1
+    return removed
+
+class LazyDocument:
+    """Dokument, dessen Inhalt erst beim Zugriff gelesen wird."""
+
+    def __init__(self, document_id: int, filename: str, path: str, mime: str, size: int):
+        self.id = document_id
+        self.filename = filename
+        self.path = path
+        self.mime = mime or "application/octet-stream"
+        self.size = size
+
+    def chunks(self, chunk_size: int = CHUNK_SIZE):
+        """Liest die Datei blockweise (Generator)."""
+        with open(self.path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    @contextmanager
+    def mapped(self):
+        """Liefert den Inhalt als memoryview; große Dateien per mmap ohne Kopie."""
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < MMAP_THRESHOLD or size == 0:
+                yield memoryview(f.read())
+                return
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mm)
+            try:
+                yield view
+            finally:
+                view.release()
+                mm.close()
+
+    def read(self) -> bytes:
+        with self.mapped() as view:
+            return bytes(view)
+
+def open_document(data_dir: str, document_id: int):
+    """LazyDocument zu einer Dokument-ID (oder None); liest noch keine Bytes."""
+    info = get_document_info(data_dir, document_id)
+    if info is None:
+        return None
+    return LazyDocument(document_id, info["filename"], info["stored_path"], info["mime"], info["size_bytes"])
+
+def _unique_name(name: str, seen: set) -> str:
+    base, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in seen:
+        n += 1
+        candidate = f"{base} ({n}){ext}"
+    seen.add(candidate)
+    return candidate
 
-    content = uploaded_file.getbuffer()
-    with open(stored_path, "wb") as f:
-        f.write(content)
+def write_zip(documents, fileobj):
+    """Schreibt die Dokumente blockweise als ZIP nach fileobj (kein Komplett-Laden)."""
+    seen = set()
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for doc in documents:
+            arcname = _unique_name(doc.filename.replace("/", "_").replace("\\", "_"), seen)
+            with zf.open(arcname, "w", force_zip64=True) as dst, open(doc.path, "rb") as src:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
 
-    mime = uploaded_file.type or mimetypes.guess_type(safe_name)[0] or "application/octet-stream"
-    size = len(content)
-    return stored_path, mime, size
+def build_zip(documents):
+    """ZIP der Dokumente in einer SpooledTemporaryFile (ab ZIP_SPOOL_BYTES auf Platte),
+    Position am Anfang. Aufrufer schließt die Datei."""
+    spool = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_BYTES)
+    write_zip(documents, spool)
+    spool.seek(0)
+    return spool
@@ -0,0 +1,230 @@
+"""Optionale Laufzeitmessung der Datenbankzugriffe.
+
+Aktiv per ENV LAGER_TRACE=1 oder configure(enabled=True). Dann wird je Aufruf
+einer öffentlichen db-Funktion erfasst: Anzahl, zurückgegebene Zeilen,
+Gesamtzeit, Zeit in SQL-Anweisungen, Zeit für das Holen/Öffnen der Verbindung
+und (grob) die ausgeführten VM-Schritte. Zugeordnet wird zum aktuellen
+Streamlit-Durchlauf (start_rerun) und Abschnitt (section, z.B. ein Tab).
+
+Anweisungen über SLOW_QUERY_MS landen im Slow-Query-Log (Default:
+<data_dir>/slow_queries.log). Die Dauer einer Anweisung reicht vom Start bis
+zur nächsten Anweisung bzw. zum Ende des Aufrufs, enthält also das Abholen der
+Zeilen.
+
+Ausgeschaltet kostet ein Aufruf nur eine zusätzliche Funktionsebene und eine
+Abfrage von ENABLED; Verbindungen bekommen keine Callbacks.
+"""
+import os
+import time
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+ENABLED = os.environ.get("LAGER_TRACE", "") not in ("", "0")
+SLOW_QUERY_MS = float(os.environ.get("LAGER_SLOW_QUERY_MS", "200"))
+SLOW_LOG = os.environ.get("LAGER_SLOW_LOG")  # None: <data_dir>/slow_queries.log
+# Progress-Handler alle so viele VM-Instruktionen (Zählung der VM-Schritte)
+PROGRESS_STEPS = 1000
+MAX_SLOW_PER_RERUN = 50
+
+
+class _Call:
+    __slots__ = ("name", "data_dir", "section", "sql", "sql_start", "sql_ms", "statements", "vm_steps",
+                 "connect_ms")
+
+    def __init__(self, name, data_dir, section):
+        self.name = name
+        self.data_dir = data_dir
+        self.section = section
+        self.sql = None
+        self.sql_start = 0.0
+        self.sql_ms = 0.0
+        self.statements = 0
+        self.vm_steps = 0
+        self.connect_ms = 0.0
+
+
+class Recorder:
+    """Messwerte eines Durchlaufs, gruppiert nach (Abschnitt, Funktion)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stats = {}
+        self.slow = []  # (ms, abschnitt, funktion, sql)
+
+    def add(self, call: _Call, total_ms: float, connect_ms: float, rows):
+        s = self.stats.get((call.section, call.name))
+        if s is None:
+            s = self.stats[(call.section, call.name)] = [0, 0, 0.0, 0.0, 0.0, 0, 0]
+        s[0] += 1
+        s[1] += rows or 0
+        s[2] += total_ms
+        s[3] += call.sql_ms
+        s[4] += connect_ms
+        s[5] += call.statements
+        s[6] += call.vm_steps * PROGRESS_STEPS
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def frame(self) -> pd.DataFrame:
+        rows = [(section or "–", name, *s) for (section, name), s in self.stats.items()]
+        df = pd.DataFrame(rows, columns=["abschnitt", "funktion", "aufrufe", "zeilen", "ms", "sql_ms",
+                                         "verbindung_ms", "anweisungen", "vm_schritte"])
+        for col in ("ms", "sql_ms", "verbindung_ms"):
+            df[col] = df[col].round(1)
+        return df.sort_values("ms", ascending=False, ignore_index=True)
+
+    def by_section(self) -> pd.DataFrame:
+        df = self.frame()
+        return (df.groupby("abschnitt", sort=False)[["aufrufe", "zeilen", "ms", "sql_ms", "verbindung_ms"]]
+                .sum().sort_values("ms", ascending=False).reset_index())
+
+
+_recorder = contextvars.ContextVar("lager_trace_recorder", default=None)
+_section = contextvars.ContextVar("lager_trace_section", default="")
+_call = contextvars.ContextVar("lager_trace_call", default=None)
+_hooked = set()
+_hooked_lock = threading.Lock()
+_log_lock = threading.Lock()
+
+
+def configure(enabled: bool = None, slow_query_ms: float = None, slow_log: str = None):
+    global ENABLED, SLOW_QUERY_MS, SLOW_LOG
+    if enabled is not None:
+        ENABLED = bool(enabled)
+    if slow_query_ms is not None:
+        SLOW_QUERY_MS = float(slow_query_ms)
+    if slow_log is not None:
+        SLOW_LOG = slow_log or None
+
+
+def start_rerun() -> Recorder:
+    """Neuer Recorder für den laufenden Durchlauf (Thread/Kontext)."""
+    rec = Recorder()
+    _recorder.set(rec)
+    _section.set("")
+    return rec
+
+
+def current() -> Recorder:
+    return _recorder.get()
+
+
+@contextmanager
+def section(name: str):
+    token = _section.set(name)
+    try:
+        yield
+    finally:
+        _section.reset(token)
+
+
+def slow_log_path(data_dir: str) -> str:
+    return SLOW_LOG or os.path.join(data_dir, "slow_queries.log")
+
+
+def _finish_statement(call: _Call, now: float):
+    if call.sql is None:
+        return
+    ms = (now - call.sql_start) * 1000
+    call.sql_ms += ms
+    if ms >= SLOW_QUERY_MS:
+        sql = " ".join(call.sql.split())
+        rec = _recorder.get()
+        if rec is not None and len(rec.slow) < MAX_SLOW_PER_RERUN:
+            rec.slow.append((round(ms, 1), call.section or "–", call.name, sql))
+        line = f"{datetime.now().isoformat(timespec='milliseconds')}\t{ms:.1f} ms\t{call.section or '-'}\t{call.name}\t{sql}\n"
+        try:
+            with _log_lock, open(slow_log_path(call.data_dir), "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError:
+            pass
+    call.sql = None
+
+
+def _on_statement(sql: str):
+    call = _call.get()
+    if call is None:
+        return
+    now = time.perf_counter()
+    _finish_statement(call, now)
+    call.sql = sql
+    call.sql_start = now
+    call.statements += 1
+
+
+def _on_progress():
+    call = _call.get()
+    if call is not None:
+        call.vm_steps += 1
+    return 0
+
+
+def hook(con):
+    """Callbacks an einer Verbindung an- bzw. abmelden, passend zu ENABLED."""
+    if ENABLED:
+        if con not in _hooked:
+            con.set_trace_callback(_on_statement)
+            con.set_progress_handler(_on_progress, PROGRESS_STEPS)
+            with _hooked_lock:
+                _hooked.add(con)
+    elif con in _hooked:
+        con.set_trace_callback(None)
+        con.set_progress_handler(None, PROGRESS_STEPS)
+        forget(con)
+
+
+def forget(con):
+    with _hooked_lock:
+        _hooked.discard(con)
+
+
+def has_hooks() -> bool:
+    return bool(_hooked)
+
+
+def acquire(pool):
+    """pool.acquire() mit Zeitmessung und passenden Callbacks."""
+    t0 = time.perf_counter()
+    con = pool.acquire()
+    hook(con)
+    call = _call.get()
+    if call is not None:
+        call.connect_ms += (time.perf_counter() - t0) * 1000
+    return con
+
+
+def _rows(result):
+    if isinstance(result, (str, bytes, dict)):
+        return None
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+def traced(fn):
+    """Wrapper für öffentliche db-Funktionen; verschachtelte Aufrufe zählen zum äußeren."""
+    @functools.wraps(fn)
+    def wrapper(data_dir, *args, **kwargs):
+        if not ENABLED or _call.get() is not None:
+            return fn(data_dir, *args, **kwargs)
+        call = _Call(fn.__name__, data_dir, _section.get())
+        token = _call.set(call)
+        t0 = time.perf_counter()
+        try:
+            result = fn(data_dir, *args, **kwargs)
+        finally:
+            now = time.perf_counter()
+            _finish_statement(call, now)
+            _call.reset(token)
+        rec = _recorder.get()
+        if rec is not None:
+            rec.add(call, (now - t0) * 1000, call.connect_ms, _rows(result))
+        return result
+    return wrapper
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import db  # noqa: E402
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """Leere, migrierte Datenbank in einem eigenen Verzeichnis."""
+    db.init_db(str(tmp_path))
+    yield str(tmp_path)
+    db.close_all_connections()
+    db.clear_cache()
+
+
+def add_master_data(data_dir: str, items: int = 3, locations: int = 3, lots_per_item: int = 2):
+    """Artikel SKU000…, Lagerplätze A-00… und je Artikel Chargen CH…; gibt (lot_ids, location_ids) zurück."""
+    for i in range(items):
+        db.add_item(data_dir, f"SKU{i:03d}", f"Artikel {i}")
+    for i in range(locations):
+        db.add_location(data_dir, f"A-{i:02d}", "")
+    for n in range(items * lots_per_item):
+        db.add_lot(data_dir, n % items + 1, f"CH{n:04d}", f"2026-{n % 12 + 1:02d}-15")
+    return list(range(1, items * lots_per_item + 1)), list(range(1, locations + 1))
@@ -0,0 +1,113 @@
+"""Archivierung über mehr Jahre, als SQLite auf einmal anhängen kann."""
+import sqlite3
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from src import db, archive
+from conftest import add_master_data
+
+YEARS = range(2008, 2022)  # 14 Jahresarchive > SQLITE_LIMIT_ATTACHED (10)
+
+
+@pytest.fixture
+def archived(data_dir):
+    lots, locations = add_master_data(data_dir, items=2, locations=2, lots_per_item=2)
+    docs = {}
+    for n, year in enumerate(YEARS):
+        lot, loc = lots[n % len(lots)], locations[n % len(locations)]
+        first = db.book_movement(data_dir, "IN", lot, loc, 1, 10, "Lieferant", f"WE{year}", "", date(year, 3, 1))
+        db.book_movement(data_dir, "OUT", lot, loc, 0, 4, "Kunde", f"LS{year}", "", date(year, 9, 1))
+        db.add_document(data_dir, first, f"lieferschein_{year}.pdf", f"/tmp/{year}.pdf", "application/pdf", 1)
+        docs[year] = first
+    db.book_movement(data_dir, "IN", 1, 1, 0, 3, "Lieferant", "aktuell", "", "2026-02-01")
+    before = {
+        "movements": db.get_movements(data_dir).sort_values("id", ignore_index=True),
+        "as_of": {day: db.get_inventory_as_of(data_dir, day) for day in ("2009-12-31", "2016-06-30", "2021-12-31")},
+    }
+    report = archive.archive_movements(data_dir, before="2022-01-15")
+    assert report.movements == 2 * len(YEARS)
+    assert archive.verify_archive(data_dir) == []
+    return data_dir, docs, before
+
+
+@pytest.fixture
+def attached(monkeypatch):
+    """Zeichnet die je Verbindung angehängten Jahre auf."""
+    calls, attach = [], db._attach_archives
+
+    def recording(data_dir, years, with_main=True):
+        calls.append(list(years))
+        return attach(data_dir, years, with_main)
+    monkeypatch.setattr(db, "_attach_archives", recording)
+    return calls
+
+
+def test_queries_span_all_archived_years(archived, attached):
+    data_dir, _, before = archived
+    moves = db.query_movements(data_dir, include_archive=True, limit=1000)
+    assert sorted(moves["id"]) == sorted(before["movements"]["id"])
+    assert all(len(years) <= 10 for years in attached) and len(attached) == 2
+    # Seiten über die Gruppengrenze hinweg: neueste zuerst, ohne Lücken
+    page = db.query_movements(data_dir, include_archive=True, limit=5)
+    assert list(page["id"]) == sorted(before["movements"]["id"], reverse=True)[:5]
+    older = db.query_movements(data_dir, include_archive=True, limit=1000, after_id=int(page["id"].iloc[-1]))
+    assert len(page) + len(older) == len(before["movements"])
+
+    chunks = list(db.iter_movements(data_dir, include_archive=True, chunk_rows=7))
+    rows = [row for chunk in chunks[1:] for row in chunk]
+    exported = pd.DataFrame(rows, columns=chunks[0]).sort_values("id", ignore_index=True)
+    assert list(exported["id"]) == list(before["movements"]["id"])
+    # älteste Jahre zuerst, aktuelle Bewegungen zuletzt
+    assert exported["datum"].is_monotonic_increasing
+
+
+def test_inventory_as_of_without_snapshots(archived, attached):
+    data_dir, _, before = archived
+    db.write_transaction(data_dir, lambda con: con.execute("DELETE FROM snapshot_dates"))
+    for day, expected in before["as_of"].items():
+        pd.testing.assert_frame_equal(db.get_inventory_as_of(data_dir, day), expected, check_dtype=False)
+    assert max(len(years) for years in attached) == 10
+
+
+def test_documents_attach_only_their_year(archived, attached):
+    data_dir, docs, _ = archived
+    for year in (2008, 2013, 2021):
+        found = db.get_documents_for_movement(data_dir, docs[year])
+        assert list(found["filename"]) == [f"lieferschein_{year}.pdf"]
+        info = db.get_document_info(data_dir, int(found["id"].iloc[0]))
+        assert info["movement_id"] == docs[year]
+        assert attached[-2:] == [[year], [year]]
+    attached.clear()
+    # aktuelle Bewegung ohne Dokumente und unbekannte ids: kein Archiv anhängen
+    current = int(db.get_movements(data_dir)["id"].max())
+    assert db.get_documents_for_movement(data_dir, current).empty
+    assert db.get_document_info(data_dir, 10_000) is None
+    assert attached == []
+
+
+def test_migration_backfills_id_ranges(archived):
+    data_dir, docs, _ = archived
+    ranges = "SELECT year, movement_id_min, movement_id_max, document_id_min, document_id_max FROM archive_log"
+
+    def legacy(con):
+        expected = con.execute(ranges).fetchall()
+        con.execute("UPDATE archive_log SET movement_id_min = NULL, movement_id_max = NULL, "
+                    "document_id_min = NULL, document_id_max = NULL")
+        con.execute("PRAGMA user_version=13")
+        return expected
+    expected = db.write_transaction(data_dir, legacy)
+    db.close_all_connections()
+    db.init_db(data_dir)
+    assert db.read_transaction(data_dir, lambda con: con.execute(ranges).fetchall()) == expected
+    assert not db.get_documents_for_movement(data_dir, docs[2010]).empty
+
+
+def test_attach_refuses_more_than_the_limit(archived):
+    data_dir, _, _ = archived
+    with pytest.raises(ValueError, match="Zu viele"):
+        with db._attach_archives(data_dir, list(YEARS)):
+            pass
+    con = sqlite3.connect(":memory:")
+    assert db._attach_limit(con) == con.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
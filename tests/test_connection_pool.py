@@ -0,0 +1,53 @@
+"""Verbindungspool: Schließen, während andere Threads Verbindungen ausgeliehen haben."""
+import sqlite3
+import threading
+
+import pytest
+
+from src import db
+
+
+def test_close_keeps_borrowed_connections_usable(data_dir):
+    borrowed, proceed = threading.Event(), threading.Event()
+    seen = {}
+
+    def reader(con):
+        seen["con"] = con
+        borrowed.set()
+        proceed.wait(5)
+        # Pool wurde inzwischen geschlossen: die Verbindung muss noch gehen
+        seen["items"] = con.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        con.execute("BEGIN")
+
+    errors = []
+    thread = threading.Thread(target=lambda: _catch(errors, db.read_transaction, data_dir, reader))
+    thread.start()
+    assert borrowed.wait(5)
+    db.close_all_connections()
+    proceed.set()
+    thread.join(5)
+    assert errors == []
+    assert seen["items"] == 0
+    # release() auf den geschlossenen Pool verwirft die Verbindung statt sie zurückzulegen
+    with pytest.raises(sqlite3.ProgrammingError):
+        seen["con"].execute("SELECT 1")
+
+
+def test_close_closes_idle_connections(data_dir):
+    db.get_items(data_dir)
+    pool = db._pool(data_dir)
+    con = pool.acquire()
+    pool.release(con)
+    db.close_all_connections()
+    with pytest.raises(sqlite3.ProgrammingError):
+        con.execute("SELECT 1")
+    # neuer Pool nach dem Schließen
+    assert db._pool(data_dir) is not pool
+    db.get_items(data_dir)
+
+
+def _catch(errors, fn, *args):
+    try:
+        fn(*args)
+    except Exception as e:
+        errors.append(e)
@@ -0,0 +1,68 @@
+"""Buchungsdatum: Prüfung in der API, Speicherung nur als JJJJ-MM-TT."""
+import asyncio
+import io
+from datetime import datetime
+
+import pytest
+
+from src import db, importer
+from src.api import Service
+from conftest import add_master_data
+
+
+@pytest.fixture
+def service(data_dir):
+    add_master_data(data_dir, items=1, locations=1, lots_per_item=1)
+    service = Service(data_dir, token="")
+    yield service
+    service.close()
+
+
+def _call(service, method, path, body=None):
+    return asyncio.run(service.dispatch(method, path, body))
+
+
+def _stored_dates(data_dir) -> list:
+    return [r[0] for r in db.read_transaction(data_dir, lambda con: con.execute(
+        "SELECT datum FROM movements ORDER BY id").fetchall())]
+
+
+@pytest.mark.parametrize("datum", ["morgen", "31.03.2026", "2026-02-30", "2026-03-31T10:00:00", 20260331])
+def test_api_rejects_invalid_datum(service, datum):
+    line = {"lot_id": 1, "location_id": 1, "koli": 5}
+    assert _call(service, "POST", "/movements", {"typ": "IN", "lines": [line], "datum": datum})[0] == 400
+    assert _call(service, "POST", "/movements/fefo", {"order": [{"item_id": 1, "koli": 1}], "datum": datum})[0] == 400
+    assert _stored_dates(service.data_dir) == []
+
+
+def test_api_rejects_invalid_datum_on_reservation_commit(service):
+    status, payload = _call(service, "POST", "/movements", {
+        "typ": "IN", "lines": [{"lot_id": 1, "location_id": 1, "koli": 5}], "datum": "2026-03-31"})
+    assert status == 201
+    status, payload = _call(service, "POST", "/reservations", {"lot_id": 1, "location_id": 1, "koli": 2})
+    assert status == 201
+    path = f"/reservations/{payload['id']}/commit"
+    assert _call(service, "POST", path, {"datum": "gestern"})[0] == 400
+    assert _call(service, "POST", path, {"datum": "2026-04-01"})[0] == 201
+    assert _stored_dates(service.data_dir) == ["2026-03-31", "2026-04-01"]
+    assert _call(service, "GET", "/inventory/as-of?date=31.03.2026")[0] == 400
+
+
+def test_db_stores_date_only(data_dir):
+    add_master_data(data_dir, items=1, locations=1, lots_per_item=1)
+    db.book_movement(data_dir, "IN", 1, 1, 0, 5, "", "", "", "2026-03-31T10:00:00")
+    db.book_movement(data_dir, "IN", 1, 1, 0, 3, "", "", "", datetime(2026, 3, 31, 23, 59))
+    db.book_movement(data_dir, "IN", 1, 1, 0, 1, "", "", "", "2026-04-01")
+    assert _stored_dates(data_dir) == ["2026-03-31", "2026-03-31", "2026-04-01"]
+    # alle Auswertungen arbeiten mit demselben Tagesschlüssel
+    assert db.get_inventory_as_of(data_dir, "2026-03-31")["koli"].sum() == 8
+    assert len(db.query_movements(data_dir, date_from="2026-03-31", date_to="2026-03-31")) == 2
+    with pytest.raises(db.BookingError):
+        db.book_movement(data_dir, "IN", 1, 1, 0, 1, "", "", "", "morgen")
+
+
+def test_import_stores_date_only(data_dir):
+    add_master_data(data_dir, items=1, locations=1, lots_per_item=1)
+    csv = io.StringIO("sku;batch;location;paletten;koli\nSKU000;CH0000;A-00;1;10\n")
+    importer.import_csv(data_dir, "stock", csv, datum="31.03.2026")
+    assert _stored_dates(data_dir) == ["2026-03-31"]
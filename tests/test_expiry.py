@@ -0,0 +1,45 @@
+"""MHD-Warnliste: Zusammenfassung je Stufe passend zur Liste (auch mit --days)."""
+from datetime import date, timedelta
+
+import pytest
+
+from src import db, cli
+
+AS_OF = date(2026, 3, 1)
+# Resttage der Chargen: je eine Charge pro Stufe, zwei jenseits von 60 Tagen
+REMAINING = [-5, 10, 20, 45, 75, 120]
+
+
+@pytest.fixture
+def stocked(data_dir):
+    db.add_item(data_dir, "SKU000", "Artikel")
+    db.add_location(data_dir, "A-00", "")
+    for n, days in enumerate(REMAINING, start=1):
+        db.add_lot(data_dir, 1, f"CH{n}", AS_OF + timedelta(days=days))
+        db.book_movement(data_dir, "IN", n, 1, 1, 10, "", "", "", AS_OF)
+    return data_dir
+
+
+def _counts(summary) -> dict:
+    return dict(zip(summary["stufe"], summary["positionen"]))
+
+
+def test_summary_follows_days(stocked):
+    assert _counts(db.get_expiry_summary(stocked, AS_OF)) == {
+        "abgelaufen": 1, "≤ 14 Tage": 1, "≤ 30 Tage": 1, "≤ 60 Tage": 1}
+    assert _counts(db.get_expiry_summary(stocked, AS_OF, 30)) == {
+        "abgelaufen": 1, "≤ 14 Tage": 1, "≤ 30 Tage": 1, "≤ 60 Tage": 0}
+    summary = db.get_expiry_summary(stocked, AS_OF, 90)
+    assert _counts(summary) == {"abgelaufen": 1, "≤ 14 Tage": 1, "≤ 30 Tage": 1, "≤ 60 Tage": 1,
+                                db.EXPIRY_OVERFLOW_LABEL: 1}
+    assert summary["positionen"].sum() == len(db.get_expiry_watchlist(stocked, AS_OF, 90))
+
+
+def test_report_summary_matches_csv(stocked, tmp_path, capsys):
+    out = tmp_path / "reports"
+    assert cli.main(["--data-dir", stocked, "expiry-report", "--as-of", AS_OF.isoformat(), "--days", "150",
+                     "--out-dir", str(out)]) == 0
+    printed = capsys.readouterr().out
+    rows = (out / f"mhd_warnliste_{AS_OF.isoformat()}.csv").read_text(encoding="utf-8").splitlines()
+    assert len(rows) - 1 == len(REMAINING)
+    assert f"{db.EXPIRY_OVERFLOW_LABEL}:      2 Positionen" in printed
@@ -0,0 +1,54 @@
+"""CSV-Massenimport: Ablehnungen, Bestand und Volltextindex des Anfangsbestands."""
+import io
+
+import pytest
+
+from src import db, importer
+from conftest import add_master_data
+
+STOCK = """sku;batch;mhd;location;paletten;koli
+SKU000;CH0000;2026-01-15;A-00;1;10
+SKU000;NEU-1;15.03.2027;A-01;0;5
+SKU001;CH0001;2026-02-15;A-00;2;0
+UNBEKANNT;X;;A-00;1;1
+SKU001;CH0001;2026-02-15;Z-99;1;1
+SKU002;CH0002;2026-03-15;A-02;0;0
+SKU002;CH0002;2026-03-15;A-02;0;7
+"""
+
+
+@pytest.fixture
+def imported(data_dir, monkeypatch):
+    add_master_data(data_dir, items=3, locations=3, lots_per_item=1)
+    # mehrere Blöcke, damit der blockweise Volltextindex jeden Block erfasst
+    monkeypatch.setattr(importer, "CHUNK_ROWS", 2)
+    result = importer.import_csv(data_dir, "stock", io.StringIO(STOCK), reference="Übernahme Altbestand")
+    return data_dir, result
+
+
+def _fts_ids(data_dir, text) -> set:
+    return set(db.search_movements(data_dir, text)["id"])
+
+
+def test_stock_import_counts_and_rejects(imported):
+    data_dir, result = imported
+    assert (result.rows, result.inserted, result.rejected) == (7, 4, 3)
+    assert sorted(r[0] for r in result.rejects) == [5, 6, 7]
+    inv = db.get_inventory(data_dir)
+    assert inv["koli"].sum() == 22 and inv["paletten"].sum() == 3
+    assert set(db.get_lots(data_dir)["batch"]) >= {"NEU-1"}
+
+
+def test_stock_import_fills_fulltext_index(imported):
+    data_dir, _ = imported
+    moves = db.get_movements(data_dir)
+    assert _fts_ids(data_dir, "Altbestand") == set(moves["id"])
+    assert _fts_ids(data_dir, importer.OPENING_PARTNER) == set(moves["id"])
+    # danach indexiert wieder der Trigger
+    mid = db.book_movement(data_dir, "IN", 1, 1, 0, 1, "Spedition Nord", "", "", "2026-04-01")
+    assert _fts_ids(data_dir, "Spedition") == {mid}
+    flags = db.read_transaction(data_dir, lambda con: con.execute("SELECT name FROM maintenance_flags").fetchall())
+    assert flags == []
+    # Index stimmt mit movements überein (keine doppelten oder fehlenden Einträge), sonst Fehler
+    db.write_transaction(data_dir, lambda con: con.execute(
+        "INSERT INTO movements_fts(movements_fts, rank) VALUES ('integrity-check', 1)"))
@@ -0,0 +1,142 @@
+"""Stichtagsbestand aus Monatsend-Snapshots gegen ein Nachspielen aller Bewegungen."""
+import random
+import sqlite3
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+from src import db
+from conftest import add_master_data
+
+COLUMNS = ["lot_id", "location_id", "paletten", "koli"]
+FIRST_DAY = date(2025, 1, 10)
+DAYS = 120
+
+
+def _replay(data_dir, as_of: str) -> pd.DataFrame:
+    """Bestand am Ende von as_of aus allen Bewegungen bis dahin."""
+    moves = db.read_transaction(data_dir, lambda con: pd.read_sql_query(
+        "SELECT lot_id, location_id, typ, paletten, koli, substr(datum,1,10) AS tag FROM movements", con))
+    moves = moves[moves["tag"] <= as_of]
+    sign = moves["typ"].map({"IN": 1, "OUT": -1})
+    moves = moves.assign(paletten=moves["paletten"] * sign, koli=moves["koli"] * sign)
+    stock = moves.groupby(["lot_id", "location_id"], as_index=False)[["paletten", "koli"]].sum()
+    stock = stock[(stock["paletten"] != 0) | (stock["koli"] != 0)]
+    return stock.sort_values(["lot_id", "location_id"], ignore_index=True)
+
+
+def _as_of(data_dir, as_of: str) -> pd.DataFrame:
+    found = db.get_inventory_as_of(data_dir, as_of)[COLUMNS]
+    return found.sort_values(["lot_id", "location_id"], ignore_index=True)
+
+
+def _snapshot_dates(data_dir) -> list:
+    return [r[0] for r in db.read_transaction(data_dir, lambda con: con.execute(
+        "SELECT snap_date FROM snapshot_dates ORDER BY snap_date").fetchall())]
+
+
+def _assert_matches_replay(data_dir):
+    days = [FIRST_DAY + timedelta(days=n) for n in range(-3, DAYS + 5, 3)]
+    days += [date(2025, m, 1) - timedelta(days=1) for m in range(2, 7)]
+    for day in sorted(set(days)):
+        pd.testing.assert_frame_equal(_as_of(data_dir, day.isoformat()), _replay(data_dir, day.isoformat()),
+                                      check_dtype=False, obj=f"Bestand am {day}")
+
+
+@pytest.fixture
+def history(data_dir):
+    lots, locations = add_master_data(data_dir, items=3, locations=3, lots_per_item=2)
+    rnd = random.Random(12)
+    for n in range(DAYS):
+        day = FIRST_DAY + timedelta(days=n)
+        lines = [(rnd.choice(lots), rnd.choice(locations), rnd.randint(0, 2), rnd.randint(1, 10))
+                 for _ in range(3)]
+        db.book_movements(data_dir, "IN", lines, "Lieferant", "", "", day)
+        if n % 2:
+            # komplette Position wieder auslagern, damit Bestände auch auf 0 fallen
+            lot, loc, p, k = lines[0]
+            db.book_movements(data_dir, "OUT", [(lot, loc, p, k)], "Kunde", "", "", day)
+    return data_dir
+
+
+def test_without_snapshots_replays_everything(history):
+    assert _snapshot_dates(history) == []
+    _assert_matches_replay(history)
+
+
+def test_snapshots_match_full_replay(history):
+    built = db.build_inventory_snapshots(history, "2025-06-30")
+    assert built == ["2025-01-31", "2025-02-28", "2025-03-31", "2025-04-30", "2025-05-31", "2025-06-30"]
+    assert db.build_inventory_snapshots(history, "2025-06-30") == []
+    _assert_matches_replay(history)
+
+
+def test_backdated_booking_invalidates_later_snapshots(history):
+    db.build_inventory_snapshots(history, "2025-06-30")
+    db.book_movement(history, "IN", 1, 2, 5, 50, "Nachbuchung", "", "", "2025-03-15")
+    assert _snapshot_dates(history) == ["2025-01-31", "2025-02-28"]
+    _assert_matches_replay(history)
+
+    assert db.build_inventory_snapshots(history, "2025-06-30") == [
+        "2025-03-31", "2025-04-30", "2025-05-31", "2025-06-30"]
+    _assert_matches_replay(history)
+
+
+def test_backdated_change_on_snapshot_day(history):
+    db.build_inventory_snapshots(history, "2025-06-30")
+    # Buchung genau am Monatsende gehört in den Snapshot dieses Tages
+    db.book_movement(history, "IN", 2, 1, 0, 7, "Nachbuchung", "", "", "2025-04-30")
+    assert _snapshot_dates(history)[-1] == "2025-03-31"
+    db.build_inventory_snapshots(history, "2025-06-30")
+    _assert_matches_replay(history)
+
+
+def test_backdated_update_and_delete(history):
+    db.build_inventory_snapshots(history, "2025-06-30")
+
+    def rewrite(con):
+        # ältere Bewegung nach hinten verschieben, eine andere löschen
+        con.execute("UPDATE movements SET datum = '2025-05-20', koli = koli + 4 "
+                    "WHERE id = (SELECT MIN(id) FROM movements WHERE datum LIKE '2025-02-%')")
+        con.execute("DELETE FROM movements WHERE id = (SELECT MAX(id) FROM movements WHERE datum LIKE '2025-04-%')")
+    db.write_transaction(history, rewrite)
+    assert _snapshot_dates(history) == ["2025-01-31"]
+    _assert_matches_replay(history)
+    db.build_inventory_snapshots(history, "2025-06-30")
+    _assert_matches_replay(history)
+
+
+def test_legacy_timestamps_migrate_to_day_key(history):
+    def legacy(con):
+        # Stand vor Migration 12: Bewegungen mit Uhrzeit, auch genau am Snapshot-Tag
+        con.execute("DROP TRIGGER trg_movements_date_ins")
+        con.execute("DROP TRIGGER trg_movements_date_upd")
+        con.execute("UPDATE movements SET datum = datum || 'T10:00:00' WHERE id % 2 = 0")
+        con.execute("INSERT INTO movements(typ, lot_id, location_id, paletten, koli, partner, reference, notes,"
+                    " datum, created_at) VALUES ('IN', 1, 1, 1, 9, '', '', '', '2025-03-31T18:30:00', '')")
+        con.execute("PRAGMA user_version=11")
+    db.write_transaction(history, legacy)
+    db.build_inventory_snapshots(history, "2025-06-30")
+    db.close_all_connections()
+    db.init_db(history)
+
+    dates = db.read_transaction(history, lambda con: con.execute(
+        "SELECT COUNT(*) FROM movements WHERE datum IS NOT date(datum)").fetchone()[0])
+    assert dates == 0
+    # die Snapshots kannten Buchungen mit Uhrzeit am Stichtag nicht: ab der ersten
+    # gekürzten Bewegung (Januar) verworfen
+    assert _snapshot_dates(history) == []
+    _assert_matches_replay(history)
+    db.build_inventory_snapshots(history, "2025-06-30")
+    _assert_matches_replay(history)
+
+
+def test_datum_with_time_is_refused_in_sql(history):
+    with pytest.raises(sqlite3.IntegrityError, match=db.DATE_ONLY_MESSAGE):
+        db.write_transaction(history, lambda con: con.execute(
+            "UPDATE movements SET datum = '2025-02-03 08:00' WHERE id = 1"))
+    with pytest.raises(sqlite3.IntegrityError, match=db.DATE_ONLY_MESSAGE):
+        db.write_transaction(history, lambda con: con.execute(
+            "INSERT INTO movements(typ, lot_id, location_id, paletten, koli, datum, created_at)"
+            " VALUES ('IN', 1, 1, 0, 1, '2025-02-30', '')"))
@@ -0,0 +1,127 @@
+"""EXPLAIN QUERY PLAN der häufigen Lese-Abfragen aus src/db.py.
+
+Die Abfragen werden nicht nachgeschrieben, sondern beim Aufruf der db-Funktionen
+samt gebundener Parameter mitgeschnitten und mit denselben Parametern erklärt
+(eingesetzte Literale können einen anderen Plan ergeben, z.B. bei Teilindizes).
+Geprüft wird, dass der erwartete Index benutzt wird und keine Tabelle ganz
+gelesen wird (SCAN ohne Index).
+"""
+import re
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+from src import db
+from conftest import add_master_data
+
+
+@pytest.fixture(scope="module")
+def stocked(tmp_path_factory):
+    """Bestand über 200 Tage; die meisten Positionen sind wieder leer, wie im Betrieb."""
+    data_dir = str(tmp_path_factory.mktemp("plans"))
+    db.init_db(data_dir)
+    lots, locations = add_master_data(data_dir, items=40, locations=60, lots_per_item=5)
+    start = date(2025, 1, 1)
+    positions = [(lot, loc) for lot in lots for loc in locations[::6]]
+    for n in range(0, len(positions), 10):
+        day = (start + timedelta(days=n // 10)).isoformat()
+        chunk = positions[n:n + 10]
+        db.book_movements(data_dir, "IN", [(lot, loc, 1, 10) for lot, loc in chunk],
+                          f"Lieferant {n % 7}", f"WE{n}", "", day)
+        db.book_movements(data_dir, "OUT", [(lot, loc, 1, 10) for lot, loc in chunk[1:]],
+                          f"Kunde {n % 11}", f"LS{n}", "", day)
+    db.add_document(data_dir, 5, "ls.pdf", "/dev/null", "application/pdf", 0)
+    db.build_inventory_snapshots(data_dir, "2025-06-30")
+    # Reservierungen: viele erledigte, eine offene
+    for n in range(200):
+        db.release_reservation(data_dir, db.reserve_stock(data_dir, lots[0], locations[0], 0, 1, f"Kunde {n}"))
+    db.reserve_stock(data_dir, lots[0], locations[0], 0, 1, "Kunde R")
+    # Statistiken wie nach ANALYZE / PRAGMA optimize im Betrieb
+    db.write_transaction(data_dir, lambda con: con.execute("ANALYZE"))
+    yield data_dir
+    db.close_all_connections()
+    db.clear_cache()
+
+
+_statements = []
+
+
+class _RecordingCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        _statements.append((sql, parameters))
+        return super().execute(sql, parameters)
+
+
+class _RecordingConnection(sqlite3.Connection):
+    def cursor(self, factory=_RecordingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+
+@pytest.fixture
+def plans(stocked, monkeypatch):
+    """plans(fn, ...) ruft fn(data_dir, ...) auf und gibt die Pläne seiner SELECTs zurück."""
+    connect = sqlite3.connect
+    monkeypatch.setattr(sqlite3, "connect", lambda *args, **kwargs: connect(
+        *args, factory=_RecordingConnection, **kwargs))
+    db.close_all_connections()
+
+    def run(fn, *args, **kwargs):
+        db.clear_cache()
+        _statements.clear()
+        fn(stocked, *args, **kwargs)
+        selects = [(sql, params) for sql, params in _statements
+                   if sql.lstrip().upper().startswith(("SELECT", "WITH"))]
+        assert selects, f"{fn.__name__}: keine Abfrage mitgeschnitten"
+        with connect(db._db_path(stocked)) as con:
+            return [[row[3] for row in con.execute("EXPLAIN QUERY PLAN " + sql, params)] for sql, params in selects]
+
+    yield run
+    db.close_all_connections()
+
+
+def _full_scans(plan):
+    """Tabellen, die ohne Index ganz gelesen werden (materialisierte Unterabfragen ausgenommen)."""
+    derived = {m.group(1) for line in plan for m in [re.match(r"(?:MATERIALIZE|CO-ROUTINE) (\w+)", line)] if m}
+    return [line for line in plan
+            if re.fullmatch(r"SCAN \w+", line) and line.split()[1] not in derived]
+
+
+HOT_QUERIES = [
+    ("get_lots", db.get_lots, {}, "ux_lots_item_batch_mhd"),
+    ("get_inventory", db.get_inventory, {}, "ix_inventory_nonzero"),
+    ("get_inventory je Lagerplatz", db.get_inventory, {"location_id": 7}, None),
+    ("get_inventory je Artikel", db.get_inventory, {"sku": "SKU003"}, None),
+    ("get_documents_for_movement", db.get_documents_for_movement, {"movement_id": 5}, "ix_documents_movement"),
+    ("query_movements typ+datum", db.query_movements,
+     {"typ": "OUT", "date_from": "2025-03-01", "date_to": "2025-03-31"}, "ix_movements_typ_datum"),
+    ("query_movements datum", db.query_movements,
+     {"date_from": "2025-03-01", "date_to": "2025-03-31"}, "ix_movements_datum"),
+    ("query_movements after_id", db.query_movements, {"after_id": 100, "limit": 50}, None),
+    ("get_movement_report", db.get_movement_report,
+     {"typ": "OUT", "group_by": "sku", "date_from": "2025-03-01", "date_to": "2025-03-31"}, "ix_rollup_typ_day"),
+    ("get_inventory_as_of", db.get_inventory_as_of, {"as_of": "2025-07-10"}, "ix_movements_datum"),
+    ("get_expiry_watchlist", db.get_expiry_watchlist, {"as_of": "2026-01-01", "days": 30}, "ix_lots_mhd"),
+    ("allocate_fefo", db.allocate_fefo, {"order": [(3, 0, 1)]}, "ix_lots_item_mhd"),
+    ("get_reservations", db.get_reservations, {}, "ix_reservations_open"),
+    ("get_stock_by_item", db.get_stock_by_item, {"item_id": 3}, None),
+    ("get_stock_by_location", db.get_stock_by_location, {"location_id": 7}, None),
+]
+
+
+@pytest.mark.parametrize("name, fn, kwargs, index", HOT_QUERIES, ids=[q[0] for q in HOT_QUERIES])
+def test_hot_query_uses_index(plans, name, fn, kwargs, index):
+    found = plans(fn, **kwargs)
+    for plan in found:
+        assert not _full_scans(plan), f"{name}: {plan}"
+    if index:
+        assert any(index in line for plan in found for line in plan), f"{name}: {index} nicht benutzt: {found}"
+
+
+def test_detects_full_scan(plans):
+    # Gegenprobe: Teilstring-Suche auf partner kann keinen Index nutzen
+    found = plans(db.query_movements, partner_like="Kunde 3")
+    assert any(_full_scans(plan) for plan in found)
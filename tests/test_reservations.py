@@ -0,0 +1,113 @@
+"""Reservierungen: kein Überbuchen, reservierter Bestand = Summe der offenen Reservierungen."""
+import threading
+
+import pytest
+
+from src import db
+from conftest import add_master_data
+
+STOCK_KOLI = 10
+
+
+@pytest.fixture(params=[True, False], ids=["schreibthread", "direkt"])
+def stocked(request, data_dir):
+    saved = db.WRITER_THREAD
+    db.configure_connections(writer_thread=request.param)
+    add_master_data(data_dir, items=1, locations=2, lots_per_item=1)
+    db.book_movement(data_dir, "IN", 1, 1, 0, STOCK_KOLI, "Lieferant", "", "", "2026-03-01")
+    yield data_dir
+    db.configure_connections(writer_thread=saved)
+
+
+def _reserved(data_dir) -> tuple:
+    return db.read_transaction(data_dir, lambda con: con.execute(
+        "SELECT reserved_paletten, reserved_koli FROM inventory WHERE lot_id = 1 AND location_id = 1").fetchone())
+
+
+def _open_sum(data_dir) -> tuple:
+    return db.read_transaction(data_dir, lambda con: con.execute(
+        "SELECT COALESCE(SUM(paletten), 0), COALESCE(SUM(koli), 0) FROM reservations "
+        "WHERE status = 'offen' AND lot_id = 1 AND location_id = 1").fetchone())
+
+
+def _assert_reserved_matches(data_dir):
+    assert _reserved(data_dir) == _open_sum(data_dir)
+
+
+def _make_overdue(data_dir, res_id):
+    db.write_transaction(data_dir, lambda con: con.execute(
+        "UPDATE reservations SET expires_at = '2000-01-01T00:00:00' WHERE id = ?", (res_id,)))
+
+
+def test_concurrent_reservations_never_overbook(stocked):
+    start = threading.Barrier(3 * STOCK_KOLI)
+    ids, refused = [], []
+
+    def reserve(n):
+        start.wait()
+        try:
+            ids.append(db.reserve_stock(stocked, 1, 1, 0, 1, f"Kunde {n}", ""))
+        except db.BookingError:
+            refused.append(n)
+    threads = [threading.Thread(target=reserve, args=(n,)) for n in range(3 * STOCK_KOLI)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    assert len(ids) == STOCK_KOLI and len(refused) == 2 * STOCK_KOLI
+    assert _reserved(stocked) == (0, STOCK_KOLI)
+    _assert_reserved_matches(stocked)
+
+
+def test_reserved_follows_commit_release_and_expiry(stocked):
+    first = db.reserve_stock(stocked, 1, 1, 0, 3, "Kunde A", "")
+    second = db.reserve_stock(stocked, 1, 1, 0, 2, "Kunde B", "")
+    third = db.reserve_stock(stocked, 1, 1, 0, 4, "Kunde C", "")
+    assert _reserved(stocked) == (0, 9)
+    _assert_reserved_matches(stocked)
+
+    mid = db.commit_reservation(stocked, first, "2026-03-02")
+    assert _reserved(stocked) == (0, 6)
+    _assert_reserved_matches(stocked)
+    inv = db.get_inventory(stocked)
+    assert inv.loc[(inv["lot_id"] == 1) & (inv["location_id"] == 1), "koli"].item() == STOCK_KOLI - 3
+    assert db.get_reservations(stocked, status="gebucht")["movement_id"].tolist() == [mid]
+
+    db.release_reservation(stocked, second)
+    assert _reserved(stocked) == (0, 4)
+    _assert_reserved_matches(stocked)
+
+    _make_overdue(stocked, third)
+    assert db.get_reservations(stocked, status="abgelaufen")["id"].tolist() == [third]
+    assert db.expire_reservations(stocked) == 1
+    assert _reserved(stocked) == (0, 0)
+    _assert_reserved_matches(stocked)
+    assert db.expire_reservations(stocked) == 0
+
+
+def test_out_refuses_reserved_stock(stocked):
+    db.reserve_stock(stocked, 1, 1, 0, 8, "Kunde A", "")
+    with pytest.raises(db.BookingError, match="reserviert"):
+        db.book_movement(stocked, "OUT", 1, 1, 0, 3, "Kunde B", "", "", "2026-03-02")
+    with pytest.raises(db.BookingError):
+        db.book_fefo(stocked, [(1, 0, 3)], "Kunde B", "", "", "2026-03-02")
+    # der freie Rest geht
+    db.book_movement(stocked, "OUT", 1, 1, 0, 2, "Kunde B", "", "", "2026-03-02")
+    with pytest.raises(db.BookingError):
+        db.book_movement(stocked, "OUT", 1, 1, 0, 1, "Kunde B", "", "", "2026-03-02")
+    assert _reserved(stocked) == (0, 8)
+    _assert_reserved_matches(stocked)
+
+
+def test_commit_of_expired_reservation_is_refused(stocked):
+    res_id = db.reserve_stock(stocked, 1, 1, 0, 4, "Kunde A", "")
+    _make_overdue(stocked, res_id)
+    with pytest.raises(db.BookingError, match="abgelaufen"):
+        db.commit_reservation(stocked, res_id, "2026-03-02")
+    assert db.get_movements(stocked)["typ"].tolist() == ["IN"]
+    # nach dem Aufräumen bleibt sie abgelaufen und der Bestand ist wieder frei
+    db.expire_reservations(stocked)
+    with pytest.raises(db.BookingError, match="nicht mehr offen"):
+        db.commit_reservation(stocked, res_id, "2026-03-02")
+    assert _reserved(stocked) == (0, 0)
+    db.book_movement(stocked, "OUT", 1, 1, 0, STOCK_KOLI, "Kunde B", "", "", "2026-03-02")
@@ -0,0 +1,188 @@
+"""Schreib-Thread (db._Writer): Group Commit, Savepoints, Gegendruck, Schließen."""
+import threading
+
+import pytest
+
+from src import db, archive
+
+
+@pytest.fixture
+def settings():
+    """Stellt die Verbindungs-Einstellungen nach dem Test wieder her."""
+    saved = {"busy_timeout_ms": db.BUSY_TIMEOUT_MS, "write_queue_size": db.WRITE_QUEUE_SIZE,
+             "group_commit_max": db.GROUP_COMMIT_MAX, "writer_thread": db.WRITER_THREAD}
+    yield
+    db.configure_connections(**saved)
+
+
+def _items(data_dir) -> set:
+    return set(db.get_items(data_dir)["sku"])
+
+
+def _insert(sku):
+    def job(con):
+        con.execute("INSERT INTO items(sku, name, created_at) VALUES (?, ?, '')", (sku, sku))
+        return sku
+    return job
+
+
+def _block_writer(data_dir):
+    """Hält den Schreib-Thread in einem Auftrag fest, bis das Event gesetzt wird."""
+    entered, release = threading.Event(), threading.Event()
+
+    def job(con):
+        entered.set()
+        release.wait(5)
+    thread = threading.Thread(target=db.write_transaction, args=(data_dir, job))
+    thread.start()
+    assert entered.wait(5)
+    return release, thread
+
+
+def _submit_all(data_dir, jobs):
+    """Reiht alle Aufträge ein, während der Schreib-Thread blockiert ist; gibt Ergebnisse/Fehler zurück."""
+    results = [None] * len(jobs)
+
+    def run(n, job):
+        try:
+            results[n] = db.write_transaction(data_dir, job)
+        except Exception as e:
+            results[n] = e
+    threads = [threading.Thread(target=run, args=(n, job)) for n, job in enumerate(jobs)]
+    for t in threads:
+        t.start()
+    return threads, results
+
+
+def _wait_queued(data_dir, n):
+    writer = db._writer(data_dir)
+    for _ in range(500):
+        if writer._queue.qsize() >= n:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("Aufträge nicht eingereiht")
+
+
+def test_failing_job_only_discards_itself(data_dir):
+    def failing(con):
+        con.execute("INSERT INTO items(sku, name, created_at) VALUES ('KAPUTT', 'x', '')")
+        raise db.BookingError("nicht genug Bestand")
+
+    release, blocker = _block_writer(data_dir)
+    before = db.writer_stats()
+    threads, results = _submit_all(data_dir, [_insert("A"), failing, _insert("B"), _insert("C")])
+    _wait_queued(data_dir, 4)
+    release.set()
+    for t in threads + [blocker]:
+        t.join(5)
+    assert results[0] == "A" and results[2] == "B" and results[3] == "C"
+    assert isinstance(results[1], db.BookingError)
+    assert _items(data_dir) == {"A", "B", "C"}
+    # Blocker und die vier Aufträge: zwei Commits
+    after = db.writer_stats()
+    assert after["commits"] - before["commits"] == 2
+    assert after["jobs"] - before["jobs"] == 4
+
+
+def test_job_ending_transaction_reruns_the_others(data_dir):
+    def rollback_all(con):
+        con.execute("ROLLBACK")
+        raise db.BookingError("Transaktion beendet")
+
+    release, blocker = _block_writer(data_dir)
+    threads, results = _submit_all(data_dir, [_insert("A"), _insert("B"), rollback_all, _insert("C")])
+    _wait_queued(data_dir, 4)
+    release.set()
+    for t in threads + [blocker]:
+        t.join(5)
+    assert isinstance(results[2], db.BookingError)
+    assert _items(data_dir) == {"A", "B", "C"}
+
+
+def test_nested_write_runs_inline(data_dir):
+    threads = []
+
+    def outer(con):
+        threads.append(threading.current_thread())
+        db.add_item(data_dir, "INNEN", "verschachtelt")
+        db.write_transaction(data_dir, lambda c: threads.append(threading.current_thread()))
+        assert con.execute("SELECT COUNT(*) FROM items WHERE sku = 'INNEN'").fetchone()[0] == 1
+        raise db.BookingError("alles zurück")
+
+    with pytest.raises(db.BookingError):
+        db.write_transaction(data_dir, outer)
+    assert threads[0] is threads[1] and threads[0] is not threading.current_thread()
+    # innerer Aufruf lief in derselben Transaktion und wurde mit verworfen
+    assert _items(data_dir) == set()
+
+
+def test_write_transaction_callbacks(data_dir):
+    def guarded(con):
+        if not con.in_transaction:
+            con.execute("BEGIN IMMEDIATE")
+        return con.execute("INSERT INTO items(sku, name, created_at) VALUES ('X', 'x', '')").rowcount
+
+    assert db.write_transaction(data_dir, guarded) == 1
+    # Periodenabschluss der Archivierung läuft ebenfalls über write_transaction
+    db.write_transaction(data_dir, archive._close_period, "2020-12-31")
+    assert db.get_archive_cutoff(data_dir) == "2020-12-31"
+    assert _items(data_dir) == {"X"}
+
+
+def test_full_queue_raises(data_dir, settings):
+    db.configure_connections(write_queue_size=1, busy_timeout_ms=100)
+    release, blocker = _block_writer(data_dir)
+    threads, results = _submit_all(data_dir, [_insert("A")])
+    _wait_queued(data_dir, 1)
+    with pytest.raises(db.WriteQueueFull):
+        db.write_transaction(data_dir, _insert("B"))
+    release.set()
+    for t in threads + [blocker]:
+        t.join(5)
+    assert _items(data_dir) == {"A"}
+
+
+def test_close_while_writing_loses_no_job(data_dir):
+    stop = threading.Event()
+    done, errors = [], []
+
+    def session(n):
+        k = 0
+        while not stop.is_set():
+            try:
+                done.append(db.write_transaction(data_dir, _insert(f"S{n}-{k}")))
+            except Exception as e:
+                errors.append(e)
+            k += 1
+
+    threads = [threading.Thread(target=session, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for _ in range(30):
+        db.close_all_connections()
+    stop.set()
+    for t in threads:
+        t.join(10)
+    assert not any(t.is_alive() for t in threads), "Aufrufer hängt in result()"
+    assert errors == []
+    assert _items(data_dir) == set(done)
+
+
+def test_job_for_closed_writer_goes_to_the_next(data_dir, monkeypatch):
+    stale = db._writer(data_dir)
+    db.close_all_connections()
+    # Aufrufer hat den Schreib-Thread vor close() nachgeschlagen
+    lookup, calls = db._writer, []
+
+    def stale_first(d):
+        calls.append(d)
+        return stale if len(calls) == 1 else lookup(d)
+    monkeypatch.setattr(db, "_writer", stale_first)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(db.write_transaction(data_dir, _insert("A"))),
+                              daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive(), "Aufrufer hängt in result()"
+    assert result == ["A"] and len(calls) == 2
+    assert _items(data_dir) == {"A"}